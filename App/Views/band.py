@@ -1,20 +1,30 @@
-from collections import defaultdict
-from datetime import datetime, timedelta
+import json
+import queue
+from datetime import date, datetime
 
-from flask import render_template, request, redirect, url_for, flash, abort
+from flask import Response, render_template, request, redirect, url_for, flash, abort, jsonify, stream_with_context
 from flask_login import login_required, current_user
 
-from App.db.schedule import ScheduleDatabaseManager
 from ..app_init_ import app
+from ..db.base import primary_reads
 from ..db.user import  UserDatabaseManager
 from ..db.band import  BandDatabaseManager
+from ..db.snapshot import SnapshotDatabaseManager
+from ..db.conflict import conflict_index
+from ..archive import availability_page, band_schedules, build_snapshot, snapshot_page
+from ..jobs import enqueue
+from ..joins import add_member
+from ..live import broadcaster
+from ..recommend import AvailabilityIndex, top_recommendations
 
+from const import BAND_SNAPSHOT_RELEASE_ROWS, STREAM_POLL_SECONDS
 
 
-def daterange(start_date, end_date):
-  """指定された開始日から終了日までの日付を生成するジェネレータ"""
-  for n in range(int((end_date - start_date).days) + 1):
-    yield start_date + timedelta(n)
+# バンド一覧で1回に表示するバンドの数
+BANDS_PAGE_SIZE = 20
+
+# ストリームが無通信で切断されないように送るハートビートの間隔(秒)
+STREAM_HEARTBEAT_SECONDS = 20
 
 
 @app.route("/band-gen", methods=["GET", "POST"])
@@ -74,14 +84,64 @@ def bands_list():
   if not user:
     return redirect(url_for("logout"))
 
+  # 最初は未アーカイブのバンドを1ページ分だけ描画し、続きとアーカイブ済みのバンドはボタンで読み込む
   band_db = BandDatabaseManager()
-  bands = band_db.get_bands(user_id=user.id)
-  users_dict = {
-    band.id: ", ".join([user.name for user in band_db.get_users(band.id)])
-    for band in bands
-  }
+  bands, users_dict, next_cursor = _band_page(band_db, user.id, archived=False, after=None)
+  has_archived = bool(band_db.get_bands(user.id, archived=True, limit=1))
+
+  return render_template(
+    "band/bands.html", bands=bands, users_dict=users_dict,
+    next_cursor=next_cursor, has_archived=has_archived,
+  )
 
-  return render_template("band/bands.html", bands=bands, users_dict=users_dict)
+
+@app.route("/bands/page")
+@login_required
+def bands_page():
+  """バンド一覧の続き (または、アーカイブ済みのバンド) を1ページ分返す"""
+  user_db = UserDatabaseManager()
+  user = user_db.get_user(email=current_user.get_id())
+  if not user:
+    return jsonify({"status": "error", "message": "User not found"}), 404
+
+  archived = request.args.get("archived") == "1"
+  after = None
+  if request.args.get("after"):
+    after = _parse_cursor(request.args["after"])
+    if after is None:
+      return jsonify({"status": "error", "message": "Invalid cursor"}), 400
+
+  bands, users_dict, next_cursor = _band_page(BandDatabaseManager(), user.id, archived, after)
+  html = render_template("band/band-cards.html", bands=bands, users_dict=users_dict)
+  return jsonify({"status": "success", "html": html, "next": next_cursor})
+
+
+def _band_page(
+  band_db: BandDatabaseManager, user_id: int, archived: bool, after: tuple[date, int] | None,
+) -> tuple[list, dict[int, str], str | None]:
+  """
+  バンド一覧の1ページ分を取得する。(バンド, {バンドID: メンバー名}, 次のページのカーソル) を返す。
+  次のページがあるかを知るため、1件多く取得する。
+  """
+  bands = band_db.get_bands(user_id, archived=archived, limit=BANDS_PAGE_SIZE + 1, after=after)
+  next_cursor = None
+  if len(bands) > BANDS_PAGE_SIZE:
+    bands = bands[:BANDS_PAGE_SIZE]
+    next_cursor = f"{bands[-1].end_date.isoformat()}_{bands[-1].id}"
+
+  # メンバー名はバンドごとではなく、ページ全体で1回のクエリで取得する
+  member_names = band_db.get_member_names([band.id for band in bands])
+  users_dict = {band.id: ", ".join(member_names.get(band.id, [])) for band in bands}
+  return bands, users_dict, next_cursor
+
+
+def _parse_cursor(cursor: str) -> tuple[date, int] | None:
+  """"YYYY-MM-DD_バンドID" 形式のカーソルを (終了日, バンドID) にする"""
+  try:
+    end_date, band_id = cursor.split("_")
+    return date.fromisoformat(end_date), int(band_id)
+  except ValueError:
+    return None
 
 
 @app.route("/band")
@@ -97,39 +157,10 @@ def band():
   if not band:
     abort(404, "指定されたバンドが見つかりません。")
 
-  members = band_db.get_users(band.id)
-  total_members = len(members)
-  member_map = {member.id: member.name for member in members}
-
-  schedule_db = ScheduleDatabaseManager()
-  schedules = schedule_db.get_schedules(band_id=band.id)
-
-  # 日付と時間ごとの参加可能人数とメンバー名を集計
-  schedules_agg = defaultdict(lambda: defaultdict(int))
-  schedules_detail = defaultdict(lambda: defaultdict(list))
-  user_comments = []
-
-  for schedule_obj in schedules:
-    member_name = member_map.get(schedule_obj.user_id)
-    if not member_name:
-      continue
-
-    if schedule_obj.comment:
-      user_comments.append({
-          'name': member_name,
-          'comment': schedule_obj.comment
-      })
-
-    if schedule_obj.schedule:
-      for date_obj, hour_list in schedule_obj.schedule.items():
-        date_str = date_obj.isoformat()
-        for hour, is_available in enumerate(hour_list):
-          if is_available:
-            schedules_agg[date_str][hour] += 1
-            schedules_detail[date_str][hour].append(member_name)
-
-  dates_to_display = list(daterange(band.start_date, band.end_date))
-  times_to_display = range(band.start_time.hour, band.end_time.hour+1)
+  # アーカイブしたバンドは、アーカイブ時に保存したスナップショットから表示する
+  page = snapshot_page(band) if band.archived else None
+  if page is None:
+    page = availability_page(band)
 
   user_db = UserDatabaseManager()
   creator = user_db.get_user(band.creator_user_id)
@@ -139,15 +170,142 @@ def band():
     "band/band.html",
     band=band,
     is_creator=is_creator,
-    dates=dates_to_display,
-    times=list(times_to_display),
-    schedules_agg=schedules_agg,
-    schedules_detail=schedules_detail,
-    total_members=total_members,
-    user_comments=user_comments
+    stream_poll_seconds=STREAM_POLL_SECONDS,
+    **page,
   )
 
 
+def _member_band(token: str | None):
+  """トークンのバンドを返す。ログインユーザーがメンバーでなければ中断する"""
+  if not token:
+    abort(400, "バンドのトークンが必要です。")
+
+  band_db = BandDatabaseManager()
+  band = band_db.get_band(token=token)
+  if not band:
+    abort(404, "指定されたバンドが見つかりません。")
+
+  user_db = UserDatabaseManager()
+  user = user_db.get_user(email=current_user.get_id())
+  if not user or user.id not in {member.id for member in band_db.get_users(band.id)}:
+    abort(403, "このバンドへのアクセス権がありません。")
+  return band
+
+
+@app.route("/band/stream")
+@login_required
+def band_stream():
+  """
+  バンドのページ向けのServer-Sent Eventsのストリーム。
+  メンバーがスケジュールを保存すると、変わったマスの人数とメンバー名だけを送る。
+  """
+  band_id = _member_band(request.args.get('token')).id
+  client = broadcaster.connect(band_id)
+
+  def generate():
+    try:
+      yield "retry: 5000\n\n"
+      while True:
+        try:
+          event = client.get(timeout=STREAM_HEARTBEAT_SECONDS)
+        except queue.Empty:
+          # クライアントが切断されていれば、ここでの書き込みが失敗してストリームが閉じられる
+          yield ": heartbeat\n\n"
+          continue
+        if event is None:
+          # ワーカーの終了中
+          return
+        yield f"event: cells\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+    finally:
+      broadcaster.disconnect(band_id, client)
+
+  response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+  response.headers["Cache-Control"] = "no-cache"
+  # nginxなどのリバースプロキシにバッファリングさせない
+  response.headers["X-Accel-Buffering"] = "no"
+  return response
+
+
+@app.route("/band/cells")
+@login_required
+def band_cells():
+  """ストリームに接続できなかったページがポーリングする、全てのマスの人数とメンバー名"""
+  band_id = _member_band(request.args.get('token')).id
+  snapshot, total = broadcaster.current(band_id)
+  return jsonify({
+    "status": "success",
+    "total_members": total,
+    "cells": [
+      {"date": date_str, "hour": hour, "count": len(names), "members": list(names)}
+      for (date_str, hour), names in snapshot.items()
+    ],
+  })
+
+
+@app.route("/band/recommend")
+@login_required
+def band_recommend():
+  """メンバーの空き状況から、バンド練におすすめの枠を参加可能人数の多い順に返す"""
+  token = request.args.get('token')
+  if not token:
+    return jsonify({"status": "error", "message": "Token is required"}), 400
+
+  try:
+    lengths = [int(x) for x in request.args.get('length', '1').split(',') if x]
+    top_k = min(int(request.args.get('top', 10)), 50)
+    min_count = int(request.args.get('min', 1))
+    required_ids = [int(x) for x in request.args.get('required', '').split(',') if x]
+  except ValueError:
+    return jsonify({"status": "error", "message": "Invalid parameters"}), 400
+
+  band_db = BandDatabaseManager()
+  band = band_db.get_band(token=token)
+  if not band:
+    return jsonify({"status": "error", "message": "Band not found"}), 404
+
+  members = band_db.get_users(band.id)
+  member_map = {member.id: member.name for member in members}
+
+  user_db = UserDatabaseManager()
+  user = user_db.get_user(email=current_user.get_id())
+  if not user or user.id not in member_map:
+    return jsonify({"status": "error", "message": "Permission denied"}), 403
+
+  index = AvailabilityIndex(band.start_date, band.end_date, band.start_time.hour, band.end_time.hour)
+
+  # アーカイブ時に行を削除したバンドでは、スナップショットに含めた行を使う
+  for schedule_obj in band_schedules(band):
+    if schedule_obj.user_id == 0:
+      index.add_busy(schedule_obj.schedule)
+    elif schedule_obj.user_id in member_map:
+      index.add_member(schedule_obj.user_id, schedule_obj.schedule)
+
+  # 他のバンドのバンド練と重なる時間は、そのメンバーは参加できないものとして扱う
+  for member_id, slots in conflict_index.conflicts(list(index.members), band.id).items():
+    index.add_conflicts(member_id, slots)
+
+  recommendations = top_recommendations(
+    index, [length for length in lengths if 1 <= length <= 24],
+    top_k=top_k, required_ids=required_ids, min_count=min_count
+  )
+
+  return jsonify({
+    "status": "success",
+    "total_members": len(members),
+    "recommendations": [
+      {
+        "date": r.day.isoformat(),
+        "start_hour": r.start_hour,
+        "end_hour": r.start_hour + r.length,
+        "count": r.count,
+        "members": [member_map[user_id] for user_id in r.member_ids],
+        "missing": [name for user_id, name in member_map.items() if user_id not in r.member_ids],
+      }
+      for r in recommendations
+    ]
+  })
+
+
 @app.route("/join")
 @login_required
 def join_band():
@@ -156,18 +314,21 @@ def join_band():
   if not token:
     abort(400, "招待トークンが必要です。")
 
-  band_db = BandDatabaseManager()
-  band = band_db.get_band(token=token)
+  # 招待リンクが共有されると参加が集中するため、トークンとユーザーはキャッシュから引き、
+  # メンバーの追加は1つの文 (既にメンバーなら何もしない) で行う
+  band = BandDatabaseManager().get_band(token=token)
   if not band:
     abort(404, "指定されたバンドが見つかりません。")
 
-  user_db = UserDatabaseManager()
-  user = user_db.get_user(email=current_user.get_id())
+  user = UserDatabaseManager().get_user(email=current_user.get_id())
   if not user:
     return redirect(url_for("logout"))
 
-  if band_db.add_member(user.id, band.id):
+  joined = add_member(user.id, band.id)
+  if joined:
     flash(f"バンド「{band.name}」に参加しました！", "success")
+  elif joined is None:
+    flash("参加中にエラーが発生しました。もう一度お試しください。", "error")
   else:
     flash(f"すでにバンド「{band.name}」のメンバーです。", "info")
 
@@ -265,7 +426,13 @@ def band_archive():
   if not user or not band:
     abort(404)
 
-  band_db.update_band_archive_status(band.id, archive=True)
+  if band_db.update_band_archive_status(band.id, archive=True):
+    # アーカイブ中は表示するだけなので、集計結果を保存しておく (失敗しても現在のデータから表示できる)
+    # アーカイブ後の保存は断られるので、プライマリから読めばアーカイブまでに保存された行が全て入る
+    with primary_reads():
+      snapshot = build_snapshot(band)
+    if snapshot is not None:
+      SnapshotDatabaseManager().save(band.id, snapshot, release_rows=BAND_SNAPSHOT_RELEASE_ROWS)
 
   flash(f"バンド「{band.name}」をアーカイブしました。", "success")
   return redirect(url_for('bands_list'))
@@ -287,6 +454,10 @@ def band_unarchive():
   if not user or not band:
     abort(404)
 
+  # スナップショットを削除し、アーカイブ時に削除した行があれば戻してから解除する
+  if not SnapshotDatabaseManager().restore(band.id):
+    flash("アーカイブの解除に失敗しました。もう一度お試しください。", "error")
+    return redirect(url_for('band', token=token))
   band_db.update_band_archive_status(band.id, archive=False)
 
   flash(f"バンド「{band.name}」のアーカイブを解除しました。", "success")
@@ -313,6 +484,11 @@ def band_delete():
   if band.creator_user_id != user.id:
     abort(403, "このバンドを削除する権限がありません。")
 
-  band_db.delete_band(band.id)
-  flash(f"バンド「{band.name}」を削除しました。", "success")
+  # メンバーやスケジュールが多いバンドでも待たせないよう、削除はバックグラウンドで行う
+  job = enqueue("delete_band", {"band_id": band.id}, idempotency_key=f"delete_band:{band.id}", created_by=user.id)
+  if not job:
+    flash("バンドの削除に失敗しました。もう一度お試しください。", "error")
+    return redirect(url_for('band', token=token))
+
+  flash(f"バンド「{band.name}」を削除しています。しばらくすると一覧から消えます。", "success")
   return redirect(url_for('bands_list'))
\ No newline at end of file
@@ -5,8 +5,11 @@ from flask_login import current_user, login_required
 
 from ..app_init_ import app
 from ..db.band import BandDatabaseManager
+from ..db.conflict import conflict_index
 from ..db.schedule import ScheduleDatabaseManager
 from ..db.user import UserDatabaseManager
+from ..grid import checkbox_rows, date_headers, practice_color, practice_rows
+from ..ratelimit import save_limiter, too_many_requests
 
 
 
@@ -31,8 +34,7 @@ def band_practice():
     flash("ユーザー情報が見つかりません。", "error")
     return redirect(url_for("top"))
 
-  bands_list = band_db_manager.get_bands(user.id)
-  user_bands = [band for band in bands_list if not band.archived]
+  user_bands = band_db_manager.get_bands(user.id, archived=False)
 
   # クエリパラメータから表示対象を取得 ("view" または band_id)
   selected_band_id_str = request.args.get("band_id", "view")
@@ -56,26 +58,27 @@ def band_practice():
     # --- 閲覧モード ---
     band_schedules = {}
     band_colors = {}
-    colors = ["#ffadad", "#a5dfff", "#b6ffbc", "#ffe3bf", "#a79bff", "#ffa0b6", "#bdb2ff", "#ffc6ff"]
+
+    # 全バンドのバンド練(user_id=0)のスケジュールだけを1クエリで取得する (メンバーの行は読まない)
+    practice_by_band = {
+      s.band_id: s for s in schedule_db_manager.get_practice_schedules([band.id for band in user_bands])
+    }
 
     for i, band in enumerate(user_bands):
-      schedules = schedule_db_manager.get_schedules(band_id=band.id)
-      # user_id=0 のスケジュール(バンド練)を探す
-      schedule_obj = next((s for s in schedules if s.user_id == 0), None)
+      schedule_obj = practice_by_band.get(band.id)
 
       if schedule_obj and schedule_obj.schedule:
         schedule_str_keys = {d.isoformat(): v for d, v in schedule_obj.schedule.items()}
         band_schedules[band.id] = schedule_str_keys
-      band_colors[band.id] = colors[i % len(colors)]
+      band_colors[band.id] = practice_color(i)
 
+    headers = date_headers(dates_to_display)
     return render_template(
       "band-practice/band-practice.html",
       bands=user_bands,
       selected_band_id="view",
-      dates=dates_to_display,
-      times=list(times_to_display),
-      band_schedules=band_schedules,
-      band_colors=band_colors,
+      headers=headers,
+      rows=practice_rows(headers, times_to_display, user_bands, band_schedules, band_colors),
       view_mode=True
     )
   else:
@@ -89,23 +92,29 @@ def band_practice():
     if not selected_band:
       abort(403, "このバンドへのアクセス権がありません。")
 
-    schedules = schedule_db_manager.get_schedules(band_id=selected_band_id)
-    schedule_obj = next((s for s in schedules if s.user_id == 0), None)
+    # バンド練(user_id=0)の行だけを取得する
+    schedules = schedule_db_manager.get_schedules(user_id=0, band_ids=[selected_band_id])
+    schedule_obj = schedules[0] if schedules else None
     current_schedule = schedule_obj.schedule if schedule_obj else {}
 
     current_schedule_str_keys = {d.isoformat(): v for d, v in current_schedule.items()}
 
+    # メンバーが所属する他のバンドのバンド練と重なる枠を、日付と時間ごとに集計
+    member_map = {member.id: member.name for member in band_db_manager.get_users(selected_band_id)}
+    conflict_data = {}
+    for (date_obj, hour), user_ids in conflict_index.conflicts_by_slot(list(member_map), selected_band_id).items():
+      conflict_data.setdefault(date_obj.isoformat(), {})[hour] = [member_map[user_id] for user_id in user_ids]
+
     # 表示範囲を該当バンドの期間に限定
-    dates_to_display = list(daterange(selected_band.start_date, selected_band.end_date))
+    headers = date_headers(daterange(selected_band.start_date, selected_band.end_date))
     times_to_display = range(selected_band.start_time.hour, selected_band.end_time.hour + 1)
 
     return render_template(
       "band-practice/band-practice.html",
       bands=user_bands,
       selected_band_id=selected_band_id,
-      dates=dates_to_display,
-      times=list(times_to_display),
-      schedule_data=current_schedule_str_keys,
+      headers=headers,
+      rows=checkbox_rows(headers, times_to_display, current_schedule_str_keys, conflict_data),
       view_mode=False
     )
 
@@ -122,8 +131,8 @@ def save_band_practice():
   if not user:
     return jsonify({"status": "error", "message": "User not found"}), 404
 
-  data = request.get_json()
-  if not data or "schedule" not in data or "band_id" not in data:
+  data = request.get_json(silent=True)
+  if not data or not isinstance(data.get("schedule"), dict) or "band_id" not in data:
     return jsonify({"status": "error", "message": "Invalid data"}), 400
 
   try:
@@ -131,8 +140,13 @@ def save_band_practice():
   except (ValueError, TypeError):
     return jsonify({"status": "error", "message": "Invalid band ID"}), 400
 
-  # ユーザーがそのバンドに所属しているか検証
-  user_bands_ids = [b.id for b in band_db_manager.get_bands(user.id)]
+  # 保存が集中したときは、所属の確認やDBへの書き込みの前に断る (不正なリクエストでは保存の枠を使わない)
+  admission = save_limiter.admit(user.id)
+  if not admission.allowed:
+    return too_many_requests(admission)
+
+  # ユーザーがそのバンドに所属しているか検証 (アーカイブしたバンドはスナップショットと食い違わないよう編集させない)
+  user_bands_ids = [b.id for b in band_db_manager.get_bands(user.id, archived=False)]
   if band_id not in user_bands_ids:
     return jsonify({"status": "error", "message": "Permission denied"}), 403
 
@@ -147,6 +161,15 @@ def save_band_practice():
         continue
 
   # user_id=0 でバンド練のスケジュールを更新
-  schedule_db_manager.update_schedule(user_id=0, schedule=schedule_to_save, band_id=band_id, comment="")
-
-  return jsonify({"status": "success", "message": "Band practice schedule updated."})
\ No newline at end of file
+  if not schedule_db_manager.update_schedule(user_id=0, schedule=schedule_to_save, band_id=band_id, comment=""):
+    # 所属の確認の後にアーカイブされた場合は 409 (再試行しても保存できない)、それ以外は 500
+    band = band_db_manager.get_band(band_id=band_id)
+    if band and band.archived:
+      return jsonify({"status": "error", "message": "Band is archived"}), 409
+    return jsonify({"status": "error", "message": "Failed to save band practice"}), 500
+
+  return jsonify({
+    "status": "success",
+    "message": "Band practice schedule updated.",
+    "next_save_ms": admission.next_save_ms,
+  })
\ No newline at end of file
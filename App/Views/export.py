@@ -0,0 +1,144 @@
+from datetime import date, datetime, time, timedelta, timezone
+
+from flask import Response, abort, request, stream_with_context
+from flask_login import current_user, login_required
+
+from ..app_init_ import app
+from ..archive import band_schedules
+from ..db.band import Band, BandDatabaseManager
+from ..db.base import primary_reads
+from ..db.cache import FeedEntry, feed_cache
+from ..db.schedule import ScheduleDatabaseManager
+from ..db.user import UserDatabaseManager
+from ..export import availability_csv, ics_calendar, load_feed_token, practice_blocks, practice_csv
+
+
+# カレンダーフィードに含める過去のバンド練の日数
+FEED_PAST_DAYS = 30
+
+
+def daterange(start_date, end_date):
+  """指定された開始日から終了日までの日付を1日ずつ生成する。"""
+  for n in range(int((end_date - start_date).days) + 1):
+    yield start_date + timedelta(n)
+
+
+def _get_member_band() -> tuple[Band, dict[int, str]]:
+  """クエリパラメータのトークンからバンドを取得し、ログインユーザーがメンバーであることを確認する"""
+  token = request.args.get('token')
+  if not token:
+    abort(400, "バンドのトークンが必要です。")
+
+  band_db = BandDatabaseManager()
+  band = band_db.get_band(token=token)
+  if not band:
+    abort(404, "指定されたバンドが見つかりません。")
+
+  member_map = {member.id: member.name for member in band_db.get_users(band.id)}
+
+  user = UserDatabaseManager().get_user(email=current_user.get_id())
+  if not user or user.id not in member_map:
+    abort(403, "このバンドへのアクセス権がありません。")
+
+  return band, member_map
+
+
+def _practice_blocks(band: Band):
+  """バンド練のスケジュール(user_id=0)をブロック単位で返すジェネレータ"""
+  for schedule_obj in band_schedules(band, user_id=0):
+    yield from practice_blocks(band.id, band.name, schedule_obj.schedule)
+
+
+def _attachment(body, mimetype: str, filename: str) -> Response:
+  """ジェネレータをそのままストリーミングで返すレスポンスを作る"""
+  response = Response(stream_with_context(body), mimetype=mimetype)
+  response.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+  return response
+
+
+@app.route("/band/export/availability.csv")
+@login_required
+def export_availability_csv():
+  """メンバーの参加可否をCSVでエクスポートする"""
+  band, member_map = _get_member_band()
+
+  dates = list(daterange(band.start_date, band.end_date))
+  hours = list(range(band.start_time.hour, band.end_time.hour + 1))
+  # アーカイブ時に行を削除したバンドでは、スナップショットに含めた行を使う
+  schedules = band_schedules(band)
+
+  return _attachment(
+    availability_csv(dates, hours, member_map, schedules),
+    "text/csv", f"band-{band.id}-availability.csv"
+  )
+
+
+@app.route("/band/export/practice.csv")
+@login_required
+def export_practice_csv():
+  """バンド練のスケジュールをCSVでエクスポートする"""
+  band, _ = _get_member_band()
+  return _attachment(
+    practice_csv(_practice_blocks(band)),
+    "text/csv", f"band-{band.id}-practice.csv"
+  )
+
+
+@app.route("/band/export/practice.ics")
+@login_required
+def export_practice_ics():
+  """バンド練のスケジュールをiCalendar形式でエクスポートする"""
+  band, _ = _get_member_band()
+  return _attachment(
+    ics_calendar(band.name, _practice_blocks(band)),
+    "text/calendar", f"band-{band.id}-practice.ics"
+  )
+
+
+def _build_feed(user_id: int) -> FeedEntry | None:
+  """
+  ユーザーが所属するバンドのバンド練からフィードを作成してキャッシュする。
+  DBのエラーで読めなかった場合は、空のカレンダーをキャッシュしないよう None を返す。
+  """
+  generation = feed_cache.begin()
+  today = date.today()
+  # キャッシュするので、レプリカの遅延で古い内容にならないようプライマリから読む
+  with primary_reads():
+    rows = ScheduleDatabaseManager().get_feed_practices(user_id)
+  if rows is None:
+    return None
+
+  since = today - timedelta(days=FEED_PAST_DAYS)
+  blocks = []
+  for row in rows:
+    blocks.extend(
+      block for block in practice_blocks(row["band_id"], row["name"], row["schedule"])
+      if block.day >= since
+    )
+  blocks.sort(key=lambda block: (block.day, block.start_hour, block.band_id))
+
+  # DTSTAMPを作った日の0時に固定し、同じ内容なら再作成しても・どのワーカーで作ってもETagが変わらないようにする
+  stamp = datetime.combine(today, time(), timezone.utc)
+  body = "".join(ics_calendar("Jappy バンド練", blocks, stamp)).encode("utf-8")
+  return feed_cache.put(user_id, body, frozenset(row["band_id"] for row in rows), today, generation)
+
+
+@app.route("/feed/<token>.ics")
+def calendar_feed(token: str):
+  """
+  ユーザーが所属する全バンドのバンド練を、カレンダーアプリの購読用に返す。
+  キャッシュがあればDBにはアクセスせず、If-None-Matchが一致すれば304を返す。
+  """
+  user_id = load_feed_token(token)
+  if user_id is None:
+    abort(404)
+
+  entry = feed_cache.get(user_id) or _build_feed(user_id)
+  if entry is None:
+    # 空のカレンダーを返すと購読側の予定が消えるので、後で再取得してもらう
+    abort(503)
+
+  response = Response(entry.body, mimetype="text/calendar")
+  response.set_etag(entry.etag)
+  response.headers["Cache-Control"] = "private, no-cache"
+  return response.make_conditional(request)
@@ -0,0 +1,31 @@
+from flask import jsonify
+from flask_login import current_user, login_required
+
+from ..app_init_ import app
+from ..db.job import JobDatabaseManager
+from ..db.user import UserDatabaseManager
+
+
+@app.route("/jobs/<int:job_id>")
+@login_required
+def job_status(job_id: int):
+  """バックグラウンドジョブの状態を返す (登録したユーザーだけが確認できる)"""
+  user = UserDatabaseManager().get_user(email=current_user.get_id())
+  if not user:
+    return jsonify({"status": "error", "message": "User not found"}), 404
+
+  job = JobDatabaseManager().get_job(job_id)
+  if not job or job.created_by != user.id:
+    return jsonify({"status": "error", "message": "Job not found"}), 404
+
+  return jsonify({
+    "status": "success",
+    "job": {
+      "id": job.id,
+      "kind": job.kind,
+      "state": job.status,
+      "attempts": job.attempts,
+      "max_attempts": job.max_attempts,
+      "error": job.last_error,
+    },
+  })
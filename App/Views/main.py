@@ -1,17 +1,23 @@
-from flask import render_template, request, redirect, url_for, abort, session, flash, send_file
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
+import mimetypes
+import os
+
+from flask import render_template, request, redirect, url_for, abort, session, flash, send_file, send_from_directory
 from flask_login import login_user, logout_user, login_required, current_user
 
 from ..app_init_ import app
-from ..auth import flow, User
+from ..assets import DIST_DIR
+from ..auth import get_flow, User
 from ..db.user import UserDatabaseManager
-from ..db.band import BandDatabaseManager
-from ..db.schedule import ScheduleDatabaseManager
+from ..export import make_feed_token
+from ..jobs import enqueue_in, wake_runner
+from ..upcoming import upcoming_practices
 
 from const import GOOGLE_CLIENT_ID
 
 
+# トップページに表示する今後のバンド練の件数
+UPCOMING_PRACTICES = 5
+
 
 @app.route("/")
 def index():
@@ -21,15 +27,51 @@ def index():
   return render_template('index.html')
 
 
+@app.route("/sw.js")
+def service_worker():
+  """Service Workerをルートのスコープで登録できるように、ルート直下のURLから返す"""
+  response = app.send_static_file("pwa/sw.js")
+  response.headers["Service-Worker-Allowed"] = "/"
+  response.headers["Cache-Control"] = "no-cache"
+  return response
+
+
+@app.route("/assets/<path:filename>")
+def hashed_asset(filename):
+  """
+  build_assets.py で作成したハッシュ付きのファイルを返す。
+  ファイル名が内容ごとに変わるため、ブラウザには無期限にキャッシュさせる。
+  事前に圧縮したbrotli/gzip版があり、ブラウザが対応していればそちらを返す。
+  """
+  mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+  for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+    if encoding in request.accept_encodings and os.path.isfile(os.path.join(DIST_DIR, filename + suffix)):
+      response = send_from_directory(DIST_DIR, filename + suffix, mimetype=mimetype, max_age=31536000)
+      response.headers["Content-Encoding"] = encoding
+      response.headers.pop("Content-Disposition", None)
+      break
+  else:
+    response = send_from_directory(DIST_DIR, filename, mimetype=mimetype, max_age=31536000)
+
+  response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+  response.vary.add("Accept-Encoding")
+  return response
+
+
 @app.route('/login')
 def login():
-  authorization_url, state = flow.authorization_url()
+  authorization_url, state = get_flow().authorization_url()
   session['state'] = state
   return redirect(authorization_url)
 
 
 @app.route('/callback')
 def callback():
+  # Googleの認証ライブラリは重いので、ログインするときに読み込む
+  from google.oauth2 import id_token
+  from google.auth.transport import requests as google_requests
+
+  flow = get_flow()
   flow.fetch_token(authorization_response=request.url)
 
   if not session['state'] == request.args['state']:
@@ -66,7 +108,7 @@ def top():
   if not user:
     return redirect(url_for("resist"))
 
-  return render_template("top.html")
+  return render_template("top.html", practices=upcoming_practices(user.id, UPCOMING_PRACTICES))
 
 
 @app.route("/resist", methods=["GET", "POST"])
@@ -133,7 +175,9 @@ def account():
 
     return redirect(url_for("account"))
 
-  return render_template("account.html", user=user)
+  feed_token = make_feed_token(user.id)
+  feed_url = url_for("calendar_feed", token=feed_token, _external=True) if feed_token else None
+  return render_template("account.html", user=user, feed_url=feed_url)
 
 
 @app.route("/delete-account", methods=["POST"])
@@ -146,17 +190,14 @@ def delete_account():
   if not user:
     abort(404)
 
-  success = user_db.delete(user_id=user.id)
-
-  band_db = BandDatabaseManager()
-  bands = band_db.get_bands(user.id)
-  for band in bands:
-    band_db.remove_member(user_id=user.id, band_id=band.id)
-
-  schedule_db = ScheduleDatabaseManager()
-  schedule_db.delete_schedules(user.id)
+  # 所属していたバンドからの脱退とスケジュールの削除は、バンドの数だけ時間がかかるのでバックグラウンドで行う
+  # ユーザーだけが削除されて後始末が残らないよう、ジョブは削除と同じトランザクションで登録する
+  success = user_db.delete(user_id=user.id, in_transaction=lambda conn: enqueue_in(
+    conn, "delete_account_data", {"user_id": user.id}, idempotency_key=f"delete_account:{user.id}",
+  ))
 
   if success:
+    wake_runner()
     logout_user()
     flash("アカウントを削除しました。", "success")
     return redirect(url_for("index"))
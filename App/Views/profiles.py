@@ -0,0 +1,33 @@
+import os
+
+from flask import abort, render_template, request, send_from_directory
+
+from ..app_init_ import app
+from ..profiling import PROFILE_HEADER, authorized, recent_profiles
+from const import PROFILE_DIR
+
+
+def _require_token() -> None:
+  """
+  ヘッダーのトークンを確認する。正しくなければ、ページの存在も知らせないよう404にする。
+  URLに入れるとアクセスログや履歴・Refererに残るので、クエリパラメータでは受け付けない。
+  """
+  if not authorized(request.headers.get(PROFILE_HEADER)):
+    abort(404)
+
+
+@app.route("/profiles")
+def profiles_index():
+  """保存されているプロファイルの一覧を新しい順に表示する"""
+  _require_token()
+  return render_template("profiles.html", profiles=recent_profiles(), header=PROFILE_HEADER)
+
+
+@app.route("/profiles/<profile_id>.collapsed")
+def profile_file(profile_id: str):
+  """プロファイルを collapsed stack 形式でダウンロードする"""
+  _require_token()
+  return send_from_directory(
+    os.path.abspath(PROFILE_DIR), f"{profile_id}.collapsed",
+    mimetype="text/plain", as_attachment=True,
+  )
@@ -7,15 +7,54 @@ from ..app_init_ import app
 from ..db.band import BandDatabaseManager
 from ..db.schedule import ScheduleDatabaseManager
 from ..db.user import UserDatabaseManager
+from ..grid import checkbox_rows, date_headers
+from ..ratelimit import save_limiter, too_many_requests
 
 
 
+# 一度に描画・読み込みする日数
+WINDOW_DAYS = 7
+# /schedule-manage/window で一度に返す日数の上限
+MAX_WINDOW_DAYS = 31
+
+
 def daterange(start_date, end_date):
   """指定された開始日から終了日までの日付を1日ずつ生成する。"""
   for n in range(int((end_date - start_date).days) + 1):
     yield start_date + timedelta(n)
 
 
+def _editing_range(user_bands, selected_band_id: int) -> tuple[date, date, range] | None:
+  """
+  編集する表の (開始日, 終了日, 時間の範囲) を返す。
+  デフォルト(band_id=0)は所属する全バンドの期間、それ以外はそのバンドの期間。所属していないバンドなら None
+  """
+  if selected_band_id == 0:  # デフォルトスケジュール表示
+    if not user_bands:
+      # バンドに未所属の場合、今日から14日間を表示
+      start_date = date.today()
+      return start_date, start_date + timedelta(days=13), range(24)
+
+    # 全所属バンドの期間をカバーする日付範囲を計算
+    start_date = min(band.start_date for band in user_bands)
+    end_date = max(band.end_date for band in user_bands)
+    start_time = min(band.start_time for band in user_bands)
+    end_time = max(band.end_time for band in user_bands)
+    return start_date, end_date, range(start_time.hour, end_time.hour+1)
+
+  # 特定のバンドのスケジュール表示
+  selected_band = next(
+    (band for band in user_bands if band.id == selected_band_id), None
+  )
+  if not selected_band:
+    return None
+  # バンドの期間と時間に合わせて表示範囲を制限
+  return (
+    selected_band.start_date, selected_band.end_date,
+    range(selected_band.start_time.hour, selected_band.end_time.hour+1),
+  )
+
+
 @app.route("/schedule-manage")
 @login_required
 def schedule_manage():
@@ -28,8 +67,7 @@ def schedule_manage():
     flash("ユーザー情報が見つかりません。", "error")
     return redirect(url_for("top"))
 
-  bands_list = band_db_manager.get_bands(user.id)
-  user_bands = [band for band in bands_list if not band.archived]
+  user_bands = band_db_manager.get_bands(user.id, archived=False)
 
   # クエリパラメータから表示対象のband_idを取得（指定がなければデフォルト=0）
   try:
@@ -37,8 +75,14 @@ def schedule_manage():
   except (ValueError, TypeError):
     selected_band_id = 0
 
-  # ユーザーの全スケジュール情報を取得し、band_idをキーとする辞書に変換
-  all_schedules = schedule_db_manager.get_schedules(user_id=user.id)
+  editing_range = _editing_range(user_bands, selected_band_id)
+  if editing_range is None:
+    # ユーザーが所属していないバンドIDが指定された場合はアクセスを拒否
+    abort(403, "このバンドへのアクセス権がありません。")
+  range_start, range_end, times_to_display = editing_range
+
+  # 表示するバンドのスケジュールだけを取得し、band_idをキーとする辞書に変換
+  all_schedules = schedule_db_manager.get_schedules(user_id=user.id, band_ids=[selected_band_id])
   schedules_by_band = {s.band_id: s.schedule for s in all_schedules}
   comments_by_band = {s.band_id: s.comment for s in all_schedules}
 
@@ -46,60 +90,74 @@ def schedule_manage():
   current_schedule = schedules_by_band.get(selected_band_id, {})
   current_comment = comments_by_band.get(selected_band_id, None)
 
-  # 表示範囲の初期化
-  dates_to_display = []
-  # times_to_display = range(24)
-
-  if selected_band_id == 0:  # デフォルトスケジュール表示
-    if not user_bands:
-      # バンドに未所属の場合、今日から14日間を表示
-      start_date = date.today()
-      end_date = start_date + timedelta(days=13)
-      times_to_display = range(24)
-
-    else:
-      # 全所属バンドの期間をカバーする日付範囲を計算
-      start_date = min(band.start_date for band in user_bands)
-      end_date = max(band.end_date for band in user_bands)
-      start_time = min(band.start_time for band in user_bands)
-      end_time = max(band.end_time for band in user_bands)
-      times_to_display = range(start_time.hour, end_time.hour+1)
-
-    dates_to_display = list(daterange(start_date, end_date))
-
-
-  else:  # 特定のバンドのスケジュール表示
-    selected_band = next(
-      (band for band in user_bands if band.id == selected_band_id), None
-    )
-    if not selected_band:
-      # ユーザーが所属していないバンドIDが指定された場合はアクセスを拒否
-      abort(403, "このバンドへのアクセス権がありません。")
-
-    # バンドの期間と時間に合わせて表示範囲を制限
-    dates_to_display = list(
-      daterange(selected_band.start_date, selected_band.end_date)
-    )
-    times_to_display = range(
-      selected_band.start_time.hour, selected_band.end_time.hour+1
-    )
+  # 期間が長くても最初は今日からの1週間分だけを描画し、残りはスクロールに合わせて /schedule-manage/window から読み込む
+  window_start = min(max(date.today(), range_start), max(range_start, range_end - timedelta(days=WINDOW_DAYS - 1)))
+  window_end = min(range_end, window_start + timedelta(days=WINDOW_DAYS - 1))
 
   # テンプレートで扱いやすいように、スケジュール辞書のキーをISO形式の文字列に変換
   current_schedule_str_keys = {
-    d.isoformat(): v for d, v in current_schedule.items()
+    d.isoformat(): v for d, v in current_schedule.items() if window_start <= d <= window_end
   }
+  headers = date_headers(daterange(window_start, window_end))
 
   return render_template(
     "schedule/manage.html",
     bands=user_bands,
     selected_band_id=selected_band_id,
-    dates=dates_to_display,
-    times=list(times_to_display),  # rangeオブジェクトをリストに変換
-    schedule_data=current_schedule_str_keys,
+    range_start=range_start,
+    range_end=range_end,
+    hours=list(times_to_display),
+    window_days=WINDOW_DAYS,
+    headers=headers,
+    rows=checkbox_rows(headers, times_to_display, current_schedule_str_keys),
     comment=current_comment
   )
 
 
+@app.route("/schedule-manage/window", methods=["GET"])
+@login_required
+def schedule_window():
+  """
+  スケジュール入力の表に追加する日付の列を返すエンドポイント。
+  start から days 日分 (編集できる期間の外は除く) の、日付の見出しと保存済みのチェック状態を返す。
+  """
+  user_db_manager = UserDatabaseManager()
+  band_db_manager = BandDatabaseManager()
+  schedule_db_manager = ScheduleDatabaseManager()
+
+  user = user_db_manager.get_user(email=current_user.id)
+  if not user:
+    return jsonify({"status": "error", "message": "User not found"}), 404
+
+  try:
+    band_id = int(request.args.get("band_id", 0))
+    start = date.fromisoformat(request.args["start"])
+    days = min(int(request.args.get("days", WINDOW_DAYS)), MAX_WINDOW_DAYS)
+  except (KeyError, ValueError, TypeError):
+    return jsonify({"status": "error", "message": "Invalid parameters"}), 400
+
+  user_bands = band_db_manager.get_bands(user.id, archived=False)
+  editing_range = _editing_range(user_bands, band_id)
+  if editing_range is None:
+    return jsonify({"status": "error", "message": "Permission denied"}), 403
+  range_start, range_end, _ = editing_range
+
+  window_start = max(start, range_start)
+  window_end = min(start + timedelta(days=days - 1), range_end)
+
+  schedules = schedule_db_manager.get_schedules(user_id=user.id, band_ids=[band_id])
+  current_schedule = schedules[0].schedule if schedules else {}
+
+  dates = list(daterange(window_start, window_end))
+  return jsonify({
+    "status": "success",
+    "days": [
+      {"date": iso, "label": label, "weekday": weekday, "hours": current_schedule.get(day)}
+      for day, (iso, label, weekday) in zip(dates, date_headers(dates))
+    ],
+  })
+
+
 @app.route("/schedule-manage/save", methods=["POST"])
 @login_required
 def save_schedule():
@@ -111,14 +169,36 @@ def save_schedule():
   if not user:
     return jsonify({"status": "error", "message": "User not found"}), 404
 
-  data = request.get_json()
-  if not data or "schedule" not in data or "band_id" not in data:
+  data = request.get_json(silent=True)
+  if not data or not isinstance(data.get("schedule"), dict) or "band_id" not in data:
     return jsonify({"status": "error", "message": "Invalid data"}), 400
 
-  band_id = data["band_id"]
+  # 画面からはセレクターの値 (文字列) で送られてくる。イベントやキャッシュのキーは整数なので、ここで変換する
+  try:
+    band_id = int(data["band_id"])
+  except (ValueError, TypeError):
+    return jsonify({"status": "error", "message": "Invalid band ID"}), 400
+
+  # 保存が集中したときは、DBに書き込む前に断る (不正なリクエストでは保存の枠を使わない)
+  admission = save_limiter.admit(user.id)
+  if not admission.allowed:
+    return too_many_requests(admission)
+
   schedule_str_keys = data["schedule"]
   comment = data.get("comment", "")
 
+  if data.get("partial"):
+    # 読み込み済みの週だけを編集する画面からの保存。送られてきた日付だけを置き換える (チェックのない日付は削除)
+    updates = {}
+    for date_str, time_list in schedule_str_keys.items():
+      try:
+        updates[date.fromisoformat(date_str)] = time_list
+      except ValueError:
+        continue
+    if not schedule_db_manager.merge_schedule(user.id, updates, band_id, comment):
+      return _save_failed(band_id)
+    return jsonify({"status": "success", "message": "Schedule updated.", "next_save_ms": admission.next_save_ms})
+
   # キーをdateオブジェクトに変換し、チェックが入っている日付のみを保存対象とする
   schedule_to_save = {}
   for date_str, time_list in schedule_str_keys.items():
@@ -130,8 +210,17 @@ def save_schedule():
         # 不正な日付フォーマットはスキップ
         continue
 
-  schedule_db_manager.update_schedule(user.id, schedule_to_save, band_id, comment)
-  return jsonify({"status": "success", "message": "Schedule updated."})
+  if not schedule_db_manager.update_schedule(user.id, schedule_to_save, band_id, comment):
+    return _save_failed(band_id)
+  return jsonify({"status": "success", "message": "Schedule updated.", "next_save_ms": admission.next_save_ms})
+
+
+def _save_failed(band_id: int):
+  """保存できなかったときの応答。アーカイブしたバンドへの保存は 409 (再試行しても保存できない)"""
+  band = BandDatabaseManager().get_band(band_id=band_id) if band_id else None
+  if band and band.archived:
+    return jsonify({"status": "error", "message": "Band is archived"}), 409
+  return jsonify({"status": "error", "message": "Failed to save schedule"}), 500
 
 
 @app.route("/schedule-manage/default-schedule", methods=["GET"])
@@ -146,7 +235,7 @@ def get_default_schedule():
     return jsonify({"status": "error", "message": "User not found"}), 404
 
   # band_id=0 のスケジュールを取得
-  schedules = schedule_db_manager.get_schedules(user_id=user.id)
+  schedules = schedule_db_manager.get_schedules(user_id=user.id, band_ids=[0])
   default_schedule_obj = next((s for s in schedules if s.band_id == 0), None)
 
   if default_schedule_obj and default_schedule_obj.schedule:
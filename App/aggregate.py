@@ -0,0 +1,47 @@
+from collections import defaultdict
+from typing import Iterable
+
+from .db.schedule import Schedule
+
+
+def aggregate_schedules(schedules: Iterable[Schedule], member_map: dict[int, str]):
+  """
+  メンバーのスケジュールを日付と時間ごとに集計する。
+  戻り値は (参加可能人数, 参加可能なメンバー名, 備考) で、
+  人数とメンバー名は {日付の文字列: {時間: 値}} の形式。
+  member_map に含まれないユーザー(バンド練の user_id=0 など)は集計しない。
+  """
+  schedules_agg = defaultdict(lambda: defaultdict(int))
+  schedules_detail = defaultdict(lambda: defaultdict(list))
+  user_comments = []
+
+  for schedule_obj in schedules:
+    member_name = member_map.get(schedule_obj.user_id)
+    if not member_name:
+      continue
+
+    if schedule_obj.comment:
+      user_comments.append({
+          'name': member_name,
+          'comment': schedule_obj.comment
+      })
+
+    if schedule_obj.schedule:
+      for date_obj, hour_list in schedule_obj.schedule.items():
+        date_str = date_obj.isoformat()
+        for hour, is_available in enumerate(hour_list):
+          if is_available:
+            schedules_agg[date_str][hour] += 1
+            schedules_detail[date_str][hour].append(member_name)
+
+  return schedules_agg, schedules_detail, user_comments
+
+
+def cell_map(schedules_detail: dict[str, dict[int, list[str]]]) -> dict[tuple[str, int], tuple[str, ...]]:
+  """集計結果を {(日付の文字列, 時間): 参加可能なメンバー名} の平らな辞書にする (差分の計算用)"""
+  return {
+    (date_str, hour): tuple(names)
+    for date_str, hours in schedules_detail.items()
+    for hour, names in hours.items()
+    if names
+  }
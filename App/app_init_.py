@@ -1,10 +1,112 @@
 import os
-from flask import Flask
+from flask import Flask, session
+from jinja2 import FileSystemBytecodeCache
+
+from .assets import asset_url, stylesheet_urls
+from .db.base import format_lsn, get_read_watermark, parse_lsn, replica_router, set_read_watermark
+from .db.events import bus
+from const import JINJA_BYTECODE_CACHE_DIR
 
 
 app = Flask(__name__, template_folder="../Src/templates/", static_folder="../Src/static/")
+app.jinja_env.globals.update(asset_url=asset_url, stylesheet_urls=stylesheet_urls)
+
+if JINJA_BYTECODE_CACHE_DIR:
+  try:
+    os.makedirs(JINJA_BYTECODE_CACHE_DIR, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_BYTECODE_CACHE_DIR)
+  except OSError:
+    # 書き込めない場合は毎回コンパイルする
+    pass
+
+
+@app.before_request
+def start_invalidation_bus():
+  """ワーカープロセスごとに、他のワーカーからのキャッシュ無効化の受信を始める"""
+  bus.start()
+
+
+@app.before_request
+def restore_read_watermark():
+  """直前のリクエストで書き込んだ位置をセッションから復元し、それより古いレプリカから読まないようにする"""
+  saved = session.get("db_lsn") if replica_router.enabled else None
+  set_read_watermark((parse_lsn(saved[0]), saved[1]) if saved else None)
+
+
+@app.after_request
+def save_read_watermark(response):
+  """このリクエストで書き込んだ位置をセッションに保存する (変わったときだけ)"""
+  if not replica_router.enabled:
+    return response
+  watermark = get_read_watermark()
+  saved = session.get("db_lsn")
+  if watermark is None:
+    if saved:
+      session.pop("db_lsn")
+  elif not saved or parse_lsn(saved[0]) != watermark[0]:
+    session["db_lsn"] = [format_lsn(watermark[0]), watermark[1]]
+  return response
+
+def create_app() -> Flask:
+  """
+  ビューを登録したアプリを返す (何度呼んでも同じアプリを返す)。
+  ビューのモジュールはここで読み込むので、このモジュールを import しただけではルートは登録されない。
+  """
+  import App.auth
+  import App.Views.main
+  import App.Views.band
+  import App.Views.schedule
+  import App.Views.band_practice
+  import App.Views.export
+  import App.Views.jobs
+  import App.Views.profiles
+  return app
+
+
+# --- マルチプロセスで動かす場合 (gunicorn.conf.py から呼ぶ) ---
+
+def preload() -> None:
+  """
+  fork 前のマスタープロセスで1回だけ呼ぶ。
+  ログインで使う重いライブラリとテンプレートを読み込んでおき、各ワーカーが同じメモリを共有できるようにする。
+  スレッドや接続はここでは作らない (fork 後の子プロセスには引き継がれない)
+  """
+  from google.oauth2 import id_token  # noqa: F401
+  from google.auth.transport import requests as google_requests  # noqa: F401
+  from .auth import get_flow
+
+  get_flow()
+  for name in app.jinja_env.list_templates(extensions=["html"]):
+    app.jinja_env.get_template(name)
+
+
+def init_worker() -> None:
+  """fork 後のワーカーで呼ぶ。ログの出力、プールとキャッシュ無効化の受信、ジョブの実行を、最初のリクエストを待たずに用意する"""
+  from .db.base import open_pools
+  from .db.log import log_writer
+  from .jobs import job_runner
+
+  log_writer.ensure_started()
+  open_pools()
+  bus.start()
+  job_runner.start()
+
+
+def close_streams() -> None:
+  """ワーカーの終了が始まったときに呼ぶ。SSEのストリームを終わらせて、処理中のリクエストが終わるのを待てるようにする"""
+  from .live import broadcaster
+
+  broadcaster.close()
+
+
+def shutdown_worker() -> None:
+  """ワーカーの終了時に呼ぶ。実行中のジョブを待ってから受信スレッドを止め、プールの接続を閉じ、残っているログを書き出す"""
+  from .db.base import close_pools
+  from .db.log import log_writer
+  from .jobs import job_runner
 
-import App.Views.main
-import App.Views.band
-import App.Views.schedule
-import App.Views.band_practice
\ No newline at end of file
+  # 終わらなかったジョブは期限が切れた後に他のワーカーが実行し直す
+  job_runner.stop(timeout=10)
+  bus.stop()
+  close_pools()
+  log_writer.stop()
\ No newline at end of file
@@ -0,0 +1,113 @@
+"""
+アーカイブしたバンドのスナップショット。
+アーカイブするときにバンドのページの表・備考とバンド練をまとめて保存し、
+アーカイブ中のページはスナップショットを1回読むだけで表示する (メンバーのスケジュールを集計し直さない)。
+"""
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Iterable, Iterator
+
+import psycopg
+
+from .aggregate import aggregate_schedules
+from .db.band import Band, BandDatabaseManager
+from .db.conflict import conflict_index
+from .db.schedule import Schedule, ScheduleDatabaseManager
+from .db.snapshot import SnapshotDatabaseManager
+from .grid import availability_rows, date_headers
+
+# スナップショットの形式を変えたら上げる (古い形式のスナップショットは使わず、現在のデータから表示する)
+SNAPSHOT_VERSION = 1
+
+
+def _daterange(start_date: date, end_date: date) -> Iterator[date]:
+  for n in range(int((end_date - start_date).days) + 1):
+    yield start_date + timedelta(n)
+
+
+def availability_page(band: Band, schedules: Iterable[Schedule] | None = None) -> dict:
+  """
+  バンドのページに表示する内容を現在のデータから作る。
+  {"headers", "rows", "total_members", "user_comments"} を返す (render_template にそのまま渡せる)。
+  """
+  members = BandDatabaseManager().get_users(band.id)
+  member_map = {member.id: member.name for member in members}
+
+  # メンバーが多いバンドでも全行をメモリに載せないよう、サーバーサイドカーソルで少しずつ読みながら集計する
+  if schedules is None:
+    schedules = ScheduleDatabaseManager().iter_schedules(band_id=band.id)
+
+  # 日付と時間ごとの参加可能人数とメンバー名を集計
+  schedules_agg, schedules_detail, user_comments = aggregate_schedules(schedules, member_map)
+
+  # 他のバンドのバンド練と重なっているメンバーを、日付と時間ごとに集計
+  conflicts_detail = defaultdict(lambda: defaultdict(list))
+  for (date_obj, hour), user_ids in conflict_index.conflicts_by_slot(list(member_map), band.id).items():
+    conflicts_detail[date_obj.isoformat()][hour] = [member_map[user_id] for user_id in user_ids]
+
+  # テンプレートの内側のループで辞書を引かないよう、セルごとの値を行ごとに並べておく
+  headers = date_headers(_daterange(band.start_date, band.end_date))
+  rows = availability_rows(
+    headers, range(band.start_time.hour, band.end_time.hour+1),
+    schedules_agg, schedules_detail, conflicts_detail,
+  )
+  return {
+    "headers": headers,
+    "rows": rows,
+    "total_members": len(members),
+    "user_comments": user_comments,
+  }
+
+
+def build_snapshot(band: Band) -> dict | None:
+  """
+  バンドのスナップショットを作る。スケジュールは1回だけ読み、集計しながらバンド練の行を取り出す。
+  行を削除する場合、削除した行は SnapshotDatabaseManager.save が同じトランザクションで "schedules" に入れる。
+  スケジュールを最後まで読めなかった場合は、一部の行だけのスナップショットを保存しないよう None を返す。
+  """
+  practice: dict[str, list] = {}
+
+  def recorded(schedules: Iterable[Schedule]) -> Iterator[Schedule]:
+    for schedule_obj in schedules:
+      if schedule_obj.user_id == 0:
+        practice.update(_to_json(schedule_obj.schedule))
+      yield schedule_obj
+
+  try:
+    page = availability_page(band, recorded(ScheduleDatabaseManager().iter_schedules(band_id=band.id)))
+  except psycopg.Error:
+    # iter_schedules で記録済み
+    return None
+  return {"version": SNAPSHOT_VERSION, **page, "practice": practice}
+
+
+def snapshot_page(band: Band) -> dict | None:
+  """アーカイブしたバンドのページに表示する内容をスナップショットから返す。使えるスナップショットがなければ None"""
+  data = SnapshotDatabaseManager().get(band.id)
+  if not data or data.get("version") != SNAPSHOT_VERSION:
+    return None
+  return {key: data[key] for key in ("headers", "rows", "total_members", "user_comments")}
+
+
+def band_schedules(band: Band, user_id: int | None = None) -> Iterable[Schedule]:
+  """
+  バンドのスケジュールを返す。アーカイブ時に行を削除したバンドでは、スナップショットに含めた行を返す。
+  user_id を指定した場合はそのユーザー (バンド練なら 0) の行だけを返す。
+  """
+  if band.archived:
+    data = SnapshotDatabaseManager().get(band.id, released_only=True)
+    if data:
+      return [
+        Schedule(0, item["user_id"], band.id, _from_json(item["schedule"]), item["comment"])
+        for item in data["schedules"]
+        if user_id is None or item["user_id"] == user_id
+      ]
+  return ScheduleDatabaseManager().iter_schedules(user_id=user_id, band_id=band.id)
+
+
+def _to_json(schedule: dict[date, list]) -> dict[str, list]:
+  return {d.isoformat(): hours for d, hours in (schedule or {}).items()}
+
+
+def _from_json(schedule: dict[str, list]) -> dict[date, list]:
+  return {date.fromisoformat(d): hours for d, hours in schedule.items()}
@@ -0,0 +1,60 @@
+import json
+import os
+
+from flask import url_for
+
+from const import BASE_DIR
+
+
+STATIC_DIR = os.path.join(BASE_DIR, "Src", "static")
+# build_assets.py の出力先。ファイル名にハッシュを含むため、長期間キャッシュしてよい
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+MANIFEST_PATH = os.path.join(DIST_DIR, "manifest.json")
+
+# 全ページ共通のCSS。各ページのCSSとまとめて1ファイルにバンドルする
+BASE_CSS = "css/base.css"
+
+
+def page_bundle_name(page_css: str) -> str:
+  """ページのCSSに対応するバンドル名 (例: css/band/band.css -> bundles/band.css)"""
+  return f"bundles/{os.path.basename(page_css)}"
+
+
+_manifest: dict | None = None
+_manifest_mtime: float | None = None
+
+
+def load_manifest() -> dict:
+  """
+  ビルド済みアセットのマニフェストを読み込む。
+  ビルドされていない場合は空の辞書を返し、通常の /static のURLを使う。
+  """
+  global _manifest, _manifest_mtime
+  try:
+    mtime = os.path.getmtime(MANIFEST_PATH)
+  except OSError:
+    return {}
+
+  if _manifest is None or mtime != _manifest_mtime:
+    with open(MANIFEST_PATH, encoding="utf-8") as f:
+      _manifest = json.load(f)
+    _manifest_mtime = mtime
+  return _manifest
+
+
+def asset_url(path: str) -> str:
+  """Src/static からの相対パスを、ビルド済みならハッシュ付きのURLに変換する"""
+  hashed = load_manifest().get("files", {}).get(path)
+  if hashed:
+    return url_for("hashed_asset", filename=hashed)
+  return url_for("static", filename=path)
+
+
+def stylesheet_urls(page_css: str | None = None) -> list[str]:
+  """ページで読み込むCSSのURLを返す。ビルド済みなら共通CSSとページのCSSをまとめた1ファイルになる"""
+  if page_css:
+    bundled = load_manifest().get("files", {}).get(page_bundle_name(page_css))
+    if bundled:
+      return [url_for("hashed_asset", filename=bundled)]
+    return [asset_url(BASE_CSS), asset_url(page_css)]
+  return [asset_url(BASE_CSS)]
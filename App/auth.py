@@ -1,6 +1,5 @@
 from flask import flash, redirect, url_for
 from flask_login import LoginManager, UserMixin
-from google_auth_oauthlib.flow import Flow
 from datetime import timedelta
 
 from .app_init_ import app
@@ -21,11 +20,23 @@ client_config = {
   }
 }
 
-flow = Flow.from_client_config(
-  client_config=client_config,
-  scopes=["openid", "https://www.googleapis.com/auth/userinfo.email"],
-  redirect_uri=REDIRECT_URI
-)
+_flow = None
+
+
+def get_flow():
+  """
+  OAuthのFlowを返す。google_auth_oauthlib は読み込みが重いので、最初にログインするときに読み込む
+  (gunicornでは fork 前に preload() で読み込み、ワーカー間で共有する)
+  """
+  global _flow
+  if _flow is None:
+    from google_auth_oauthlib.flow import Flow
+    _flow = Flow.from_client_config(
+      client_config=client_config,
+      scopes=["openid", "https://www.googleapis.com/auth/userinfo.email"],
+      redirect_uri=REDIRECT_URI
+    )
+  return _flow
 
 # Flask-Login
 login_manager = LoginManager()
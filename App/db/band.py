@@ -1,15 +1,28 @@
 import psycopg
 import secrets
 import string
+from contextlib import nullcontext
 from datetime import date, time
 
-from .base import _get_connection
-from .user import User
+from psycopg.rows import args_row
+
+from .base import PREPARE, _get_connection, _get_read_connection, primary_reads, select_list
+from .cache import record_cache
+from .events import (
+  BAND_CHANGED, BAND_DELETED, INVALIDATION_CHANNEL, MEMBER_ADDED, MEMBER_REMOVED, Event, bus,
+)
+from .log import log_db_error
+from .user import USER_COLUMNS, User
 
 
 class Band:
   """バンド情報を格納するためのデータクラス"""
 
+  __slots__ = (
+    "id", "name", "creator_user_id", "token",
+    "start_date", "end_date", "start_time", "end_time", "archived",
+  )
+
   def __init__(
     self, id: int, name: str, creator_user_id: int, token: str,
     start_date: date, end_date: date, start_time: time, end_time: time, archived: bool,
@@ -33,11 +46,16 @@ class Band:
     )
 
 
+# Band の引数と同じ順番
+BAND_COLUMNS = Band.__slots__
+
+
 class BandDatabaseManager:
   """バンドに関連するデータベース操作を管理するクラス"""
 
   def __init__(self):
     self._get_connection = _get_connection
+    self._get_read_connection = _get_read_connection
 
   # --- 書き込み操作 (Create, Update, Delete) ---
 
@@ -50,35 +68,38 @@ class BandDatabaseManager:
     成功した場合、(バンドID, トークン) を返す。
     """
     token = self._generate_token()
-    # RETURNING id を追加して、挿入した行のIDを取得する
+    # バンドの追加と、作成者を最初のメンバーとして追加する処理を1つの文で行う
     sql = """
-      INSERT INTO bands
-        (name, creator_user_id, token, start_date, end_date, start_time, end_time)
-      VALUES (%s, %s, %s, %s, %s, %s, %s)
-      RETURNING id;
+      WITH new_band AS (
+        INSERT INTO bands
+          (name, creator_user_id, token, start_date, end_date, start_time, end_time)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        RETURNING id
+      ), new_member AS (
+        INSERT INTO band_user (user_id, band_id)
+        SELECT %s, id FROM new_band
+      )
+      SELECT id FROM new_band;
     """
     try:
       with self._get_connection() as conn:
-        with conn.cursor() as cur:
+        with conn.cursor() as cur, conn.pipeline():
           cur.execute(sql, (
             name, creator_user_id, token, start_date,
-            end_date, start_time, end_time
+            end_date, start_time, end_time, creator_user_id
           ))
 
-          # fetchone()で結果を取得する
+          # fetchone()で結果を取得する (ここまでが1回目の往復)
           result = cur.fetchone()
           if not result:
             raise psycopg.Error("バンドの作成に失敗しました。")
           new_band_id = result['id']
 
-          # 作成者を最初のメンバーとして追加
-          member_sql = "INSERT INTO band_user (user_id, band_id) VALUES (%s, %s);"
-          cur.execute(member_sql, (creator_user_id, new_band_id))
-
-          conn.commit()
+          # 通知にはバンドIDが必要なので、通知とCOMMITは2回目の往復で送る
+          bus.commit(conn, Event(MEMBER_ADDED, user_id=creator_user_id, band_id=new_band_id))
           return new_band_id, token
     except psycopg.Error as e:
-      print(f"データベースエラーが発生しました (create): {e}")
+      log_db_error("create", e, user_id=creator_user_id)
       return None
 
 
@@ -95,16 +116,18 @@ class BandDatabaseManager:
     try:
       with self._get_connection() as conn:
         with conn.cursor() as cur:
-          cur.execute(sql, (
-            name, start_date, end_date,
-            start_time, end_time, band_id
-          ))
-          conn.commit()
+          # 文・通知・COMMITを1回の往復で送る
+          with conn.pipeline():
+            cur.execute(sql, (
+              name, start_date, end_date,
+              start_time, end_time, band_id
+            ))
+            bus.commit(conn, Event(BAND_CHANGED, band_id=band_id))
           # 1行以上更新されていれば成功
           return cur.rowcount > 0
 
     except psycopg.Error as e:
-      print(f"データベースエラーが発生しました (update_band): {e}")
+      log_db_error("update_band", e, band_id=band_id)
       return False
 
 
@@ -118,35 +141,64 @@ class BandDatabaseManager:
     try:
       with self._get_connection() as conn:
         with conn.cursor() as cur:
-          cur.execute(sql, (
-            archive, band_id
-          ))
-          conn.commit()
+          # 文・通知・COMMITを1回の往復で送る
+          with conn.pipeline():
+            cur.execute(sql, (
+              archive, band_id
+            ))
+            bus.commit(conn, Event(BAND_CHANGED, band_id=band_id))
           # 1行以上更新されていれば成功
           return cur.rowcount > 0
 
     except psycopg.Error as e:
-      print(f"データベースエラーが発生しました (update_band): {e}")
+      log_db_error("update_band_archive_status", e, band_id=band_id)
       return False
 
 
   def add_member(self, user_id: int, band_id: int) -> bool:
-    """ユーザーをバンドのメンバーとして追加する"""
-    sql = "INSERT INTO band_user (user_id, band_id) VALUES (%s, %s);"
+    """ユーザーをバンドのメンバーとして追加する。既にメンバーの場合は False を返す"""
+    added = self.add_members(band_id, [user_id])
+    return added is not None and user_id in added
+
+
+  def add_members(self, band_id: int, user_ids: list[int]) -> set[int] | None:
+    """
+    複数のユーザーをまとめてバンドのメンバーとして追加し、新しく追加したユーザーのIDを返す (エラーの場合は None)。
+    既にメンバーのユーザーは ON CONFLICT で何もしない (例外を使わない)。
+    追加と、追加できたユーザーの分だけの無効化の通知を1つの文で行い、COMMITと合わせて1回の往復で送る。
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+      return set()
+    events = {user_id: Event(MEMBER_ADDED, user_id=user_id, band_id=band_id) for user_id in user_ids}
+
+    sql = """
+      WITH candidates AS (
+        SELECT * FROM unnest(%s::integer[], %s::text[]) AS c(user_id, payload)
+      ), added AS (
+        INSERT INTO band_user (user_id, band_id)
+        SELECT user_id, %s FROM candidates
+        ON CONFLICT (user_id, band_id) DO NOTHING
+        RETURNING user_id
+      )
+      SELECT added.user_id, pg_notify(%s, candidates.payload)
+      FROM added JOIN candidates USING (user_id);
+    """
     try:
       with self._get_connection() as conn:
         with conn.cursor() as cur:
-          cur.execute(sql, (user_id, band_id))
-          conn.commit()
-          return True
-    except psycopg.IntegrityError:
-      # (user_id, band_id) の組み合わせはUNIQUE制約があるため、
-      # 既にメンバーの場合はこのエラーが発生する
-      print("ユーザーは既にこのバンドのメンバーです。")
-      return False
+          with conn.pipeline():
+            cur.execute(sql, (
+              user_ids, [bus.payload(event) for event in events.values()], band_id, INVALIDATION_CHANNEL,
+            ), prepare=PREPARE)
+            conn.commit()
+          added = {row["user_id"] for row in cur.fetchall()}
+        if added:
+          bus.committed(conn, *(events[user_id] for user_id in added))
+        return added
     except psycopg.Error as e:
-      print(f"データベースエラーが発生しました (add_member): {e}")
-      return False
+      log_db_error("add_members", e, band_id=band_id, users=len(user_ids))
+      return None
 
 
   def remove_member(self, user_id: int, band_id: int) -> bool:
@@ -156,20 +208,20 @@ class BandDatabaseManager:
     sql = "DELETE FROM band_user WHERE user_id = %s AND band_id = %s;"
     try:
       with self._get_connection() as conn:
-        with conn.cursor() as cur:
-          cur.execute(sql, (user_id, band_id))
-          rows_affected = cur.rowcount
+        # 2つのDELETE・通知・COMMITを1回の往復で送る
+        with conn.pipeline():
+          member_cur = conn.execute(sql, (user_id, band_id))
 
           # 注意: band_id=0 (個人のデフォルトスケジュール) は削除しない
           if band_id != 0:
             schedule_sql = "DELETE FROM schedules WHERE user_id = %s AND band_id = %s;"
-            cur.execute(schedule_sql, (user_id, band_id))
+            conn.execute(schedule_sql, (user_id, band_id))
 
-          conn.commit()
-          # 1行以上削除されていれば成功
-          return rows_affected > 0
+          bus.commit(conn, Event(MEMBER_REMOVED, user_id=user_id, band_id=band_id))
+        # 1行以上削除されていれば成功
+        return member_cur.rowcount > 0
     except psycopg.Error as e:
-      print(f"データベースエラーが発生しました (remove_member): {e}")
+      log_db_error("remove_member", e, user_id=user_id, band_id=band_id)
       return False
 
 
@@ -178,21 +230,23 @@ class BandDatabaseManager:
     バンド自体を削除する。関連する全てのデータも削除される。
     """
     # 外部キー制約のため、削除する順番が重要
-    # 1. schedules -> 2. band_user -> 3. bands
+    # 1. schedules -> 2. band_user -> 3. band_snapshots -> 4. bands
     sqls = [
       "DELETE FROM schedules WHERE band_id = %s;",
       "DELETE FROM band_user WHERE band_id = %s;",
+      "DELETE FROM band_snapshots WHERE band_id = %s;",
       "DELETE FROM bands WHERE id = %s;"
     ]
     try:
       with self._get_connection() as conn:
-        with conn.cursor() as cur:
+        # 4つのDELETE・通知・COMMITを1回の往復で送る
+        with conn.pipeline():
           for sql in sqls:
-            cur.execute(sql, (band_id,))
-          conn.commit()
-          return True
+            conn.execute(sql, (band_id,))
+          bus.commit(conn, Event(BAND_DELETED, band_id=band_id))
+        return True
     except psycopg.Error as e:
-      print(f"データベースエラーが発生しました (delete_band): {e}")
+      log_db_error("delete_band", e, band_id=band_id)
       return False
 
   # --- 読み取り操作 (Read) ---
@@ -200,76 +254,136 @@ class BandDatabaseManager:
   def get_band(self, band_id: int | None = None, token: str | None = None) -> Band | None:
     """idまたはtokenを指定して、単一のバンド情報を取得する"""
     if band_id:
-      sql = "SELECT * FROM bands WHERE id = %s;"
+      sql = f"SELECT {select_list(BAND_COLUMNS)} FROM bands WHERE id = %s;"
       args = (band_id,)
+      key = ("band_id", band_id)
     elif token:
-      sql = "SELECT * FROM bands WHERE token = %s;"
+      sql = f"SELECT {select_list(BAND_COLUMNS)} FROM bands WHERE token = %s;"
       args = (token,)
+      key = ("band_token", token)
     else:
       return None
 
+    cached = record_cache.get(key)
+    if cached is not None:
+      return cached
+
+    generation = record_cache.begin()
     try:
-      with self._get_connection() as conn:
-        with conn.cursor() as cur:
-          cur.execute(sql, args)
-          result = cur.fetchone()
-          if result:
-            # psycopgはtimeオブジェクトを直接返すため、timedeltaからの変換は不要
-            return Band(**result)
-          return None
+      with self._cache_fill_reads(), self._get_read_connection() as conn:
+        with conn.cursor(row_factory=args_row(Band)) as cur:
+          cur.execute(sql, args, prepare=PREPARE)
+          # psycopgはtimeオブジェクトを直接返すため、timedeltaからの変換は不要
+          band = cur.fetchone()
+          if band:
+            record_cache.put(key, band, (("band", band.id),), generation)
+          return band
     except psycopg.Error as e:
-      print(f"データベースエラーが発生しました (get_band): {e}")
+      log_db_error("get_band", e, band_id=band_id)
       return None
 
 
-  def get_bands(self, user_id: int) -> list[Band]:
-    """指定されたユーザーが所属する全てのバンド情報をリストで取得する"""
-    sql = """
-      SELECT b.*
+  def get_bands(
+    self, user_id: int, archived: bool | None = None,
+    limit: int | None = None, after: tuple[date, int] | None = None,
+  ) -> list[Band]:
+    """
+    指定されたユーザーが所属するバンド情報をリストで取得する。
+    archived を指定すると、アーカイブ済み (True) / 未アーカイブ (False) のバンドだけを返す。
+    並び順は終了日の新しい順 (同じ日はIDの大きい順)。archived を指定しない場合は未アーカイブのバンドが先。
+    after に前のページの最後のバンドの (終了日, ID) を渡すと、その続きから limit 件を返す (キーセットページング)。
+    """
+    conditions = ["bu.user_id = %s"]
+    args: list = [user_id]
+    if archived is not None:
+      conditions.append("b.archived = %s")
+      args.append(archived)
+    if after is not None:
+      conditions.append("(b.end_date, b.id) < (%s, %s)")
+      args.extend(after)
+
+    order = "b.end_date DESC, b.id DESC" if archived is not None else "b.archived, b.end_date DESC, b.id DESC"
+    sql = f"""
+      SELECT {select_list(BAND_COLUMNS, "b")}
       FROM bands b
       JOIN band_user bu ON b.id = bu.band_id
-      WHERE bu.user_id = %s
-      ORDER BY b.id DESC;
+      WHERE {" AND ".join(conditions)}
+      ORDER BY {order}
     """
+    if limit is not None:
+      sql += " LIMIT %s"
+      args.append(limit)
+
     bands_list: list[Band] = []
     try:
-      with self._get_connection() as conn:
-        with conn.cursor() as cur:
-          cur.execute(sql, (user_id,))
-          results = cur.fetchall()
-          for row in results:
-            # psycopgはtimeオブジェクトを直接返すため、timedeltaからの変換は不要
-            bands_list.append(Band(**row))
+      with self._get_read_connection() as conn:
+        # 行を辞書にせず、そのまま Band を作る
+        with conn.cursor(row_factory=args_row(Band)) as cur:
+          cur.execute(sql, args, prepare=PREPARE)
+          bands_list = cur.fetchall()
     except psycopg.Error as e:
-      print(f"データベースエラーが発生しました (get_bands): {e}")
-
-    bands_list.sort(key=lambda x: (not x.archived, x.end_date), reverse=True)
+      log_db_error("get_bands", e, user_id=user_id)
 
     return bands_list
 
 
+  def get_member_names(self, band_ids: list[int]) -> dict[int, list[str]]:
+    """複数のバンドのメンバー名を1回のクエリで取得する。{バンドID: [メンバー名]} を返す"""
+    if not band_ids:
+      return {}
+
+    sql = """
+      SELECT bu.band_id, array_agg(u.name ORDER BY u.id) AS names
+      FROM band_user bu
+      JOIN users u ON u.id = bu.user_id
+      WHERE bu.band_id = ANY(%s)
+      GROUP BY bu.band_id;
+    """
+    try:
+      with self._get_read_connection() as conn:
+        with conn.cursor() as cur:
+          cur.execute(sql, (list(band_ids),), prepare=PREPARE)
+          return {row["band_id"]: row["names"] for row in cur.fetchall()}
+    except psycopg.Error as e:
+      log_db_error("get_member_names", e, bands=len(band_ids))
+      return {}
+
+
   def get_users(self, band_id: int) -> list[User]:
     """指定されたバンドIDに所属する全てのユーザー情報をリストで取得する"""
-    sql = """
-      SELECT u.id, u.email, u.name
+    sql = f"""
+      SELECT {select_list(USER_COLUMNS, "u")}
       FROM users u
       JOIN band_user bu ON u.id = bu.user_id
       WHERE bu.band_id = %s;
     """
+    key = ("members", band_id)
+    cached = record_cache.get(key)
+    if cached is not None:
+      return list(cached)
+
     users_list: list[User] = []
+    generation = record_cache.begin()
     try:
-      with self._get_connection() as conn:
-        with conn.cursor() as cur:
-          cur.execute(sql, (band_id,))
-          results = cur.fetchall()
-          for row in results:
-            users_list.append(User(**row))
+      with self._cache_fill_reads(), self._get_read_connection() as conn:
+        with conn.cursor(row_factory=args_row(User)) as cur:
+          cur.execute(sql, (band_id,), prepare=PREPARE)
+          users_list = cur.fetchall()
     except psycopg.Error as e:
-      print(f"データベースエラーが発生しました (get_users): {e}")
+      log_db_error("get_users", e, band_id=band_id)
+      return users_list
+
+    # メンバーの追加/脱退と、メンバーの名前の変更で破棄する
+    tags = (("members", band_id),) + tuple(("user", user.id) for user in users_list)
+    record_cache.put(key, tuple(users_list), tags, generation)
     return users_list
 
   # --- 内部ヘルパーメソッド ---
 
+  def _cache_fill_reads(self):
+    """キャッシュに入れる読み取りは、レプリカの遅延の影響を受けないようにプライマリで行う"""
+    return primary_reads() if record_cache.active else nullcontext()
+
   def _generate_token(self, length: int = 16) -> str:
     """指定された長さのランダムな英数字トークンを生成する"""
     alphabet = string.ascii_letters + string.digits
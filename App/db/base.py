@@ -1,13 +1,399 @@
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
 import psycopg
+import psycopg.sql
 from psycopg.rows import dict_row
-from const import DATABASE_URL
+from psycopg_pool import ConnectionPool
+from .log import log_db_error, log_error, mark_operation_start
+from const import (
+  DATABASE_POOL_MAX_SIZE, DATABASE_POOL_MIN_SIZE, DATABASE_PREPARED_STATEMENTS,
+  DATABASE_REPLICA_URLS, DATABASE_URL, REPLICA_MAX_LAG_SECONDS,
+)
+
+
+# プールを使う場合だけ、接続をまたいで使い回せるのでプリペアドステートメントを使う。
+# プールなしで毎回接続する場合は、準備の往復が増えるだけなので使わない
+USE_POOL = DATABASE_POOL_MAX_SIZE > 0
+PREPARE = USE_POOL and DATABASE_PREPARED_STATEMENTS
 
 
 def _get_connection():
   """
-  データベース接続を取得する。
+  書き込み用のデータベース接続を取得する (with文で使う)。
   結果が辞書形式で返されるように設定する。
+  ブロックを正常に抜けるとコミット、例外で抜けるとロールバックされる。
+  """
+  return _connect(DATABASE_URL)
+
+
+def _get_read_connection():
+  """
+  読み取り用のデータベース接続を取得する (with文で使う)。
+  レプリカが設定されていて十分に追いついていればレプリカに、そうでなければプライマリに接続する。
+  読み取りだけなのでautocommitにし、BEGIN/COMMITの往復を省く。
+  """
+  if _primary_reads.get():
+    return _connect(DATABASE_URL, autocommit=True)
+  return replica_router.connect_for_read()
+
+
+@contextmanager
+def primary_reads():
+  """
+  この中の読み取りをすべてプライマリで行う。
+  キャッシュに入れる値は、レプリカの遅延で古い内容のまま残らないようにプライマリから読む。
+  """
+  token = _primary_reads.set(True)
+  try:
+    yield
+  finally:
+    _primary_reads.reset(token)
+
+
+def select_list(columns: tuple[str, ...], alias: str | None = None) -> str:
+  """
+  SELECT する列の一覧を作る。
+  行は args_row でクラスの引数に位置で渡すので、columns はクラスの引数と同じ順番にする
+  """
+  if alias:
+    return ", ".join(f"{alias}.{column}" for column in columns)
+  return ", ".join(columns)
+
+
+# --- 発行したSQLの計測 ---
+
+class QueryStats:
+  """count_queries() の中で発行したSQLの数・取得した接続の数・SQLの実行時間を格納するためのデータクラス"""
+
+  __slots__ = ("statements", "connections", "seconds", "queries")
+
+  def __init__(self):
+    self.statements = 0
+    self.connections = 0
+    self.seconds = 0.0
+    # 発行したSQL (1行目だけ)。予算を超えたときに、どの文が増えたのかを示すために使う
+    self.queries: list[str] = []
+
+  def __repr__(self):
+    return f"QueryStats(statements={self.statements}, connections={self.connections}, seconds={self.seconds:.4f})"
+
+  def record(self, query, seconds: float) -> None:
+    text = query.as_string() if isinstance(query, psycopg.sql.Composable) else query
+    if isinstance(text, bytes):
+      text = text.decode(errors="replace")
+    self.statements += 1
+    self.seconds += seconds
+    self.queries.append(" ".join(str(text).split())[:200])
+
+
+_query_stats: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+
+@contextmanager
+def count_queries() -> Iterator[QueryStats]:
+  """
+  この中で発行したSQLと取得した接続を数える (同じスレッド・コンテキストの分だけ)。
+  計測していないときのコストは、文の実行ごとに ContextVar を1回読むだけ。
+  """
+  stats = QueryStats()
+  token = _query_stats.set(stats)
+  try:
+    yield stats
+  finally:
+    _query_stats.reset(token)
+
+
+class _CountingCursor(psycopg.Cursor):
+  """count_queries() の中では、実行した文の数と時間を記録するカーソル"""
+
+  def execute(self, query, params=None, **kwargs):
+    stats = _query_stats.get()
+    if stats is None:
+      return super().execute(query, params, **kwargs)
+    started = time.perf_counter()
+    try:
+      return super().execute(query, params, **kwargs)
+    finally:
+      stats.record(query, time.perf_counter() - started)
+
+  def executemany(self, query, params_seq, **kwargs):
+    stats = _query_stats.get()
+    if stats is None:
+      return super().executemany(query, params_seq, **kwargs)
+    started = time.perf_counter()
+    try:
+      return super().executemany(query, params_seq, **kwargs)
+    finally:
+      stats.record(query, time.perf_counter() - started)
+
+
+class _CountingServerCursor(psycopg.ServerCursor):
+  """サーバーサイドカーソル (iter_schedules) 用の _CountingCursor"""
+
+  def execute(self, query, params=None, **kwargs):
+    stats = _query_stats.get()
+    if stats is None:
+      return super().execute(query, params, **kwargs)
+    started = time.perf_counter()
+    try:
+      return super().execute(query, params, **kwargs)
+    finally:
+      stats.record(query, time.perf_counter() - started)
+
+
+def _configure(conn: psycopg.Connection) -> None:
+  """新しい接続に、文を数えるカーソルを設定する"""
+  conn.cursor_factory = _CountingCursor
+  conn.server_cursor_factory = _CountingServerCursor
+
+
+# --- コネクションプール ---
+
+_pools: dict[tuple[str, bool], ConnectionPool] = {}
+_pools_lock = threading.Lock()
+_pools_pid: int | None = None
+
+
+def _get_pool(dsn: str, autocommit: bool) -> ConnectionPool | None:
+  """接続先とautocommitの組み合わせごとのプールを返す。fork後の子プロセスでは作り直す"""
+  global _pools_pid
+  if not USE_POOL:
+    return None
+  with _pools_lock:
+    if _pools_pid != os.getpid():
+      # 親プロセスの接続は子プロセスで使ってはいけないので、閉じずに捨てる
+      _pools.clear()
+      _pools_pid = os.getpid()
+    pool = _pools.get((dsn, autocommit))
+    if pool is None:
+      pool = ConnectionPool(
+        dsn, min_size=DATABASE_POOL_MIN_SIZE, max_size=DATABASE_POOL_MAX_SIZE,
+        kwargs={"autocommit": autocommit, "row_factory": dict_row}, configure=_configure,
+        name=f"jappy-{'read' if autocommit else 'write'}-{len(_pools)}", open=True,
+      )
+      _pools[(dsn, autocommit)] = pool
+    return pool
+
+
+def open_pools() -> None:
+  """
+  プライマリへのプールをこのプロセスで作っておき、最初のリクエストで接続を待たないようにする。
+  fork 前のプロセスで呼んでも子プロセスでは作り直されるため、ワーカーの起動後に呼ぶ
+  """
+  _get_pool(DATABASE_URL, False)
+  _get_pool(DATABASE_URL, True)
+
+
+def close_pools() -> None:
+  """このプロセスのプールをすべて閉じる"""
+  with _pools_lock:
+    pools = list(_pools.values())
+    _pools.clear()
+  for pool in pools:
+    pool.close()
+
+
+@contextmanager
+def _connect(dsn: str, autocommit: bool = False) -> Iterator[psycopg.Connection]:
+  stats = _query_stats.get()
+  if stats is not None:
+    stats.connections += 1
+  # エラーのログの所要時間は、プールの空きを待つ時間も含めてここから測る
+  mark_operation_start()
+  pool = _get_pool(dsn, autocommit)
+  if pool is not None:
+    with pool.connection() as conn:
+      yield conn
+  else:
+    with psycopg.connect(dsn, autocommit=autocommit, row_factory=dict_row) as conn:
+      _configure(conn)
+      yield conn
+
+
+# --- レプリカへの振り分け ---
+
+# ログインユーザーが最後に書き込んだ時点のWAL位置 (LSN, 書き込んだ時刻)。
+# リクエストの開始時にセッションから復元し、終了時にセッションへ保存する
+_read_watermark: ContextVar[tuple[int, float] | None] = ContextVar("read_watermark", default=None)
+_primary_reads: ContextVar[bool] = ContextVar("primary_reads", default=False)
+
+
+def parse_lsn(lsn: str) -> int:
+  """'16/B374D848' の形式のLSNを比較できる整数に変換する"""
+  high, low = lsn.split("/")
+  return (int(high, 16) << 32) | int(low, 16)
+
+
+def format_lsn(lsn: int) -> str:
+  return f"{lsn >> 32:X}/{lsn & 0xFFFFFFFF:X}"
+
+
+def get_read_watermark() -> tuple[int, float] | None:
+  return _read_watermark.get()
+
+
+def set_read_watermark(watermark: tuple[int, float] | None) -> None:
+  _read_watermark.set(watermark)
+
+
+class _ReplicaState:
+  """レプリカごとの直近の状態を格納するためのデータクラス"""
+
+  def __init__(self, dsn: str):
+    self.dsn = dsn
+    self.lag = 0.0
+    self.replay_lsn = 0
+    self.checked_at = 0.0
+    self.failed_at = 0.0
+
+  def __repr__(self):
+    return (
+      f"_ReplicaState(lag={self.lag:.2f}, replay_lsn='{format_lsn(self.replay_lsn)}', "
+      f"checked_at={self.checked_at:.0f}, failed_at={self.failed_at:.0f})"
+    )
+
+
+class ReplicaRouter:
+  """
+  読み取りをレプリカに、書き込みをプライマリに振り分けるクラス。
+  - レプリカの遅延は数秒ごとに確認してキャッシュし、上限を超えていればプライマリで読む
+  - 書き込み直後のユーザーは、その書き込みのLSNまで再生済みのレプリカか、プライマリで読む (read-your-writes)
+  - 接続できないレプリカはしばらく使わない
   """
-  conn = psycopg.connect(DATABASE_URL)
-  conn.row_factory = dict_row # type: ignore
-  return conn
\ No newline at end of file
+
+  # 遅延の確認に使うクエリ。プライマリからWALを受信中 (streaming) で、受信したWALを再生しきっていれば、
+  # 最後の再生からの経過時間に関係なく遅延は0とみなす。
+  # 受信が止まっている (切断・再接続中) 場合は受信済みの位置が古いままなので、最後の再生からの経過時間を遅延とする。
+  # pg_stat_wal_receiver の status は pg_read_all_stats の権限がないと NULL になり、常に経過時間で判定する
+  STATUS_SQL = """
+    SELECT
+      pg_last_wal_replay_lsn()::text AS replay_lsn,
+      CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+          AND EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+      END AS lag;
+  """
+
+  def __init__(
+    self, primary_dsn: str, replica_dsns: list[str], max_lag: float,
+    check_interval: float = 2.0, retry_interval: float = 30.0,
+  ):
+    self._primary_dsn = primary_dsn
+    self._replicas = [_ReplicaState(dsn) for dsn in replica_dsns]
+    self._max_lag = max_lag
+    self._check_interval = check_interval
+    self._retry_interval = retry_interval
+    self._lock = threading.Lock()
+    self._cycle = itertools.cycle(range(len(self._replicas))) if self._replicas else None
+
+  @property
+  def enabled(self) -> bool:
+    return bool(self._replicas)
+
+  @contextmanager
+  def connect_for_read(self) -> Iterator[psycopg.Connection]:
+    watermark = self._current_watermark()
+    for state in self._candidates():
+      with ExitStack() as stack:
+        conn = self._try_replica(state, watermark, stack)
+        if conn is not None:
+          yield conn
+          return
+    with _connect(self._primary_dsn, autocommit=True) as conn:
+      yield conn
+
+  def record_write(self, conn: psycopg.Connection) -> None:
+    """
+    書き込みをコミットした直後に呼ぶ。プライマリの現在のLSNを、このリクエストの読み取りの下限として記録する。
+    レプリカを使っていない場合は何もしない。
+    """
+    if not self.enabled:
+      return
+    try:
+      row = conn.execute("SELECT pg_current_wal_lsn()::text AS lsn;").fetchone()
+    except psycopg.Error as e:
+      log_db_error("record_write", e)
+      return
+    lsn = parse_lsn(row["lsn"])
+    current = _read_watermark.get()
+    if current is None or current[0] < lsn:
+      _read_watermark.set((lsn, time.time()))
+
+  def status(self) -> list[_ReplicaState]:
+    with self._lock:
+      return list(self._replicas)
+
+  # --- 内部ヘルパーメソッド ---
+
+  def _current_watermark(self) -> int | None:
+    """
+    読み取りの下限となるLSNを返す。
+    書き込みから遅延の上限以上の時間がたっていれば、使えるレプリカはすでに追いついているので下限は不要。
+    """
+    watermark = _read_watermark.get()
+    if watermark is None:
+      return None
+    lsn, written_at = watermark
+    if time.time() - written_at > self._max_lag:
+      _read_watermark.set(None)
+      return None
+    return lsn
+
+  def _candidates(self) -> list[_ReplicaState]:
+    """ラウンドロビンの順に、使えそうなレプリカを返す"""
+    if not self._replicas:
+      return []
+    now = time.time()
+    with self._lock:
+      start = next(self._cycle)
+      ordered = self._replicas[start:] + self._replicas[:start]
+      return [
+        state for state in ordered
+        if now - state.failed_at > self._retry_interval
+        and (now - state.checked_at > self._check_interval or state.lag <= self._max_lag)
+      ]
+
+  def _try_replica(
+    self, state: _ReplicaState, watermark: int | None, stack: ExitStack
+  ) -> psycopg.Connection | None:
+    """使えるレプリカならその接続を返す。使えなければNoneを返し、接続はstackを抜けるときに返却される"""
+    try:
+      conn = stack.enter_context(_connect(state.dsn, autocommit=True))
+    except psycopg.Error as e:
+      log_error("レプリカに接続できませんでした。プライマリを使います", "replica_connect", e, logging.WARNING)
+      with self._lock:
+        state.failed_at = time.time()
+      return None
+
+    try:
+      now = time.time()
+      stale = now - state.checked_at > self._check_interval
+      behind = watermark is not None and state.replay_lsn < watermark
+      # 状態が古いか、キャッシュ上はまだ書き込みに追いついていない場合だけ確認する
+      if stale or behind:
+        row = conn.execute(self.STATUS_SQL, prepare=PREPARE).fetchone()
+        with self._lock:
+          state.lag = float(row["lag"] or 0)
+          state.replay_lsn = parse_lsn(row["replay_lsn"]) if row["replay_lsn"] else 0
+          state.checked_at = now
+
+      if state.lag > self._max_lag or (watermark is not None and state.replay_lsn < watermark):
+        return None
+      return conn
+    except psycopg.Error as e:
+      log_error("レプリカの状態を確認できませんでした。プライマリを使います", "replica_status", e, logging.WARNING)
+      with self._lock:
+        state.failed_at = time.time()
+      return None
+
+
+# プロセス内で共有するルーター
+replica_router = ReplicaRouter(DATABASE_URL, DATABASE_REPLICA_URLS, REPLICA_MAX_LAG_SECONDS)
@@ -0,0 +1,264 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Hashable
+
+from .events import (
+  BAND_CHANGED, BAND_DELETED, MEMBER_ADDED, MEMBER_REMOVED,
+  SCHEDULE_UPDATED, USER_CHANGED, USER_DELETED, Event, bus,
+)
+
+
+class FeedEntry:
+  """ユーザーごとのカレンダーフィードのキャッシュ内容を格納するためのデータクラス"""
+
+  def __init__(self, etag: str, body: bytes, band_ids: frozenset[int], built_on: date):
+    self.etag = etag
+    self.body = body
+    self.band_ids = band_ids
+    self.built_on = built_on
+
+  def __repr__(self):
+    return (
+      f"FeedEntry(etag='{self.etag}', size={len(self.body)}, "
+      f"band_ids={sorted(self.band_ids)}, built_on='{self.built_on}')"
+    )
+
+
+class FeedCache:
+  """
+  ユーザーごとのカレンダーフィード(ICS)をETagと一緒に保持するクラス。
+  バンド練の保存・メンバーの追加/脱退・バンドの変更の無効化イベントを受けたときだけ破棄する。
+  読み込み中に無効化が起きた場合に古い内容を書き戻さないよう、put には begin() の戻り値を渡す。
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._entries: dict[int, FeedEntry] = {}
+    self._generation = 0
+
+  def begin(self) -> int:
+    """DBから読み込む前に呼び、戻り値を put に渡す"""
+    with self._lock:
+      return self._generation
+
+  def get(self, user_id: int) -> FeedEntry | None:
+    """キャッシュを取得する。日付が変わったもの(直近の予定の範囲がずれる)は無効とする"""
+    # 他のワーカーの変更を受信できていない間は、古い内容を返さないようにキャッシュを使わない
+    if not bus.active:
+      return None
+    with self._lock:
+      entry = self._entries.get(user_id)
+      if entry and entry.built_on != date.today():
+        del self._entries[user_id]
+        return None
+      return entry
+
+  def put(
+    self, user_id: int, body: bytes, band_ids: frozenset[int], built_on: date, generation: int
+  ) -> FeedEntry:
+    """
+    フィードの内容をキャッシュし、内容から計算した強いETagを付けて返す。
+    読み込み中に無効化があった場合や作った日が今日でない場合は、返すだけでキャッシュしない。
+    """
+    entry = FeedEntry(
+      etag=hashlib.sha256(body).hexdigest()[:32],
+      body=body, band_ids=band_ids, built_on=built_on
+    )
+    if not bus.active or built_on != date.today():
+      return entry
+    with self._lock:
+      if generation == self._generation:
+        self._entries[user_id] = entry
+    return entry
+
+  def invalidate_user(self, user_id: int) -> None:
+    with self._lock:
+      self._generation += 1
+      self._entries.pop(user_id, None)
+
+  def invalidate_band(self, band_id: int) -> None:
+    with self._lock:
+      self._generation += 1
+      for user_id in [u for u, entry in self._entries.items() if band_id in entry.band_ids]:
+        del self._entries[user_id]
+
+  def clear(self) -> None:
+    with self._lock:
+      self._generation += 1
+      self._entries.clear()
+
+
+class PracticeEntry:
+  """ユーザーごとの今後のバンド練のキャッシュ内容を格納するためのデータクラス"""
+
+  def __init__(self, blocks: tuple, band_ids: frozenset[int], built_on: date):
+    self.blocks = blocks
+    self.band_ids = band_ids
+    self.built_on = built_on
+
+  def __repr__(self):
+    return f"PracticeEntry(blocks={len(self.blocks)}, band_ids={sorted(self.band_ids)}, built_on='{self.built_on}')"
+
+
+class PracticeCache:
+  """
+  ユーザーごとの今後のバンド練 (トップページに表示する) を保持するクラス。
+  所属する全てのバンド (アーカイブ済みを含む) のIDを一緒に持ち、
+  そのバンドのバンド練の保存・変更・削除、ユーザーのメンバーの追加/脱退の無効化イベントを受けたときだけ破棄する。
+  読み込み中に無効化が起きた場合に古い内容を書き戻さないよう、put には begin() の戻り値を渡す。
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._entries: dict[int, PracticeEntry] = {}
+    self._generation = 0
+
+  @property
+  def active(self) -> bool:
+    return bus.active
+
+  def begin(self) -> int:
+    """DBから読み込む前に呼び、戻り値を put に渡す"""
+    with self._lock:
+      return self._generation
+
+  def get(self, user_id: int) -> tuple | None:
+    """キャッシュを取得する。作った日から日付が変わったものは無効とする"""
+    if not bus.active:
+      return None
+    with self._lock:
+      entry = self._entries.get(user_id)
+      if entry and entry.built_on != date.today():
+        del self._entries[user_id]
+        return None
+      return entry.blocks if entry else None
+
+  def put(self, user_id: int, blocks: tuple, band_ids: frozenset[int], generation: int) -> None:
+    if not bus.active:
+      return
+    with self._lock:
+      if generation != self._generation:
+        return
+      self._entries[user_id] = PracticeEntry(blocks, band_ids, date.today())
+
+  def invalidate_user(self, user_id: int) -> None:
+    with self._lock:
+      self._generation += 1
+      self._entries.pop(user_id, None)
+
+  def invalidate_band(self, band_id: int) -> None:
+    with self._lock:
+      self._generation += 1
+      for user_id in [u for u, entry in self._entries.items() if band_id in entry.band_ids]:
+        del self._entries[user_id]
+
+  def clear(self) -> None:
+    with self._lock:
+      self._generation += 1
+      self._entries.clear()
+
+
+class RecordCache:
+  """
+  ユーザー・バンド・メンバー一覧などのレコードを保持するLRUキャッシュ。
+  各エントリには ("user", ユーザーID) のようなタグを付け、無効化イベントでタグ単位に破棄する。
+  読み込み中に無効化が起きた場合に古い内容を書き戻さないよう、put には begin() の戻り値を渡す。
+  """
+
+  def __init__(self, maxsize: int = 4096):
+    self._maxsize = maxsize
+    self._lock = threading.Lock()
+    self._entries: OrderedDict[Hashable, tuple[Any, tuple[Hashable, ...]]] = OrderedDict()
+    self._tags: dict[Hashable, set[Hashable]] = {}
+    self._generation = 0
+
+  @property
+  def active(self) -> bool:
+    return bus.active
+
+  def begin(self) -> int:
+    """DBから読み込む前に呼び、戻り値を put に渡す"""
+    with self._lock:
+      return self._generation
+
+  def get(self, key: Hashable) -> Any | None:
+    if not bus.active:
+      return None
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        return None
+      self._entries.move_to_end(key)
+      return entry[0]
+
+  def put(self, key: Hashable, value: Any, tags: tuple[Hashable, ...], generation: int) -> None:
+    if value is None or not bus.active:
+      return
+    with self._lock:
+      # 読み込み中に無効化があった場合、valueは古い可能性があるのでキャッシュしない
+      if generation != self._generation:
+        return
+      self._remove(key)
+      self._entries[key] = (value, tags)
+      for tag in tags:
+        self._tags.setdefault(tag, set()).add(key)
+      while len(self._entries) > self._maxsize:
+        self._remove(next(iter(self._entries)))
+
+  def invalidate(self, *tags: Hashable) -> None:
+    with self._lock:
+      self._generation += 1
+      for tag in tags:
+        for key in self._tags.pop(tag, set()):
+          self._remove(key)
+
+  def clear(self) -> None:
+    with self._lock:
+      self._generation += 1
+      self._entries.clear()
+      self._tags.clear()
+
+  def _remove(self, key: Hashable) -> None:
+    entry = self._entries.pop(key, None)
+    if entry is None:
+      return
+    for tag in entry[1]:
+      keys = self._tags.get(tag)
+      if keys is not None:
+        keys.discard(key)
+        if not keys:
+          del self._tags[tag]
+
+
+# プロセス内で共有するキャッシュ
+feed_cache = FeedCache()
+practice_cache = PracticeCache()
+record_cache = RecordCache()
+
+
+def _on_event(event: Event) -> None:
+  """無効化イベントに対応するキャッシュのエントリを破棄する"""
+  if event.kind in (USER_CHANGED, USER_DELETED):
+    record_cache.invalidate(("user", event.user_id))
+    if event.kind == USER_DELETED:
+      feed_cache.invalidate_user(event.user_id)
+      practice_cache.invalidate_user(event.user_id)
+  elif event.kind in (BAND_CHANGED, BAND_DELETED):
+    record_cache.invalidate(("band", event.band_id), ("members", event.band_id))
+    feed_cache.invalidate_band(event.band_id)
+    practice_cache.invalidate_band(event.band_id)
+  elif event.kind in (MEMBER_ADDED, MEMBER_REMOVED):
+    record_cache.invalidate(("members", event.band_id))
+    feed_cache.invalidate_user(event.user_id)
+    practice_cache.invalidate_user(event.user_id)
+  elif event.kind == SCHEDULE_UPDATED and event.user_id == 0:
+    feed_cache.invalidate_band(event.band_id)
+    practice_cache.invalidate_band(event.band_id)
+
+
+bus.subscribe(_on_event)
+bus.on_flush(feed_cache.clear)
+bus.on_flush(practice_cache.clear)
+bus.on_flush(record_cache.clear)
@@ -0,0 +1,239 @@
+import json
+import threading
+from datetime import date
+from typing import Literal
+
+import psycopg
+
+from .base import _get_connection
+from .events import (
+  BAND_CHANGED, BAND_DELETED, MEMBER_ADDED, MEMBER_REMOVED,
+  SCHEDULE_UPDATED, USER_DELETED, Event, bus,
+)
+from .log import log_db_error
+
+
+Slot = tuple[date, int]
+
+
+class ConflictIndex:
+  """
+  ユーザーごとに「所属バンドのバンド練で埋まっている枠」を保持し、バンド間の重複を検出するクラス。
+  ユーザーの情報は初めて参照されたときに1クエリでまとめて読み込み、
+  以降はバンド練の保存・メンバーの追加/脱退のたびに差分だけを反映する。
+  読み込み中に更新があった場合に古い内容を書き戻さないよう、更新のたびに世代を進め、読み込みの前後で比べる。
+  """
+
+  def __init__(self):
+    self._get_connection = _get_connection
+    self._lock = threading.Lock()
+    self._band_slots: dict[int, frozenset[Slot]] = {}
+    self._user_bands: dict[int, set[int]] = {}
+    self._band_users: dict[int, set[int]] = {}
+    self._committed: dict[int, dict[Slot, set[int]]] = {}
+    self._generation = 0
+
+  # --- 更新の通知 ---
+
+  def practice_updated(self, band_id: int, schedule: dict[date, list[Literal[0, 1]]]) -> None:
+    """バンド練のスケジュールが保存されたときに呼ぶ"""
+    new_slots = self._to_slots(schedule)
+    with self._lock:
+      self._generation += 1
+      old_slots = self._band_slots.get(band_id, frozenset())
+      self._band_slots[band_id] = new_slots
+      for user_id in self._band_users.get(band_id, ()):
+        committed = self._committed[user_id]
+        for slot in old_slots - new_slots:
+          self._discard(committed, slot, band_id)
+        for slot in new_slots - old_slots:
+          committed.setdefault(slot, set()).add(band_id)
+
+  def member_added(self, user_id: int, band_id: int) -> None:
+    """ユーザーがバンドに参加したときに呼ぶ"""
+    with self._lock:
+      self._generation += 1
+      if user_id not in self._committed:
+        return
+      if band_id not in self._band_slots:
+        # バンド練の内容が未読み込みなら、次回参照時に読み込み直す
+        self._forget_user(user_id)
+        return
+      self._user_bands[user_id].add(band_id)
+      self._band_users.setdefault(band_id, set()).add(user_id)
+      committed = self._committed[user_id]
+      for slot in self._band_slots[band_id]:
+        committed.setdefault(slot, set()).add(band_id)
+
+  def member_removed(self, user_id: int, band_id: int) -> None:
+    """ユーザーがバンドから脱退したときに呼ぶ"""
+    with self._lock:
+      self._generation += 1
+      if user_id not in self._committed:
+        return
+      self._user_bands[user_id].discard(band_id)
+      self._band_users.get(band_id, set()).discard(user_id)
+      committed = self._committed[user_id]
+      for slot in self._band_slots.get(band_id, ()):
+        self._discard(committed, slot, band_id)
+
+  def band_changed(self, band_id: int) -> None:
+    """バンドの削除・アーカイブ状態の変更時に呼ぶ。関係するユーザーは次回参照時に読み込み直す"""
+    with self._lock:
+      self._generation += 1
+      for user_id in list(self._band_users.get(band_id, ())):
+        self._forget_user(user_id)
+      self._band_users.pop(band_id, None)
+      self._band_slots.pop(band_id, None)
+
+  def user_removed(self, user_id: int) -> None:
+    """ユーザーが削除されたときに呼ぶ"""
+    with self._lock:
+      self._generation += 1
+      self._forget_user(user_id)
+
+  def clear(self) -> None:
+    """保持している情報をすべて破棄する"""
+    with self._lock:
+      self._generation += 1
+      self._band_slots.clear()
+      self._user_bands.clear()
+      self._band_users.clear()
+      self._committed.clear()
+
+  # --- 参照 ---
+
+  def conflicts(self, user_ids: list[int], band_id: int) -> dict[int, dict[Slot, list[int]]]:
+    """
+    各ユーザーについて、band_id以外の所属バンドのバンド練が入っている枠を
+    {ユーザーID: {(日付, 時): [バンドID, ...]}} の形で返す
+    """
+    self._load([user_id for user_id in user_ids if user_id not in self._committed])
+
+    result: dict[int, dict[Slot, list[int]]] = {}
+    with self._lock:
+      for user_id in user_ids:
+        committed = self._committed.get(user_id, {})
+        slots = {
+          slot: sorted(band_ids - {band_id})
+          for slot, band_ids in committed.items()
+          if band_ids - {band_id}
+        }
+        if slots:
+          result[user_id] = slots
+    return result
+
+  def conflicts_by_slot(self, user_ids: list[int], band_id: int) -> dict[Slot, list[int]]:
+    """他バンドのバンド練と重なっている枠ごとに、該当するユーザーIDのリストを返す"""
+    by_slot: dict[Slot, list[int]] = {}
+    for user_id, slots in self.conflicts(user_ids, band_id).items():
+      for slot in slots:
+        by_slot.setdefault(slot, []).append(user_id)
+    return by_slot
+
+  # --- 内部ヘルパーメソッド ---
+
+  def _load(self, user_ids: list[int], retries: int = 1) -> None:
+    """
+    未読み込みのユーザーの所属バンドとバンド練を1クエリでまとめて読み込む。
+    読み込み中に更新があった場合は、読み込んだ内容が古い可能性があるので捨てて retries 回まで読み込み直す。
+    """
+    if not user_ids:
+      return
+
+    sql = """
+      SELECT bu.user_id, bu.band_id, s.schedule
+      FROM band_user bu
+      JOIN bands b ON b.id = bu.band_id
+      LEFT JOIN schedules s ON s.band_id = bu.band_id AND s.user_id = 0
+      WHERE bu.user_id = ANY(%s) AND NOT b.archived;
+    """
+    with self._lock:
+      generation = self._generation
+    try:
+      # インデックスは更新イベントで差分を反映していくので、遅延のないプライマリから読み込む
+      with self._get_connection() as conn:
+        with conn.cursor() as cur:
+          cur.execute(sql, (user_ids,))
+          rows = cur.fetchall()
+    except psycopg.Error as e:
+      log_db_error("conflict_index", e, users=len(user_ids))
+      return
+
+    with self._lock:
+      if generation == self._generation:
+        self._store(user_ids, rows)
+        return
+
+    if retries > 0:
+      self._load([user_id for user_id in user_ids if user_id not in self._committed], retries - 1)
+
+  def _store(self, user_ids: list[int], rows: list[dict]) -> None:
+    """読み込んだ所属バンドとバンド練をインデックスに反映する (ロックを取得した状態で呼ぶ)"""
+    for user_id in user_ids:
+      self._user_bands[user_id] = set()
+      self._committed[user_id] = {}
+
+    for row in rows:
+      user_id, band_id = row['user_id'], row['band_id']
+      if band_id not in self._band_slots:
+        self._band_slots[band_id] = self._to_slots(row['schedule'])
+      self._user_bands[user_id].add(band_id)
+      self._band_users.setdefault(band_id, set()).add(user_id)
+      committed = self._committed[user_id]
+      for slot in self._band_slots[band_id]:
+        committed.setdefault(slot, set()).add(band_id)
+
+  def _forget_user(self, user_id: int) -> None:
+    for band_id in self._user_bands.pop(user_id, ()):
+      self._band_users.get(band_id, set()).discard(user_id)
+    self._committed.pop(user_id, None)
+
+  def _discard(self, committed: dict[Slot, set[int]], slot: Slot, band_id: int) -> None:
+    band_ids = committed.get(slot)
+    if band_ids is not None:
+      band_ids.discard(band_id)
+      if not band_ids:
+        del committed[slot]
+
+  def _to_slots(self, schedule: dict | str | None) -> frozenset[Slot]:
+    """schedule辞書(キーはdateまたはISO形式の文字列)を (日付, 時) の集合に変換する"""
+    if not schedule:
+      return frozenset()
+    if isinstance(schedule, str):
+      schedule = json.loads(schedule)
+
+    slots = set()
+    for day, hour_list in schedule.items():
+      if isinstance(day, str):
+        day = date.fromisoformat(day)
+      slots.update((day, hour) for hour, is_practice in enumerate(hour_list) if is_practice)
+    return frozenset(slots)
+
+
+# プロセス内で共有するインデックス
+conflict_index = ConflictIndex()
+
+
+def _on_event(event: Event) -> None:
+  """無効化イベントをインデックスに反映する"""
+  if event.kind == SCHEDULE_UPDATED:
+    if event.user_id != 0:
+      return
+    if event.schedule is not None:
+      conflict_index.practice_updated(event.band_id, event.schedule)
+    else:
+      # 他のワーカーからの通知にはスケジュールの内容が含まれないため、次回参照時に読み込み直す
+      conflict_index.band_changed(event.band_id)
+  elif event.kind == MEMBER_ADDED:
+    conflict_index.member_added(event.user_id, event.band_id)
+  elif event.kind == MEMBER_REMOVED:
+    conflict_index.member_removed(event.user_id, event.band_id)
+  elif event.kind in (BAND_CHANGED, BAND_DELETED):
+    conflict_index.band_changed(event.band_id)
+  elif event.kind == USER_DELETED:
+    conflict_index.user_removed(event.user_id)
+
+
+bus.subscribe(_on_event)
+bus.on_flush(conflict_index.clear)
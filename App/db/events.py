@@ -0,0 +1,173 @@
+import json
+import logging
+import os
+import socket
+import threading
+from typing import Any, Callable
+
+import psycopg
+
+from .base import replica_router
+from .log import log_error
+from .notify import listener, notify
+
+
+# 無効化イベントの種類
+USER_CHANGED = "user_changed"
+USER_DELETED = "user_deleted"
+BAND_CHANGED = "band_changed"
+BAND_DELETED = "band_deleted"
+MEMBER_ADDED = "member_added"
+MEMBER_REMOVED = "member_removed"
+SCHEDULE_UPDATED = "schedule_updated"
+SCHEDULES_DELETED = "schedules_deleted"
+
+EVENT_KINDS = frozenset({
+  USER_CHANGED, USER_DELETED, BAND_CHANGED, BAND_DELETED,
+  MEMBER_ADDED, MEMBER_REMOVED, SCHEDULE_UPDATED, SCHEDULES_DELETED,
+})
+
+# 無効化イベントの通知チャンネル
+INVALIDATION_CHANNEL = "cache_invalidation"
+
+
+class Event:
+  """
+  キャッシュの無効化イベントを格納するためのデータクラス。
+  schedule は同じプロセス内でだけ渡される付加情報で、通知(NOTIFY)には含めない。
+  """
+
+  def __init__(
+    self, kind: str, user_id: int | None = None, band_id: int | None = None,
+    schedule: dict | None = None,
+  ):
+    if kind not in EVENT_KINDS:
+      raise ValueError(f"不明なイベントです: {kind}")
+    self.kind = kind
+    self.user_id = user_id
+    self.band_id = band_id
+    self.schedule = schedule
+
+  def __repr__(self):
+    return f"Event(kind='{self.kind}', user_id={self.user_id}, band_id={self.band_id})"
+
+  def to_payload(self, origin: str) -> dict[str, Any]:
+    return {"kind": self.kind, "user_id": self.user_id, "band_id": self.band_id, "origin": origin}
+
+  @classmethod
+  def from_payload(cls, payload: dict) -> "Event":
+    return cls(payload["kind"], user_id=payload.get("user_id"), band_id=payload.get("band_id"))
+
+
+class InvalidationBus:
+  """
+  ワーカープロセス間でキャッシュの無効化を伝えるクラス。
+  書き込み処理はコミットと同時にイベントを通知し、自分のプロセスではコミット直後に、
+  他のプロセスではLISTENしている接続経由で、購読者(各キャッシュ)にイベントを配る。
+  通知の受信が途切れている間はイベントを取りこぼすため、再接続時に全キャッシュを破棄する。
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._handlers: list[tuple[Callable[[Event], None], frozenset[str] | None]] = []
+    self._flush_handlers: list[Callable[[], None]] = []
+    self._listening = False
+
+  def subscribe(self, handler: Callable[[Event], None], kinds: set[str] | None = None) -> None:
+    """イベントを購読する。kindsを指定した場合はその種類のイベントだけを受け取る"""
+    with self._lock:
+      self._handlers.append((handler, frozenset(kinds) if kinds else None))
+
+  def on_flush(self, handler: Callable[[], None]) -> None:
+    """イベントを取りこぼした可能性があるときに呼ばれる、キャッシュを全て破棄するコールバックを登録する"""
+    with self._lock:
+      self._flush_handlers.append(handler)
+
+  def start(self) -> None:
+    """このプロセスで他のワーカーからの通知の受信を始める (何度呼んでもよい)"""
+    with self._lock:
+      listening, self._listening = self._listening, True
+    if not listening:
+      listener.subscribe(INVALIDATION_CHANNEL, self._on_notify)
+      listener.on_reconnect(self.flush)
+    listener.start()
+
+  def stop(self) -> None:
+    """受信スレッドを止める (ワーカーの終了時に呼ぶ)"""
+    listener.stop()
+
+  @property
+  def active(self) -> bool:
+    """他のワーカーからの通知を受信できている間だけTrue。Falseの間はキャッシュを使ってはいけない"""
+    return listener.connected
+
+  def commit(self, conn: psycopg.Connection, *events: Event) -> None:
+    """
+    イベントを通知してトランザクションをコミットし、このプロセスの購読者にも配る。
+    通知はコミットされたときにだけ他のワーカーへ配信される。
+    パイプラインモードの中で呼ぶと、それまでの文・通知・COMMITが1回の往復で送られる。
+    """
+    origin = self._origin()
+    for event in events:
+      notify(conn, INVALIDATION_CHANNEL, event.to_payload(origin))
+    conn.commit()
+    self.committed(conn, *events)
+
+  def payload(self, event: Event) -> str:
+    """
+    SQLの中で pg_notify(INVALIDATION_CHANNEL, ...) に渡す通知の内容。
+    書き込みと同じ文で通知を送った場合は、コミット後に committed() を呼ぶ。
+    """
+    return json.dumps(event.to_payload(self._origin()))
+
+  def committed(self, conn: psycopg.Connection, *events: Event) -> None:
+    """通知を含むトランザクションをコミットした後に呼び、このプロセスの購読者にも配る"""
+    # このリクエストの以降の読み取りが、レプリカでもこの書き込みを必ず読めるようにする
+    replica_router.record_write(conn)
+    for event in events:
+      self.dispatch(event)
+
+  def dispatch(self, event: Event) -> None:
+    """このプロセスの購読者にイベントを配る"""
+    with self._lock:
+      handlers = [handler for handler, kinds in self._handlers if kinds is None or event.kind in kinds]
+    for handler in handlers:
+      try:
+        handler(event)
+      except Exception as e:
+        log_error(
+          "キャッシュの無効化中にエラーが発生しました", "dispatch", e,
+          kind=event.kind, user_id=event.user_id, band_id=event.band_id,
+        )
+
+  def flush(self) -> None:
+    """全ての購読者のキャッシュを破棄する"""
+    with self._lock:
+      handlers = list(self._flush_handlers)
+    for handler in handlers:
+      try:
+        handler()
+      except Exception as e:
+        log_error("キャッシュの破棄中にエラーが発生しました", "flush", e)
+
+  # --- 内部ヘルパーメソッド ---
+
+  def _origin(self) -> str:
+    # fork後はPIDが変わるため、毎回求める
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+  def _on_notify(self, payload: dict) -> None:
+    # 自分のプロセスのイベントはコミット直後に配り済み
+    if payload.get("origin") == self._origin():
+      return
+    try:
+      event = Event.from_payload(payload)
+    except (KeyError, ValueError) as e:
+      log_error("不正な無効化イベントを受信しました", "_on_notify", e, logging.WARNING, payload=payload)
+      self.flush()
+      return
+    self.dispatch(event)
+
+
+# プロセス内で共有するバス
+bus = InvalidationBus()
@@ -0,0 +1,197 @@
+import psycopg
+from psycopg.rows import args_row
+from psycopg.types.json import Jsonb
+
+from .base import PREPARE, _get_connection, _get_read_connection, select_list
+from .log import log_db_error
+from .notify import notify
+
+# 新しいジョブを知らせる通知チャンネル
+JOBS_CHANNEL = "jobs"
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class Job:
+  """バックグラウンドジョブを格納するためのデータクラス"""
+
+  __slots__ = ("id", "kind", "payload", "status", "attempts", "max_attempts", "last_error", "created_by")
+
+  def __init__(
+    self, id: int, kind: str, payload: dict, status: str,
+    attempts: int, max_attempts: int, last_error: str | None, created_by: int | None,
+  ):
+    self.id = id
+    self.kind = kind
+    self.payload = payload
+    self.status = status
+    self.attempts = attempts
+    self.max_attempts = max_attempts
+    self.last_error = last_error
+    self.created_by = created_by
+
+  def __repr__(self):
+    return f"Job(id={self.id}, kind='{self.kind}', status='{self.status}', attempts={self.attempts})"
+
+
+# Job の引数と同じ順番
+JOB_COLUMNS = Job.__slots__
+
+
+class JobDatabaseManager:
+  """バックグラウンドジョブ (jobs) の操作を管理するクラス"""
+
+  def __init__(self):
+    self._get_connection = _get_connection
+    self._get_read_connection = _get_read_connection
+
+  # --- 書き込み操作 (Create, Update, Delete) ---
+
+  def enqueue(
+    self, kind: str, payload: dict, max_attempts: int,
+    idempotency_key: str | None = None, created_by: int | None = None,
+  ) -> Job | None:
+    """
+    ジョブを登録する。同じ idempotency_key のジョブが既にあれば、新しく作らずにそのジョブを返す
+    (再実行の上限に達して失敗していたジョブは、最初から実行し直す)。
+    コミットと同時に、待機中のワーカーへ通知する。
+    """
+    try:
+      with self._get_connection() as conn:
+        # INSERT・通知・COMMITを1回の往復で送る
+        with conn.pipeline():
+          cur = self.enqueue_in(conn, kind, payload, max_attempts, idempotency_key, created_by)
+          conn.commit()
+        return cur.fetchone()
+    except psycopg.Error as e:
+      log_db_error("enqueue", e, kind=kind, user_id=created_by)
+      return None
+
+
+  def enqueue_in(
+    self, conn: psycopg.Connection, kind: str, payload: dict, max_attempts: int,
+    idempotency_key: str | None = None, created_by: int | None = None,
+  ) -> psycopg.Cursor:
+    """
+    conn のトランザクションの中でジョブを登録し、通知を送る (コミットは呼び出し側で行う)。
+    他の書き込みと同じトランザクションで登録すれば、書き込みだけが残ってジョブがない状態にならない。
+    登録したジョブを fetchone() で返すカーソルを返す。
+    """
+    # 既にある場合は (失敗していなければ) 何も変えない UPDATE で行を返させ、1つの文で登録と既存のジョブの取得を行う
+    sql = f"""
+      INSERT INTO jobs (kind, payload, max_attempts, idempotency_key, created_by)
+      VALUES (%s, %s, %s, %s, %s)
+      ON CONFLICT (idempotency_key) DO UPDATE
+      SET status = CASE WHEN jobs.status = '{FAILED}' THEN '{QUEUED}' ELSE jobs.status END,
+          attempts = CASE WHEN jobs.status = '{FAILED}' THEN 0 ELSE jobs.attempts END,
+          run_at = CASE WHEN jobs.status = '{FAILED}' THEN now() ELSE jobs.run_at END,
+          updated_at = CASE WHEN jobs.status = '{FAILED}' THEN now() ELSE jobs.updated_at END
+      RETURNING {select_list(JOB_COLUMNS)};
+    """
+    cur = conn.cursor(row_factory=args_row(Job))
+    cur.execute(sql, (kind, Jsonb(payload), max_attempts, idempotency_key, created_by), prepare=PREPARE)
+    notify(conn, JOBS_CHANNEL, {"kind": kind})
+    return cur
+
+
+  def claim(self, lease_seconds: int) -> Job | None:
+    """
+    実行できるジョブを1つ取り出して実行中にする。
+    待機中で実行時刻を過ぎたジョブと、実行中のまま期限が切れた (ワーカーが落ちた) ジョブが対象。
+    期限が切れたジョブのうち、再実行の上限に達しているものは取り出さずに失敗にする。
+    SKIP LOCKED で他のワーカーが取り出し中の行は飛ばすので、複数のワーカーが同時に呼んでも待たない。
+    """
+    expire_sql = f"""
+      UPDATE jobs
+      SET status = '{FAILED}', locked_until = NULL,
+          last_error = COALESCE(last_error, 'lease expired'), updated_at = now()
+      WHERE status = '{RUNNING}' AND locked_until < now() AND attempts >= max_attempts;
+    """
+    sql = f"""
+      UPDATE jobs
+      SET status = '{RUNNING}', attempts = attempts + 1,
+          locked_until = now() + make_interval(secs => %s), updated_at = now()
+      WHERE id = (
+        SELECT id FROM jobs
+        WHERE status IN ('{QUEUED}', '{RUNNING}')
+          AND run_at <= now()
+          AND (status = '{QUEUED}' OR (locked_until < now() AND attempts < max_attempts))
+        ORDER BY run_at
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+      )
+      RETURNING {select_list(JOB_COLUMNS)};
+    """
+    try:
+      with self._get_connection() as conn:
+        with conn.cursor(row_factory=args_row(Job)) as cur:
+          # 上限に達したジョブの失敗と取り出しを1回の往復で送る
+          with conn.pipeline():
+            conn.execute(expire_sql, prepare=PREPARE)
+            cur.execute(sql, (lease_seconds,), prepare=PREPARE)
+          return cur.fetchone()
+    except psycopg.Error as e:
+      log_db_error("claim", e)
+      return None
+
+
+  def complete(self, job_id: int, attempts: int) -> bool:
+    """
+    ジョブを完了にする。attempts は claim で取り出したときの値で、
+    期限が切れて他のワーカーが取り出し直していた場合は何もせず False を返す。
+    """
+    sql = f"""
+      UPDATE jobs
+      SET status = '{DONE}', locked_until = NULL, last_error = NULL, updated_at = now()
+      WHERE id = %s AND status = '{RUNNING}' AND attempts = %s;
+    """
+    try:
+      with self._get_connection() as conn:
+        with conn.cursor() as cur:
+          cur.execute(sql, (job_id, attempts), prepare=PREPARE)
+          return cur.rowcount > 0
+    except psycopg.Error as e:
+      log_db_error("complete", e, job_id=job_id)
+      return False
+
+
+  def fail(self, job_id: int, attempts: int, error: str, retry_in_seconds: float) -> str | None:
+    """
+    ジョブの失敗を記録する。再実行の上限に達していなければ retry_in_seconds 秒後に再実行する。
+    失敗後のステータス (queued または failed) を返す。
+    attempts は claim で取り出したときの値で、期限が切れて他のワーカーが取り出し直していた場合は何もせず None を返す。
+    """
+    sql = f"""
+      UPDATE jobs
+      SET status = CASE WHEN attempts >= max_attempts THEN '{FAILED}' ELSE '{QUEUED}' END,
+          run_at = now() + make_interval(secs => %s),
+          locked_until = NULL, last_error = %s, updated_at = now()
+      WHERE id = %s AND status = '{RUNNING}' AND attempts = %s
+      RETURNING status;
+    """
+    try:
+      with self._get_connection() as conn:
+        with conn.cursor() as cur:
+          cur.execute(sql, (retry_in_seconds, error, job_id, attempts), prepare=PREPARE)
+          row = cur.fetchone()
+          return row["status"] if row else None
+    except psycopg.Error as e:
+      log_db_error("fail", e, job_id=job_id)
+      return None
+
+  # --- 読み取り操作 (Read) ---
+
+  def get_job(self, job_id: int) -> Job | None:
+    """IDを指定してジョブを取得する (状態の確認用なので、書き込み直後でも読めるようプライマリから読む)"""
+    sql = f"SELECT {select_list(JOB_COLUMNS)} FROM jobs WHERE id = %s;"
+    try:
+      with self._get_connection() as conn:
+        with conn.cursor(row_factory=args_row(Job)) as cur:
+          cur.execute(sql, (job_id,), prepare=PREPARE)
+          return cur.fetchone()
+    except psycopg.Error as e:
+      log_db_error("get_job", e, job_id=job_id)
+      return None
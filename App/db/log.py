@@ -0,0 +1,174 @@
+"""
+データベース層のログ。
+
+ログはキューに入れるだけで、標準エラー出力への書き込みは別のスレッド (QueueListener) が行う。
+DBの障害で全てのリクエストが同時にエラーを出しても、リクエストは出力を待たない (キューがあふれた分は捨てて数える)。
+1行に1つのJSONで、メソッド名・ユーザーID/バンドID・エラーの種類・所要時間などを項目として出力する。
+同じメソッドの同じ種類のエラーは一定時間に数件だけ出力し、抑えた件数は次に出力するログの suppressed に入れる。
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from const import LOG_QUEUE_SIZE, LOG_RATE_LIMIT_BURST, LOG_RATE_LIMIT_WINDOW_SECONDS
+
+
+logger = logging.getLogger("jappy.db")
+
+# 直近で接続を取得し始めた時刻。エラーのログの所要時間 (接続の待ち時間を含む) に使う
+_operation_started: ContextVar[float | None] = ContextVar("operation_started", default=None)
+
+
+def mark_operation_start() -> None:
+  """接続を取得する直前に呼ぶ"""
+  _operation_started.set(time.perf_counter())
+
+
+class JsonFormatter(logging.Formatter):
+  """ログを1行のJSONにする"""
+
+  def format(self, record: logging.LogRecord) -> str:
+    entry = {
+      "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+      "level": record.levelname,
+      "logger": record.name,
+      "message": record.getMessage(),
+      **getattr(record, "fields", {}),
+    }
+    return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+  """
+  同じキー (メソッド, エラーの種類) のログを window 秒に burst 件までにする。
+  キューに入れる前 (ログを出したスレッド) で判定するので、抑えたログはキューにも入らない。
+  """
+
+  def __init__(self, burst: int = LOG_RATE_LIMIT_BURST, window: float = LOG_RATE_LIMIT_WINDOW_SECONDS):
+    super().__init__()
+    self._burst = burst
+    self._window = window
+    self._lock = threading.Lock()
+    # キー -> [期間の開始時刻, 期間内に出力した件数, 抑えた件数]
+    self._windows: dict[tuple, list] = {}
+
+  def filter(self, record: logging.LogRecord) -> bool:
+    fields = getattr(record, "fields", None)
+    if not fields or self._burst <= 0:
+      return True
+    key = (record.levelno, fields.get("method"), fields.get("error"), fields.get("sqlstate"))
+    now = time.monotonic()
+    with self._lock:
+      state = self._windows.get(key)
+      if state is None or now - state[0] >= self._window:
+        if len(self._windows) > 1000:
+          self._windows = {k: v for k, v in self._windows.items() if now - v[0] < self._window}
+        suppressed = state[2] if state else 0
+        state = self._windows[key] = [now, 0, 0]
+      else:
+        suppressed = 0
+      if state[1] >= self._burst:
+        state[2] += 1
+        return False
+      state[1] += 1
+    if suppressed:
+      record.fields = {**fields, "suppressed": suppressed}
+    return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+  """キューがいっぱいのときは待たずに捨てて、捨てた件数を次のログに付けるハンドラ"""
+
+  def __init__(self, log_queue: queue.Queue):
+    super().__init__(log_queue)
+    self.dropped = 0
+
+  def enqueue(self, record: logging.LogRecord) -> None:
+    if self.dropped:
+      record.fields = {**getattr(record, "fields", {}), "dropped": self.dropped}
+    try:
+      self.queue.put_nowait(record)
+      self.dropped = 0
+    except queue.Full:
+      self.dropped += 1
+
+
+class _LogWriter:
+  """キューからログを取り出して書き込むスレッドを、プロセスごとに1つ起動する"""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._pid: int | None = None
+    self._listener: logging.handlers.QueueListener | None = None
+    self._handler: DroppingQueueHandler | None = None
+
+  def ensure_started(self) -> None:
+    # fork後の子プロセスにはスレッドが引き継がれないため、プロセスごとに作り直す
+    if self._pid == os.getpid():
+      return
+    with self._lock:
+      if self._pid == os.getpid():
+        return
+      log_queue: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+      output = logging.StreamHandler(sys.stderr)
+      output.setFormatter(JsonFormatter())
+      handler = DroppingQueueHandler(log_queue)
+      handler.addFilter(RateLimitFilter())
+
+      if self._handler is not None:
+        logger.removeHandler(self._handler)
+      logger.addHandler(handler)
+      logger.setLevel(logging.INFO)
+      logger.propagate = False
+
+      self._listener = logging.handlers.QueueListener(log_queue, output)
+      self._listener.start()
+      self._handler = handler
+      if self._pid is None:
+        atexit.register(self.stop)
+      self._pid = os.getpid()
+
+  def stop(self) -> None:
+    """キューに残っているログを書き出してからスレッドを止める"""
+    with self._lock:
+      if self._listener is not None and self._pid == os.getpid():
+        self._listener.stop()
+      self._pid = None
+
+
+log_writer = _LogWriter()
+
+
+def log_event(message: str, level: int = logging.WARNING, **fields) -> None:
+  """項目付きのログをキューに入れる (値が None の項目は出力しない)"""
+  log_writer.ensure_started()
+  logger.log(level, message, extra={"fields": {k: v for k, v in fields.items() if v is not None}})
+
+
+def log_error(message: str, method: str, error: BaseException, level: int = logging.ERROR, **fields) -> None:
+  """
+  例外を記録する。例外の種類・SQLSTATE と、このコンテキストで最後に接続を取得し始めてからの時間を項目に加える。
+  """
+  started = _operation_started.get()
+  log_event(
+    message, level,
+    method=method,
+    error=type(error).__name__,
+    sqlstate=getattr(error, "sqlstate", None),
+    detail=str(error).strip()[:500],
+    duration_ms=round((time.perf_counter() - started) * 1000, 1) if started is not None else None,
+    **fields,
+  )
+
+
+def log_db_error(method: str, error: BaseException, level: int = logging.ERROR, **fields) -> None:
+  """データベースの操作のエラーを記録する"""
+  log_error("データベースエラーが発生しました", method, error, level, **fields)
@@ -0,0 +1,133 @@
+import json
+import logging
+import os
+import threading
+from typing import Callable
+
+import psycopg
+from psycopg import sql
+
+from .log import log_error
+from const import DATABASE_URL
+
+
+class NotificationListener:
+  """
+  PostgreSQLのLISTEN/NOTIFYを受信するクラス。
+  プロセスごとに専用の接続とスレッドを1つだけ持ち、受信した通知を購読者のコールバックに配る。
+  接続が切れた場合は再接続し、その間に取りこぼした可能性があることを on_reconnect で知らせる。
+  1つの接続でLISTENするので、購読するチャンネルが増えても接続やスレッドは増えない。
+  """
+
+  def __init__(self, dsn: str = DATABASE_URL, poll_timeout: float = 5.0, max_backoff: float = 30.0):
+    self._dsn = dsn
+    self._poll_timeout = poll_timeout
+    self._max_backoff = max_backoff
+    self._lock = threading.Lock()
+    self._handlers: dict[str, list[Callable[[dict], None]]] = {}
+    self._reconnect_handlers: list[Callable[[], None]] = []
+    self._thread: threading.Thread | None = None
+    self._stopping = threading.Event()
+    self._pid: int | None = None
+    self._connected = False
+
+  @property
+  def connected(self) -> bool:
+    """LISTENしている接続が生きていて、通知を受信できる状態かどうか"""
+    return self._connected and self._pid == os.getpid()
+
+  def subscribe(self, channel: str, handler: Callable[[dict], None]) -> None:
+    """チャンネルの通知を購読する。通知のpayload(JSON)はdictにして渡す"""
+    with self._lock:
+      self._handlers.setdefault(channel, []).append(handler)
+    self.start()
+
+  def on_reconnect(self, handler: Callable[[], None]) -> None:
+    """
+    接続したとき(=それまでの通知を取りこぼした可能性があるとき)に呼ばれるコールバックを登録する。
+    最初の接続でも呼ばれる。
+    """
+    with self._lock:
+      self._reconnect_handlers.append(handler)
+
+  def start(self) -> None:
+    """受信スレッドを起動する。fork後の子プロセスではスレッドが引き継がれないため、プロセスごとに起動し直す"""
+    with self._lock:
+      if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+        return
+      self._pid = os.getpid()
+      self._stopping.clear()
+      self._thread = threading.Thread(target=self._run, name="pg-listener", daemon=True)
+      self._thread.start()
+
+  def stop(self) -> None:
+    self._stopping.set()
+
+  # --- 内部ヘルパーメソッド ---
+
+  def _run(self) -> None:
+    backoff = 1.0
+    while not self._stopping.is_set():
+      try:
+        with psycopg.connect(self._dsn, autocommit=True) as conn:
+          channels: set[str] = set()
+          self._listen(conn, channels)
+          # LISTENを始めてから知らせることで、接続していなかった間の変更を取りこぼさないようにする
+          self._connected = True
+          self._dispatch_reconnect()
+          backoff = 1.0
+
+          while not self._stopping.is_set():
+            for notify in conn.notifies(timeout=self._poll_timeout):
+              self._dispatch(notify.channel, notify.payload)
+            # 購読中に増えたチャンネルもLISTENする
+            self._listen(conn, channels)
+      except psycopg.Error as e:
+        self._connected = False
+        log_error("通知の受信でエラーが発生しました。再接続します", "listen", e, logging.WARNING, retry_in=backoff)
+        self._stopping.wait(backoff)
+        backoff = min(backoff * 2, self._max_backoff)
+    self._connected = False
+
+  def _listen(self, conn: psycopg.Connection, channels: set[str]) -> None:
+    with self._lock:
+      wanted = set(self._handlers)
+    for channel in wanted - channels:
+      conn.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
+      channels.add(channel)
+
+  def _dispatch(self, channel: str, payload: str) -> None:
+    try:
+      data = json.loads(payload) if payload else {}
+    except ValueError:
+      data = {"payload": payload}
+
+    with self._lock:
+      handlers = list(self._handlers.get(channel, ()))
+    for handler in handlers:
+      try:
+        handler(data)
+      except Exception as e:
+        log_error("通知の処理中にエラーが発生しました", "dispatch", e, channel=channel)
+
+  def _dispatch_reconnect(self) -> None:
+    with self._lock:
+      handlers = list(self._reconnect_handlers)
+    for handler in handlers:
+      try:
+        handler()
+      except Exception as e:
+        log_error("再接続時の処理中にエラーが発生しました", "reconnect", e)
+
+
+def notify(conn: psycopg.Connection | psycopg.Cursor, channel: str, payload: dict) -> None:
+  """
+  現在のトランザクション内で通知を送る。
+  通知はコミットされたときにだけ配信され、ロールバックされた場合は送られない。
+  パイプラインモードでも結果を待たずに送れるよう、結果は読まない。
+  """
+  conn.execute("SELECT pg_notify(%s, %s);", (channel, json.dumps(payload)))
+
+
+# プロセス内で共有するリスナー
+listener = NotificationListener()
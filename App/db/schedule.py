@@ -1,15 +1,20 @@
 import json
 from datetime import date
-from typing import Literal
+from typing import Iterator, Literal
 
 import psycopg
+from psycopg.rows import args_row
 
-from .base import _get_connection
+from .base import PREPARE, _get_connection, _get_read_connection, select_list
+from .events import INVALIDATION_CHANNEL, SCHEDULE_UPDATED, SCHEDULES_DELETED, Event, bus
+from .log import log_db_error
 
 
 class Schedule:
   """スケジュール情報を格納するためのデータクラス"""
 
+  __slots__ = ("id", "user_id", "band_id", "schedule", "comment")
+
   def __init__(self, id: int, user_id: int, band_id: int, schedule: dict[date, list[Literal[0, 1]]], comment: str):
     self.id = id
     self.user_id = user_id
@@ -24,82 +29,274 @@ class Schedule:
     )
 
 
+# Schedule の引数と同じ順番
+SCHEDULE_COLUMNS = Schedule.__slots__
+
+# 保存先のバンドがアーカイブされていないこと (band_id=0 はデフォルトのスケジュール)。引数は (band_id, band_id)。
+# バンドの行を FOR SHARE で押さえるので、アーカイブ (bands の UPDATE) は保存のCOMMITを待ち、
+# アーカイブのCOMMIT後に始まった保存は断られる。スナップショットを作るときに、後から行が増えることはない
+ARCHIVED_BAND_GUARD = "(%s = 0 OR EXISTS (SELECT 1 FROM bands WHERE id = %s AND NOT archived FOR SHARE))"
+
+
 class ScheduleDatabaseManager:
   """schedulesテーブルを操作するためのクラス"""
 
   def __init__(self):
     self._get_connection = _get_connection
+    self._get_read_connection = _get_read_connection
 
-  def get_schedules(self, user_id: int | None = None, band_id: int | None = None) -> list[Schedule]:
-    """ユーザーIDまたはバンドIDでスケジュール情報を取得する"""
-    if user_id is not None:
-      sql = "SELECT * FROM schedules WHERE user_id = %s;"
+  def get_schedules(
+    self, user_id: int | None = None, band_id: int | None = None, band_ids: list[int] | None = None
+  ) -> list[Schedule]:
+    """
+    ユーザーIDまたはバンドIDでスケジュール情報を取得する。
+    ユーザーIDで取得する場合、band_idsで対象のバンドを絞り込むと、
+    schedules がband_idでパーティション化されていても該当するパーティションだけを読む。
+    """
+    if user_id is not None and band_ids is not None:
+      sql = f"SELECT {select_list(SCHEDULE_COLUMNS)} FROM schedules WHERE user_id = %s AND band_id = ANY(%s);"
+      args = (user_id, band_ids)
+    elif user_id is not None:
+      sql = f"SELECT {select_list(SCHEDULE_COLUMNS)} FROM schedules WHERE user_id = %s;"
       args = (user_id,)
     elif band_id is not None:
-      sql = "SELECT * FROM schedules WHERE band_id = %s;"
+      sql = f"SELECT {select_list(SCHEDULE_COLUMNS)} FROM schedules WHERE band_id = %s;"
       args = (band_id,)
     else:
       return []
 
     schedules_list: list[Schedule] = []
     try:
-      with self._get_connection() as conn:
-        with conn.cursor() as cur:
-          cur.execute(sql, args)
-          results = cur.fetchall()
-          for row in results:
-            row['schedule'] = self._deserialize_schedule(row['schedule'])
-            schedules_list.append(Schedule(**row))
+      with self._get_read_connection() as conn:
+        with conn.cursor(row_factory=args_row(self._schedule_from_row)) as cur:
+          cur.execute(sql, args, prepare=PREPARE)
+          schedules_list = cur.fetchall()
+    except psycopg.Error as e:
+      log_db_error("get_schedules", e, user_id=user_id, band_id=band_id)
+
+    return schedules_list
+
+
+  def get_practice_schedules(self, band_ids: list[int]) -> list[Schedule]:
+    """指定された複数のバンドのバンド練スケジュール(user_id=0)をまとめて取得する"""
+    if not band_ids:
+      return []
+
+    sql = f"SELECT {select_list(SCHEDULE_COLUMNS)} FROM schedules WHERE user_id = 0 AND band_id = ANY(%s);"
+    schedules_list: list[Schedule] = []
+    try:
+      with self._get_read_connection() as conn:
+        with conn.cursor(row_factory=args_row(self._schedule_from_row)) as cur:
+          cur.execute(sql, (band_ids,), prepare=PREPARE)
+          schedules_list = cur.fetchall()
     except psycopg.Error as e:
-      print(f"データベースエラーが発生しました: {e}")
+      log_db_error("get_practice_schedules", e, bands=len(band_ids))
 
     return schedules_list
 
 
+  def get_upcoming_practice_days(self, user_id: int, since: date) -> list[dict] | None:
+    """
+    ユーザーが所属するバンドごとに、since 以降のバンド練(user_id=0)の日付と時間のリストを1クエリで取得する。
+    行は band_id, name, color_index, day (ISO形式の日付), hours の辞書で、日付順に並ぶ。
+    color_index はバンド一覧と同じ順番 (終了日の新しい順) で数えた、未アーカイブのバンドの中での位置。
+    今後のバンド練がないバンドやアーカイブ済みのバンドも、day と hours を None にした行で返す (キャッシュの無効化に使う)。
+    エラーの場合は None を返す。
+    """
+    sql = """
+      SELECT m.band_id, m.name, m.color_index, d.key AS day, d.value AS hours
+      FROM (
+        SELECT b.id AS band_id, b.name, b.archived,
+          row_number() OVER (PARTITION BY b.archived ORDER BY b.end_date DESC, b.id DESC) - 1 AS color_index
+        FROM band_user bu
+        JOIN bands b ON b.id = bu.band_id
+        WHERE bu.user_id = %s
+      ) m
+      LEFT JOIN schedules s ON s.user_id = 0 AND s.band_id = m.band_id AND NOT m.archived
+      LEFT JOIN LATERAL jsonb_each(
+        CASE WHEN jsonb_typeof(s.schedule) = 'object' THEN s.schedule END
+      ) AS d(key, value) ON d.key >= %s
+      ORDER BY d.key, m.color_index;
+    """
+    try:
+      with self._get_read_connection() as conn:
+        with conn.cursor() as cur:
+          cur.execute(sql, (user_id, since.isoformat()), prepare=PREPARE)
+          return cur.fetchall()
+    except psycopg.Error as e:
+      log_db_error("get_upcoming_practice_days", e, user_id=user_id)
+      return None
+
+
+  def get_feed_practices(self, user_id: int) -> list[dict] | None:
+    """
+    ユーザーが所属する未アーカイブのバンドごとに、バンド練(user_id=0)のスケジュールを1クエリで取得する。
+    行は band_id, name, schedule の辞書 (バンド練がないバンドは schedule が空)。エラーの場合は None を返す。
+    """
+    sql = """
+      SELECT b.id AS band_id, b.name, s.schedule
+      FROM band_user bu
+      JOIN bands b ON b.id = bu.band_id
+      LEFT JOIN schedules s ON s.user_id = 0 AND s.band_id = b.id
+      WHERE bu.user_id = %s AND NOT b.archived;
+    """
+    try:
+      with self._get_read_connection() as conn:
+        with conn.cursor() as cur:
+          cur.execute(sql, (user_id,), prepare=PREPARE)
+          return [
+            {**row, "schedule": self._deserialize_schedule(row["schedule"])}
+            for row in cur.fetchall()
+          ]
+    except psycopg.Error as e:
+      log_db_error("get_feed_practices", e, user_id=user_id)
+      return None
+
+
+  def iter_schedules(
+    self, user_id: int | None = None, band_id: int | None = None, batch_size: int = 200
+  ) -> Iterator[Schedule]:
+    """
+    ユーザーIDまたはバンドID(両方指定した場合はその組み合わせ)でスケジュール情報を1件ずつ返すジェネレータ。
+    サーバーサイドカーソルでbatch_size件ずつ取得するため、件数が多くてもメモリ使用量は一定になる。
+    途中でDBのエラーが起きた場合は、記録してから例外をそのまま投げる (途中までの結果を全件として扱わせない)。
+    """
+    if user_id is not None and band_id is not None:
+      sql = f"SELECT {select_list(SCHEDULE_COLUMNS)} FROM schedules WHERE user_id = %s AND band_id = %s ORDER BY user_id;"
+      args = (user_id, band_id)
+    elif user_id is not None:
+      sql = f"SELECT {select_list(SCHEDULE_COLUMNS)} FROM schedules WHERE user_id = %s ORDER BY band_id;"
+      args = (user_id,)
+    elif band_id is not None:
+      sql = f"SELECT {select_list(SCHEDULE_COLUMNS)} FROM schedules WHERE band_id = %s ORDER BY user_id;"
+      args = (band_id,)
+    else:
+      return
+
+    try:
+      # 読み取り用の接続はautocommitなので、サーバーサイドカーソルのためにトランザクションを開く
+      with self._get_read_connection() as conn, conn.transaction():
+        with conn.cursor(name="iter_schedules", row_factory=args_row(self._schedule_from_row)) as cur:
+          cur.itersize = batch_size
+          cur.execute(sql, args)
+          yield from cur
+    except psycopg.Error as e:
+      log_db_error("iter_schedules", e, user_id=user_id, band_id=band_id)
+      raise
+
+
   def update_schedule(self, user_id: int, schedule: dict[date, list[Literal[0, 1]]], band_id: int = 0, comment: str | None = None) -> Schedule | None:
-    """スケジュールを更新または新規作成する (UPSERT)"""
+    """
+    スケジュールを更新または新規作成する (UPSERT)。
+    アーカイブしたバンドには保存せず None を返す (ARCHIVED_BAND_GUARD を参照)。
+    """
     json_schedule = self._serialize_schedule(schedule)
-    sql = """
-      INSERT INTO schedules (user_id, band_id, schedule, comment)
-      VALUES (%s, %s, %s, %s)
-      ON CONFLICT (user_id, band_id) DO UPDATE
-      SET schedule = EXCLUDED.schedule,
-          comment = EXCLUDED.comment;
+    # バンドのページ・重複検出用のインデックス・フィードに変更を知らせる
+    event = Event(SCHEDULE_UPDATED, user_id=user_id, band_id=band_id, schedule=schedule)
+    # 更新/挿入したレコードは RETURNING で受け取り、読み直さない。
+    # 通知は書き込んだ行があるときだけ同じ文で送る (アーカイブしたバンドで INSERT しなかった場合は送らない)
+    sql = f"""
+      WITH written AS (
+        INSERT INTO schedules (user_id, band_id, schedule, comment)
+        SELECT %s, %s, %s, %s
+        WHERE {ARCHIVED_BAND_GUARD}
+        ON CONFLICT (user_id, band_id) DO UPDATE
+        SET schedule = EXCLUDED.schedule,
+            comment = EXCLUDED.comment
+        RETURNING {select_list(SCHEDULE_COLUMNS)}
+      )
+      SELECT {select_list(SCHEDULE_COLUMNS)}, pg_notify(%s, %s) FROM written;
     """
-    get_sql = "SELECT * FROM schedules WHERE user_id = %s AND band_id = %s;"
 
     try:
       with self._get_connection() as conn:
-        with conn.cursor() as cur:
-          cur.execute(sql, (user_id, band_id, json_schedule, comment))
-          conn.commit()
-
-          # 更新/挿入したレコードを取得してオブジェクトとして返す
-          cur.execute(get_sql, (user_id, band_id))
-          result = cur.fetchone()
-          if result:
-            result['schedule'] = self._deserialize_schedule(result['schedule'])
-            return Schedule(**result)
-          return None
+        with conn.cursor(row_factory=args_row(self._schedule_from_row)) as cur:
+          # UPSERT・通知・COMMITを1回の往復で送る
+          with conn.pipeline():
+            cur.execute(sql, (
+              user_id, band_id, json_schedule, comment, band_id, band_id,
+              INVALIDATION_CHANNEL, bus.payload(event),
+            ), prepare=PREPARE)
+            conn.commit()
+          saved = cur.fetchone()
+        if saved:
+          bus.committed(conn, event)
+        return saved
     except psycopg.Error as e:
-      print(f"データベースエラーが発生しました: {e}")
+      log_db_error("update_schedule", e, user_id=user_id, band_id=band_id)
       return None
 
 
+  def merge_schedule(
+    self, user_id: int, updates: dict[date, list[Literal[0, 1]]], band_id: int = 0, comment: str | None = None
+  ) -> bool:
+    """
+    updates に含まれる日付のスケジュールだけを置き換え、それ以外の日付はそのまま残す (UPSERT)。
+    チェックが1つもない日付は削除する。読み直さずに1つの文で置き換えるので、同時に保存しても他の日付を消さない。
+    アーカイブしたバンドには保存せず False を返す (ARCHIVED_BAND_GUARD を参照)。
+    """
+    json_schedule = self._serialize_schedule({d: v for d, v in updates.items() if any(v)})
+    replaced_keys = [d.isoformat() for d in updates]
+    # 更新後のスケジュール全体は手元にないので、重複検出用のインデックスは次回参照時に読み込み直す
+    event = Event(SCHEDULE_UPDATED, user_id=user_id, band_id=band_id)
+    # 通知は書き込んだ行があるときだけ同じ文で送る (アーカイブしたバンドで INSERT しなかった場合は送らない)
+    sql = f"""
+      WITH written AS (
+        INSERT INTO schedules (user_id, band_id, schedule, comment)
+        SELECT %s, %s, %s, %s
+        WHERE {ARCHIVED_BAND_GUARD}
+        ON CONFLICT (user_id, band_id) DO UPDATE
+        SET schedule = (coalesce(schedules.schedule, '{{}}'::jsonb) - %s::text[]) || EXCLUDED.schedule,
+            comment = EXCLUDED.comment
+        RETURNING id
+      )
+      SELECT pg_notify(%s, %s) FROM written;
+    """
+
+    try:
+      with self._get_connection() as conn:
+        with conn.cursor() as cur:
+          # UPSERT・通知・COMMITを1回の往復で送る
+          with conn.pipeline():
+            cur.execute(sql, (
+              user_id, band_id, json_schedule, comment, band_id, band_id, replaced_keys,
+              INVALIDATION_CHANNEL, bus.payload(event),
+            ), prepare=PREPARE)
+            conn.commit()
+          written = cur.rowcount != 0
+        if written:
+          bus.committed(conn, event)
+        return written
+    except psycopg.Error as e:
+      log_db_error("merge_schedule", e, user_id=user_id, band_id=band_id)
+      return False
+
+
   def delete_schedules(self, user_id: int) -> bool:
     """指定されたユーザーIDのスケジュールをすべて削除する"""
     sql = "DELETE FROM schedules WHERE user_id = %s;"
     try:
       with self._get_connection() as conn:
         with conn.cursor() as cur:
-          cur.execute(sql, (user_id,))
-          conn.commit()
+          with conn.pipeline():
+            cur.execute(sql, (user_id,))
+            bus.commit(conn, Event(SCHEDULES_DELETED, user_id=user_id))
           return True
     except psycopg.Error as e:
-      print(f"データベースエラーが発生しました: {e}")
+      log_db_error("delete_schedules", e, user_id=user_id)
       return False
 
 
+  def _schedule_from_row(
+    self, id: int, user_id: int, band_id: int, schedule: str | dict | None, comment: str, notified: None = None
+  ) -> Schedule:
+    """
+    SCHEDULE_COLUMNS の順番の行から Schedule を作る (行ファクトリとして使う)。
+    notified は行と一緒に pg_notify を呼んだ場合の戻り値 (void) を受けて捨てる
+    """
+    return Schedule(id, user_id, band_id, self._deserialize_schedule(schedule), comment)
+
+
   def _serialize_schedule(self, schedule: dict[date, list[Literal[0, 1]]]) -> str:
     """schedule辞書をJSON文字列にシリアライズする"""
     if not isinstance(schedule, dict):
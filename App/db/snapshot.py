@@ -0,0 +1,110 @@
+import json
+import zlib
+
+import psycopg
+
+from .base import PREPARE, _get_connection, _get_read_connection
+from .events import BAND_CHANGED, Event, bus
+from .log import log_db_error
+
+
+class SnapshotDatabaseManager:
+  """アーカイブしたバンドのスナップショット (band_snapshots) の操作を管理するクラス"""
+
+  def __init__(self):
+    self._get_connection = _get_connection
+    self._get_read_connection = _get_read_connection
+
+  # --- 書き込み操作 (Create, Update, Delete) ---
+
+  def save(self, band_id: int, data: dict, release_rows: bool = False) -> bool:
+    """
+    スナップショットを保存する (既にあれば置き換える)。
+    release_rows が True の場合、同じトランザクションでバンドのスケジュールの行を削除し、
+    削除した行 (DELETE ... RETURNING) をそのまま data の "schedules" として保存する。
+    読んでから削除するまでの間に保存された行も、削除した行として必ずスナップショットに残る。
+    """
+    upsert_sql = """
+      INSERT INTO band_snapshots (band_id, data, released)
+      VALUES (%s, %s, %s)
+      ON CONFLICT (band_id) DO UPDATE
+      SET data = EXCLUDED.data, released = EXCLUDED.released, created_at = now();
+    """
+    try:
+      with self._get_connection() as conn:
+        if release_rows:
+          with conn.cursor() as cur:
+            cur.execute(
+              "DELETE FROM schedules WHERE band_id = %s RETURNING user_id, schedule, comment;", (band_id,)
+            )
+            data = {**data, "schedules": [
+              {"user_id": row["user_id"], "schedule": row["schedule"] or {}, "comment": row["comment"]}
+              for row in cur
+            ]}
+        # UPSERT・通知・COMMITを1回の往復で送る
+        with conn.pipeline():
+          conn.execute(upsert_sql, (band_id, self._compress(data), release_rows))
+          bus.commit(conn, Event(BAND_CHANGED, band_id=band_id))
+        return True
+    except psycopg.Error as e:
+      log_db_error("save", e, band_id=band_id)
+      return False
+
+
+  def restore(self, band_id: int) -> bool:
+    """
+    スナップショットを削除する。行を削除していた場合は、スナップショットからスケジュールの行を戻す。
+    戻すのは現在もメンバーのユーザーとバンド練 (user_id=0) の行だけで、既に行があれば上書きしない。
+    """
+    insert_sql = """
+      INSERT INTO schedules (user_id, band_id, schedule, comment)
+      SELECT %s, %s, %s, %s
+      WHERE %s = 0 OR EXISTS (SELECT 1 FROM band_user WHERE user_id = %s AND band_id = %s)
+      ON CONFLICT (user_id, band_id) DO NOTHING;
+    """
+    try:
+      with self._get_connection() as conn:
+        with conn.cursor() as cur:
+          cur.execute(
+            "DELETE FROM band_snapshots WHERE band_id = %s RETURNING data, released;", (band_id,)
+          )
+          row = cur.fetchone()
+          if row and row["released"]:
+            rows = self._decompress(row["data"]).get("schedules", [])
+            cur.executemany(insert_sql, [
+              (
+                item["user_id"], band_id, json.dumps(item["schedule"]), item["comment"],
+                item["user_id"], item["user_id"], band_id,
+              )
+              for item in rows
+            ])
+          bus.commit(conn, Event(BAND_CHANGED, band_id=band_id))
+        return True
+    except psycopg.Error as e:
+      log_db_error("restore", e, band_id=band_id)
+      return False
+
+  # --- 読み取り操作 (Read) ---
+
+  def get(self, band_id: int, released_only: bool = False) -> dict | None:
+    """スナップショットを展開して返す。なければ None (released_only の場合、行を削除していなければ None)"""
+    sql = "SELECT data FROM band_snapshots WHERE band_id = %s"
+    if released_only:
+      sql += " AND released"
+    try:
+      with self._get_read_connection() as conn:
+        with conn.cursor() as cur:
+          cur.execute(sql, (band_id,), prepare=PREPARE)
+          row = cur.fetchone()
+          return self._decompress(row["data"]) if row else None
+    except psycopg.Error as e:
+      log_db_error("get", e, band_id=band_id)
+      return None
+
+  # --- 内部ヘルパーメソッド ---
+
+  def _compress(self, data: dict) -> bytes:
+    return zlib.compress(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode(), 9)
+
+  def _decompress(self, data: bytes) -> dict:
+    return json.loads(zlib.decompress(data))
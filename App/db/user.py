@@ -1,10 +1,20 @@
+from contextlib import nullcontext
+from typing import Callable
+
 import psycopg
-from .base import _get_connection
+from psycopg.rows import args_row
+from .base import PREPARE, _get_connection, _get_read_connection, primary_reads, select_list
+from .cache import record_cache
+from .events import USER_CHANGED, USER_DELETED, Event, bus
+from .log import log_db_error
 
 
 class User:
   """ユーザー情報を格納するためのデータクラス"""
 
+  # 1リクエストで大量に作り、キャッシュにも保持するので、インスタンスごとの __dict__ を持たせない
+  __slots__ = ("id", "email", "name")
+
   def __init__(self, id: int, email: str, name: str):
     self.id = id
     self.email = email
@@ -14,11 +24,16 @@ class User:
     return f"User(id={self.id}, email='{self.email}', name='{self.name}')"
 
 
+# User の引数と同じ順番
+USER_COLUMNS = User.__slots__
+
+
 class UserDatabaseManager:
   """ユーザーに関連するデータベース操作を管理するクラス"""
 
   def __init__(self):
     self._get_connection = _get_connection
+    self._get_read_connection = _get_read_connection
 
   # --- 書き込み操作 (Create, Update, Delete) ---
 
@@ -30,12 +45,13 @@ class UserDatabaseManager:
       with self._get_connection() as conn:
         with conn.cursor() as cur:
           cur.execute(sql, (email, name))
-          conn.commit()
           # fetchone()で結果を取得する
           result = cur.fetchone()
-          return result['id'] if result else None
+          user_id = result['id'] if result else None
+          bus.commit(conn, Event(USER_CHANGED, user_id=user_id))
+          return user_id
     except psycopg.Error as e:
-      print(f"データベースエラーが発生しました (add): {e}")
+      log_db_error("add", e)
       return None
 
 
@@ -45,27 +61,36 @@ class UserDatabaseManager:
     try:
       with self._get_connection() as conn:
         with conn.cursor() as cur:
-          cur.execute(sql, (email, name, user_id))
-          conn.commit()
+          # 文・通知・COMMITを1回の往復で送る
+          with conn.pipeline():
+            cur.execute(sql, (email, name, user_id))
+            bus.commit(conn, Event(USER_CHANGED, user_id=user_id))
           # 1行以上更新されていれば成功
           return cur.rowcount > 0
     except psycopg.Error as e:
-      print(f"データベースエラーが発生しました (update): {e}")
+      log_db_error("update", e, user_id=user_id)
       return False
 
 
-  def delete(self, user_id: int) -> bool:
-    """ユーザーを削除する"""
+  def delete(self, user_id: int, in_transaction: Callable[[psycopg.Connection], object] | None = None) -> bool:
+    """
+    ユーザーを削除する。
+    in_transaction を指定すると、削除と同じトランザクションの中で接続を渡して呼ぶ (後始末のジョブの登録など)。
+    """
     sql = "DELETE FROM users WHERE id = %s;"
     try:
       with self._get_connection() as conn:
         with conn.cursor() as cur:
-          cur.execute(sql, (user_id,))
-          conn.commit()
+          # 文・通知・COMMITを1回の往復で送る
+          with conn.pipeline():
+            cur.execute(sql, (user_id,))
+            if in_transaction is not None:
+              in_transaction(conn)
+            bus.commit(conn, Event(USER_DELETED, user_id=user_id))
           # 1行以上削除されていれば成功
           return cur.rowcount > 0
     except psycopg.Error as e:
-      print(f"データベースエラーが発生しました (delete): {e}")
+      log_db_error("delete", e, user_id=user_id)
       return False
 
   # --- 読み取り操作 (Read) ---
@@ -73,20 +98,36 @@ class UserDatabaseManager:
   def get_user(self, user_id: int | None = None, email: str | None = None) -> User | None:
     """idまたはemailを指定して、単一のユーザー情報を取得する"""
     if user_id:
-      sql = "SELECT id, email, name FROM users WHERE id = %s;"
+      sql = f"SELECT {select_list(USER_COLUMNS)} FROM users WHERE id = %s;"
       args = (user_id,)
+      key = ("user_id", user_id)
     elif email:
-      sql = "SELECT id, email, name FROM users WHERE email = %s;"
+      sql = f"SELECT {select_list(USER_COLUMNS)} FROM users WHERE email = %s;"
       args = (email,)
+      key = ("user_email", email)
     else:
       return None
 
+    # ほぼ全てのリクエストでログインユーザーを引くため、無効化イベントで破棄されるまでキャッシュする
+    cached = record_cache.get(key)
+    if cached is not None:
+      return cached
+
+    generation = record_cache.begin()
     try:
-      with self._get_connection() as conn:
-        with conn.cursor() as cur:
-          cur.execute(sql, args)
-          result = cur.fetchone()
-          return User(**result) if result else None
+      with self._cache_fill_reads(), self._get_read_connection() as conn:
+        with conn.cursor(row_factory=args_row(User)) as cur:
+          cur.execute(sql, args, prepare=PREPARE)
+          user = cur.fetchone()
+          if user:
+            record_cache.put(key, user, (("user", user.id),), generation)
+          return user
     except psycopg.Error as e:
-      print(f"データベースエラーが発生しました (get_user): {e}")
-      return None
\ No newline at end of file
+      log_db_error("get_user", e, user_id=user_id)
+      return None
+
+  # --- 内部ヘルパーメソッド ---
+
+  def _cache_fill_reads(self):
+    """キャッシュに入れる読み取りは、レプリカの遅延の影響を受けないようにプライマリで行う"""
+    return primary_reads() if record_cache.active else nullcontext()
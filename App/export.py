@@ -0,0 +1,197 @@
+import csv
+import io
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Iterable, Iterator, Literal
+from zoneinfo import ZoneInfo
+
+from itsdangerous import BadSignature, URLSafeSerializer
+
+from const import CALENDAR_TIMEZONE, SECRET_KEY
+
+
+class PracticeBlock:
+  """連続したバンド練の時間帯を1つにまとめたデータクラス"""
+
+  def __init__(self, band_id: int, band_name: str, day: date, start_hour: int, end_hour: int):
+    self.band_id = band_id
+    self.band_name = band_name
+    self.day = day
+    self.start_hour = start_hour
+    self.end_hour = end_hour
+
+  @property
+  def start(self) -> datetime:
+    return datetime.combine(self.day, time(self.start_hour))
+
+  @property
+  def end(self) -> datetime:
+    # end_hour=24 は翌日の0時として扱う
+    return datetime.combine(self.day, time(0)) + timedelta(hours=self.end_hour)
+
+  def __repr__(self):
+    return (
+      f"PracticeBlock(band_id={self.band_id}, band_name='{self.band_name}', "
+      f"day='{self.day}', start_hour={self.start_hour}, end_hour={self.end_hour})"
+    )
+
+
+def practice_blocks(
+  band_id: int, band_name: str, schedule: dict[date, list[Literal[0, 1]]]
+) -> Iterator[PracticeBlock]:
+  """バンド練のスケジュールを、隣り合う時間をまとめたブロックとして日付順に返すジェネレータ"""
+  for day in sorted(schedule):
+    start_hour = None
+    for hour, is_practice in enumerate(schedule[day]):
+      if is_practice and start_hour is None:
+        start_hour = hour
+      elif not is_practice and start_hour is not None:
+        yield PracticeBlock(band_id, band_name, day, start_hour, hour)
+        start_hour = None
+    if start_hour is not None:
+      yield PracticeBlock(band_id, band_name, day, start_hour, len(schedule[day]))
+
+
+# --- フィード用トークン ---
+
+def _feed_serializer() -> URLSafeSerializer | None:
+  # 鍵がなければ誰でも同じ署名を作れてしまうので、トークンを発行も検証もしない
+  if not SECRET_KEY:
+    return None
+  return URLSafeSerializer(SECRET_KEY, salt="calendar-feed")
+
+
+def make_feed_token(user_id: int) -> str | None:
+  """カレンダーフィードのURLに埋め込む、ユーザーIDを署名したトークンを作る。SECRET_KEYがなければNoneを返す"""
+  serializer = _feed_serializer()
+  if serializer is None:
+    return None
+  return str(serializer.dumps(user_id))
+
+
+def load_feed_token(token: str) -> int | None:
+  """トークンを検証してユーザーIDを返す。不正なトークンやSECRET_KEYがない場合はNoneを返す"""
+  serializer = _feed_serializer()
+  if serializer is None:
+    return None
+  try:
+    user_id = serializer.loads(token)
+  except BadSignature:
+    return None
+  return user_id if isinstance(user_id, int) else None
+
+
+# --- CSV ---
+
+def csv_line(values: Iterable) -> str:
+  """1行分の値をCSV形式の文字列にする"""
+  buffer = io.StringIO()
+  csv.writer(buffer).writerow(values)
+  return buffer.getvalue()
+
+
+def availability_csv(
+  dates: list[date], hours: list[int], member_map: dict[int, str], schedules: Iterable
+) -> Iterator[str]:
+  """
+  メンバーごと・日付ごとの参加可否をCSVの行として1行ずつ返すジェネレータ。
+  schedulesはScheduleを1件ずつ返すイテラブルで、同時に保持するのは1人分だけになる。
+  """
+  # Excelで文字化けしないようにBOMを付ける
+  yield "\ufeff" + csv_line(["名前", "日付"] + [f"{hour:02d}:00" for hour in hours])
+
+  for schedule_obj in schedules:
+    member_name = member_map.get(schedule_obj.user_id)
+    if not member_name:
+      continue
+    for day in dates:
+      hour_list = schedule_obj.schedule.get(day, ())
+      yield csv_line(
+        [member_name, day.isoformat()]
+        + [1 if hour < len(hour_list) and hour_list[hour] else 0 for hour in hours]
+      )
+
+
+def practice_csv(blocks: Iterable[PracticeBlock]) -> Iterator[str]:
+  """バンド練のブロックをCSVの行として1行ずつ返すジェネレータ"""
+  yield "\ufeff" + csv_line(["バンド", "日付", "開始", "終了"])
+  for block in blocks:
+    yield csv_line([
+      block.band_name, block.day.isoformat(),
+      f"{block.start_hour:02d}:00", f"{block.end_hour:02d}:00"
+    ])
+
+
+# --- iCalendar ---
+
+def ics_calendar(
+  calendar_name: str, blocks: Iterable[PracticeBlock], stamp: datetime | None = None
+) -> Iterator[str]:
+  """
+  バンド練のブロックを1件ずつVEVENTにして、iCalendar形式の行を返すジェネレータ。
+  stamp はDTSTAMPに使う時刻 (省略時は現在時刻)。同じ内容から同じ本文を作りたい場合に指定する。
+  """
+  yield _ics_lines(
+    "BEGIN:VCALENDAR",
+    "VERSION:2.0",
+    "PRODID:-//Jappy//Band Practice//JA",
+    "CALSCALE:GREGORIAN",
+    "METHOD:PUBLISH",
+    f"X-WR-CALNAME:{_ics_escape(calendar_name)}",
+    f"X-WR-TIMEZONE:{CALENDAR_TIMEZONE}",
+  )
+  yield _ics_timezone()
+
+  dtstamp = (stamp or datetime.now(timezone.utc)).astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+  for block in blocks:
+    yield _ics_lines(
+      "BEGIN:VEVENT",
+      f"UID:band-{block.band_id}-{block.start:%Y%m%dT%H%M}@jappy",
+      f"DTSTAMP:{dtstamp}",
+      f"DTSTART;TZID={CALENDAR_TIMEZONE}:{block.start:%Y%m%dT%H%M%S}",
+      f"DTEND;TZID={CALENDAR_TIMEZONE}:{block.end:%Y%m%dT%H%M%S}",
+      f"SUMMARY:{_ics_escape(block.band_name + ' バンド練')}",
+      "END:VEVENT",
+    )
+
+  yield _ics_lines("END:VCALENDAR")
+
+
+def _ics_timezone() -> str:
+  """CALENDAR_TIMEZONEのVTIMEZONEを返す (夏時間のないタイムゾーンを想定し、現在のオフセットで固定する)"""
+  offset = datetime.now(ZoneInfo(CALENDAR_TIMEZONE)).utcoffset() or timedelta(0)
+  minutes = int(offset.total_seconds() // 60)
+  sign = "+" if minutes >= 0 else "-"
+  tz_offset = f"{sign}{abs(minutes) // 60:02d}{abs(minutes) % 60:02d}"
+  return _ics_lines(
+    "BEGIN:VTIMEZONE",
+    f"TZID:{CALENDAR_TIMEZONE}",
+    "BEGIN:STANDARD",
+    "DTSTART:19700101T000000",
+    f"TZOFFSETFROM:{tz_offset}",
+    f"TZOFFSETTO:{tz_offset}",
+    "END:STANDARD",
+    "END:VTIMEZONE",
+  )
+
+
+def _ics_escape(text: str) -> str:
+  return (
+    text.replace("\\", "\\\\").replace(";", "\\;")
+    .replace(",", "\\,").replace("\n", "\\n")
+  )
+
+
+def _ics_lines(*lines: str) -> str:
+  """各行を75オクテットで折り返し(RFC 5545)、CRLFで連結する"""
+  folded = []
+  for line in lines:
+    chunk, size = "", 0
+    for char in line:
+      char_size = len(char.encode("utf-8"))
+      if size + char_size > 75:
+        folded.append(chunk)
+        chunk, size = " ", 1
+      chunk += char
+      size += char_size
+    folded.append(chunk)
+  return "".join(f"{line}\r\n" for line in folded)
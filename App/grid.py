@@ -0,0 +1,110 @@
+"""
+日付 × 時間の表をテンプレートで描画するためのデータを作る。
+テンプレートの内側のループでは辞書の参照や isoformat() をせず、ここで作った行をそのまま出力するだけにする。
+"""
+from datetime import date
+from typing import Iterable
+
+WEEKDAYS = ["月", "火", "水", "木", "金", "土", "日"]
+# バンド練の表示でバンドを塗り分ける色 (バンド一覧の順に割り当てる)
+PRACTICE_COLORS = ["#ffadad", "#a5dfff", "#b6ffbc", "#ffe3bf", "#a79bff", "#ffa0b6", "#bdb2ff", "#ffc6ff"]
+
+
+def date_headers(dates: Iterable[date]) -> list[tuple[str, str, str]]:
+  """見出しの行。(ISO形式の日付, "MM/DD", 曜日) のリスト"""
+  return [(day.isoformat(), day.strftime("%m/%d"), WEEKDAYS[day.weekday()]) for day in dates]
+
+
+def practice_color(index: int) -> str:
+  return PRACTICE_COLORS[index % len(PRACTICE_COLORS)]
+
+
+def _hour_labels(hour: int) -> tuple[int, str]:
+  return hour, f"{hour:02d}:00"
+
+
+def availability_rows(
+  headers: list[tuple[str, str, str]], hours: Iterable[int],
+  schedules_agg: dict, schedules_detail: dict, conflicts_detail: dict,
+) -> list[tuple[int, str, list[tuple[str, int, str, str]]]]:
+  """
+  バンドのページの行。(時間, "HH:00", セル) のリストで、
+  セルは (ISO形式の日付, 参加可能人数, 参加可能なメンバー名, 重複しているメンバー名) のタプル。
+  メンバー名はカンマ区切りの文字列 (いなければ空文字列)。
+  """
+  empty: dict = {}
+  # 日付ごとの辞書は時間のループの外で1回だけ引く
+  columns = [
+    (iso, schedules_agg.get(iso, empty), schedules_detail.get(iso, empty), conflicts_detail.get(iso, empty))
+    for iso, _, _ in headers
+  ]
+  rows = []
+  for hour in hours:
+    cells = []
+    for iso, counts, details, conflicts in columns:
+      members = details.get(hour)
+      conflicting = conflicts.get(hour)
+      cells.append((
+        iso,
+        counts.get(hour, 0),
+        ",".join(members) if members else "",
+        ",".join(conflicting) if conflicting else "",
+      ))
+    rows.append((*_hour_labels(hour), cells))
+  return rows
+
+
+def checkbox_rows(
+  headers: list[tuple[str, str, str]], hours: Iterable[int],
+  schedule: dict[str, list], conflicts_detail: dict | None = None,
+) -> list[tuple[int, str, list[tuple[str, bool, str]]]]:
+  """
+  チェックボックスの表 (スケジュール入力・バンド練の編集) の行。(時間, "HH:00", セル) のリストで、
+  セルは (ISO形式の日付, チェックするか, 重複しているメンバー名 ", " 区切り) のタプル。
+  """
+  empty: dict = {}
+  columns = [
+    (iso, schedule.get(iso), (conflicts_detail or empty).get(iso, empty))
+    for iso, _, _ in headers
+  ]
+  rows = []
+  for hour in hours:
+    cells = []
+    for iso, hour_list, conflicts in columns:
+      conflicting = conflicts.get(hour)
+      cells.append((
+        iso,
+        bool(hour_list) and hour < len(hour_list) and hour_list[hour] == 1,
+        ", ".join(conflicting) if conflicting else "",
+      ))
+    rows.append((*_hour_labels(hour), cells))
+  return rows
+
+
+def practice_rows(
+  headers: list[tuple[str, str, str]], hours: Iterable[int],
+  bands: list, band_schedules: dict[int, dict[str, list]], band_colors: dict[int, str],
+) -> list[tuple[int, str, list[list[tuple[str, str]]]]]:
+  """
+  バンド練の閲覧モードの行。(時間, "HH:00", セル) のリストで、
+  セルはその枠に練習があるバンドの (バンド名, 色) のリスト。
+  """
+  # 練習が登録されているバンドだけを、日付ごとの時間のリストに引いておく
+  practiced = [
+    (band.name, band_colors[band.id], band_schedules[band.id])
+    for band in bands if band_schedules.get(band.id)
+  ]
+  columns = [
+    [(name, color, schedule.get(iso)) for name, color, schedule in practiced]
+    for iso, _, _ in headers
+  ]
+  rows = []
+  for hour in hours:
+    cells = []
+    for column in columns:
+      cells.append([
+        (name, color) for name, color, hour_list in column
+        if hour_list and hour < len(hour_list) and hour_list[hour] == 1
+      ])
+    rows.append((*_hour_labels(hour), cells))
+  return rows
@@ -0,0 +1,210 @@
+"""
+時間のかかる処理をリクエストの外で実行するバックグラウンドジョブ。
+
+ジョブは jobs テーブルに登録し、各ワーカープロセスのスレッド (JobRunner) が SKIP LOCKED で1つずつ取り出して実行する。
+登録はコミットと同時に通知されるので、待機中のスレッドはすぐに動き出す (通知が届かなくても JOB_POLL_SECONDS ごとに確認する)。
+失敗したジョブは待ち時間を2倍ずつ延ばしながら JOB_MAX_ATTEMPTS 回まで再実行する。上限まで失敗したジョブは、同じ idempotency_key で登録し直すと最初から実行し直す。
+途中で落ちたワーカーのジョブは JOB_LEASE_SECONDS 後に他のワーカーが実行し直すので、ハンドラは何度実行されても同じ結果になるように書く。
+
+Webのワーカーとは別のプロセスで実行する場合:
+  python -m App.jobs
+"""
+import logging
+import os
+import threading
+from typing import Callable
+
+import psycopg
+
+from .db.job import FAILED, Job, JobDatabaseManager, JOBS_CHANNEL
+from .db.log import log_error, log_event
+from .db.notify import listener
+from const import (
+  JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS, JOB_POLL_SECONDS, JOB_RETRY_BASE_SECONDS, JOB_WORKERS,
+)
+
+
+# ジョブの種類 -> ハンドラ (payload を受け取り、失敗したら例外を投げる)
+_handlers: dict[str, Callable[[dict], None]] = {}
+
+
+def job_handler(kind: str):
+  """ジョブの種類に対応するハンドラを登録するデコレータ"""
+  def register(func: Callable[[dict], None]) -> Callable[[dict], None]:
+    _handlers[kind] = func
+    return func
+  return register
+
+
+class JobRunner:
+  """
+  ジョブを取り出して実行するスレッドを管理するクラス。
+  fork 後の子プロセスにはスレッドが引き継がれないため、プロセスごとに start() する。
+  """
+
+  def __init__(self, workers: int = JOB_WORKERS, poll_seconds: float = JOB_POLL_SECONDS):
+    self._workers = workers
+    self._poll_seconds = poll_seconds
+    self._lock = threading.Lock()
+    self._wakeup = threading.Event()
+    self._stopping = threading.Event()
+    self._threads: list[threading.Thread] = []
+    self._pid: int | None = None
+    self._subscribed = False
+
+  def start(self) -> None:
+    """ジョブを実行するスレッドを起動する (起動済みなら何もしない)"""
+    if self._workers <= 0:
+      return
+    with self._lock:
+      if self._pid == os.getpid() and any(thread.is_alive() for thread in self._threads):
+        return
+      self._pid = os.getpid()
+      self._stopping.clear()
+      self._threads = [
+        threading.Thread(target=self._run, name=f"job-runner-{n}", daemon=True)
+        for n in range(self._workers)
+      ]
+      for thread in self._threads:
+        thread.start()
+      if not self._subscribed:
+        listener.subscribe(JOBS_CHANNEL, lambda _: self.wake())
+        self._subscribed = True
+
+  def stop(self, timeout: float | None = None) -> None:
+    """新しいジョブを取り出すのをやめ、実行中のジョブが終わるのを待つ"""
+    self._stopping.set()
+    self._wakeup.set()
+    for thread in self._threads:
+      thread.join(timeout)
+
+  def wake(self) -> None:
+    """待機中のスレッドに、新しいジョブがあることを知らせる"""
+    self._wakeup.set()
+
+  # --- 内部ヘルパーメソッド ---
+
+  def _run(self) -> None:
+    job_db = JobDatabaseManager()
+    while not self._stopping.is_set():
+      job = job_db.claim(JOB_LEASE_SECONDS)
+      if job is None:
+        self._wakeup.wait(self._poll_seconds)
+        self._wakeup.clear()
+        continue
+      self._execute(job_db, job)
+
+  def _execute(self, job_db: JobDatabaseManager, job: Job) -> None:
+    handler = _handlers.get(job.kind)
+    try:
+      if handler is None:
+        raise LookupError(f"不明なジョブです: {job.kind}")
+      handler(job.payload)
+    except Exception as e:
+      retry_in = JOB_RETRY_BASE_SECONDS * 2 ** (job.attempts - 1)
+      status = job_db.fail(job.id, job.attempts, f"{type(e).__name__}: {e}", retry_in)
+      log_error(
+        "ジョブが失敗しました", "job", e,
+        job_id=job.id, kind=job.kind, attempts=job.attempts,
+        retry_in=None if status == FAILED else retry_in,
+      )
+      if status is None:
+        self._lease_lost(job)
+      return
+    if not job_db.complete(job.id, job.attempts):
+      self._lease_lost(job)
+
+  def _lease_lost(self, job: Job) -> None:
+    # 実行中に期限が切れて他のワーカーが取り出した (またはDBのエラー)。結果はそちらの実行に任せる
+    log_event(
+      "ジョブの期限が切れたため、結果を記録しませんでした", logging.WARNING,
+      method="job", job_id=job.id, kind=job.kind, attempts=job.attempts,
+    )
+
+
+# プロセス内で共有するランナー
+job_runner = JobRunner()
+
+
+def enqueue(
+  kind: str, payload: dict, idempotency_key: str | None = None, created_by: int | None = None,
+) -> Job | None:
+  """
+  ジョブを登録する。同じ idempotency_key のジョブが既にあれば、そのジョブを返す。
+  登録したプロセスでもすぐ実行できるよう、ランナーを起動しておく。
+  """
+  if kind not in _handlers:
+    raise ValueError(f"不明なジョブです: {kind}")
+  job = JobDatabaseManager().enqueue(
+    kind, payload, JOB_MAX_ATTEMPTS, idempotency_key=idempotency_key, created_by=created_by,
+  )
+  if job is not None:
+    wake_runner()
+  return job
+
+
+def enqueue_in(
+  conn: psycopg.Connection, kind: str, payload: dict,
+  idempotency_key: str | None = None, created_by: int | None = None,
+) -> None:
+  """
+  conn のトランザクションの中でジョブを登録する。他の書き込みと一緒にコミットされ、ロールバックされれば登録されない。
+  コミットした後で wake_runner() を呼ぶ。
+  """
+  if kind not in _handlers:
+    raise ValueError(f"不明なジョブです: {kind}")
+  JobDatabaseManager().enqueue_in(
+    conn, kind, payload, JOB_MAX_ATTEMPTS, idempotency_key=idempotency_key, created_by=created_by,
+  )
+
+
+def wake_runner() -> None:
+  """登録したプロセスでもすぐ実行できるよう、ランナーを起動して待機中のスレッドを起こす"""
+  job_runner.start()
+  job_runner.wake()
+
+
+# --- ジョブのハンドラ ---
+
+@job_handler("delete_band")
+def _delete_band(payload: dict) -> None:
+  """バンドとメンバー・スケジュール・スナップショットを削除する"""
+  from .db.band import BandDatabaseManager
+
+  if not BandDatabaseManager().delete_band(payload["band_id"]):
+    raise RuntimeError("バンドを削除できませんでした")
+
+
+@job_handler("delete_account_data")
+def _delete_account_data(payload: dict) -> None:
+  """削除したユーザーを所属していたバンドから脱退させ、スケジュールを削除する"""
+  from .db.band import BandDatabaseManager
+  from .db.schedule import ScheduleDatabaseManager
+
+  user_id = payload["user_id"]
+  band_db = BandDatabaseManager()
+  # 途中で失敗した場合は、残っているバンドだけが再実行の対象になる
+  for band in band_db.get_bands(user_id):
+    if not band_db.remove_member(user_id=user_id, band_id=band.id):
+      raise RuntimeError(f"バンド {band.id} から脱退できませんでした")
+  if not ScheduleDatabaseManager().delete_schedules(user_id):
+    raise RuntimeError("スケジュールを削除できませんでした")
+
+
+if __name__ == "__main__":
+  import signal
+
+  from .db.base import close_pools, open_pools
+
+  open_pools()
+  job_runner.start()
+  print(f"ジョブを実行しています (スレッド数 {JOB_WORKERS})。Ctrl+C で終了します")
+  stopped = threading.Event()
+  signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+  try:
+    stopped.wait()
+  except KeyboardInterrupt:
+    pass
+  job_runner.stop()
+  listener.stop()
+  close_pools()
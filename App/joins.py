@@ -0,0 +1,100 @@
+"""
+招待リンクからのバンドへの参加。
+
+大きなバンドの招待リンクが共有されると、同じバンドへの参加が一度に集中する。
+JOIN_BATCHING が有効なら、同じバンドへの参加のうち、前の書き込みを待っている間に届いたものを1つのINSERTにまとめる。
+最初に届いたリクエストがまとめ役になり、そのバンドへの前の書き込みが終わったら、それまでに集まった分をまとめて書き込む。
+集中していなければ待つ相手がいないので、まとめずにすぐ書き込む (待ち時間は増えない)。
+"""
+import threading
+
+from .db.band import BandDatabaseManager
+from const import JOIN_BATCH_MAX_SIZE, JOIN_BATCHING
+
+
+class _JoinBatch:
+  """1回のINSERTでまとめて追加するユーザーを格納するためのデータクラス"""
+
+  __slots__ = ("user_ids", "added", "done")
+
+  def __init__(self):
+    self.user_ids: list[int] = []
+    self.added: set[int] | None = None
+    self.done = threading.Event()
+
+
+class _BandLock:
+  """バンドへの書き込みを順番に行うためのロックと、それを待っているまとめ役の数を格納するためのデータクラス"""
+
+  __slots__ = ("lock", "waiters")
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.waiters = 0
+
+
+class JoinBatcher:
+  """同じバンドへの同時の参加をまとめて書き込むクラス"""
+
+  def __init__(self, max_size: int = JOIN_BATCH_MAX_SIZE):
+    self._max_size = max_size
+    self._lock = threading.Lock()
+    # バンドID -> まだ書き込み始めていないバッチ
+    self._pending: dict[int, _JoinBatch] = {}
+    # バンドID -> 書き込み中・書き込み待ちのまとめ役がいるバンドのロック (誰も使わなくなったら削除する)。
+    # バンドごとに分けるので、別のバンドへの参加が同じロックを待つことはない
+    self._band_locks: dict[int, _BandLock] = {}
+
+  def add_member(self, user_id: int, band_id: int) -> bool | None:
+    """
+    ユーザーをバンドのメンバーとして追加する。
+    追加した場合は True、既にメンバーの場合は False、エラーの場合は None を返す。
+    """
+    with self._lock:
+      batch = self._pending.get(band_id)
+      leader = batch is None or len(batch.user_ids) >= self._max_size
+      if leader:
+        batch = self._pending[band_id] = _JoinBatch()
+        band_lock = self._band_locks.get(band_id)
+        if band_lock is None:
+          band_lock = self._band_locks[band_id] = _BandLock()
+        band_lock.waiters += 1
+      batch.user_ids.append(user_id)
+
+    if leader:
+      try:
+        # 前の書き込みが終わるまでの間に届いた参加も、このバッチに入る
+        with band_lock.lock:
+          with self._lock:
+            if self._pending.get(band_id) is batch:
+              del self._pending[band_id]
+          batch.added = BandDatabaseManager().add_members(band_id, batch.user_ids)
+      finally:
+        with self._lock:
+          band_lock.waiters -= 1
+          if band_lock.waiters == 0:
+            del self._band_locks[band_id]
+        batch.done.set()
+    else:
+      batch.done.wait()
+
+    if batch.added is None:
+      return None
+    return user_id in batch.added
+
+
+# プロセス内で共有するバッチ
+join_batcher = JoinBatcher()
+
+
+def add_member(user_id: int, band_id: int) -> bool | None:
+  """
+  ユーザーをバンドのメンバーとして追加する。
+  追加した場合は True、既にメンバーの場合は False、エラーの場合は None を返す。
+  """
+  if JOIN_BATCHING:
+    return join_batcher.add_member(user_id, band_id)
+  added = BandDatabaseManager().add_members(band_id, [user_id])
+  if added is None:
+    return None
+  return user_id in added
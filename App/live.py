@@ -0,0 +1,182 @@
+import os
+import queue
+import threading
+import time
+
+from .aggregate import aggregate_schedules, cell_map
+from .db.band import BandDatabaseManager
+from .db.base import primary_reads
+from .db.events import (
+  BAND_CHANGED, BAND_DELETED, MEMBER_ADDED, MEMBER_REMOVED,
+  SCHEDULE_UPDATED, SCHEDULES_DELETED, USER_CHANGED, USER_DELETED, Event, bus,
+)
+from .db.log import log_error
+from .db.schedule import ScheduleDatabaseManager
+
+
+# 同じバンドへの通知が続いた場合に、まとめて1回だけ集計し直すための待ち時間(秒)
+COALESCE_SECONDS = 0.2
+
+
+class BandBroadcaster:
+  """
+  バンドのページを開いているクライアントに、参加可否の変更をプッシュするクラス。
+  スケジュールの更新などの無効化イベントを受けると、バンドごとに1回だけ集計し直し、
+  前回の集計結果から変わったマスだけを接続中の全クライアントのキューに入れる。
+  接続数が増えてもDBへの問い合わせはバンドごと・更新ごとに1回で済む。
+  gevent のワーカーでは待機中のクライアントはキューで待つグリーンレットなので、スレッドを占有しない。
+  """
+
+  def __init__(self, coalesce_seconds: float = COALESCE_SECONDS):
+    self._coalesce_seconds = coalesce_seconds
+    self._lock = threading.Lock()
+    self._clients: dict[int, set[queue.Queue]] = {}
+    # band_id -> {(日付の文字列, 時間): 参加可能なメンバー名}
+    self._snapshots: dict[int, dict[tuple[str, int], tuple[str, ...]]] = {}
+    self._totals: dict[int, int] = {}
+    self._dirty: set[int] = set()
+    self._wakeup = threading.Event()
+    self._thread: threading.Thread | None = None
+    self._pid: int | None = None
+    self._subscribed = False
+
+  def connect(self, band_id: int) -> queue.Queue:
+    """クライアントを登録し、変更を受け取るキューを返す"""
+    self._ensure_started()
+    client: queue.Queue = queue.Queue()
+    with self._lock:
+      first = band_id not in self._clients
+      self._clients.setdefault(band_id, set()).add(client)
+
+    # 最初のクライアントが接続したときに、差分の基準となる集計結果を作っておく
+    if first:
+      snapshot, total = self._compute(band_id)
+      with self._lock:
+        self._snapshots.setdefault(band_id, snapshot)
+        self._totals.setdefault(band_id, total)
+    return client
+
+  def disconnect(self, band_id: int, client: queue.Queue) -> None:
+    """クライアントの登録を解除する。誰も見ていないバンドの集計結果は破棄する"""
+    with self._lock:
+      clients = self._clients.get(band_id)
+      if clients is None or client not in clients:
+        return
+      clients.discard(client)
+      if not clients:
+        del self._clients[band_id]
+        self._snapshots.pop(band_id, None)
+        self._totals.pop(band_id, None)
+        self._dirty.discard(band_id)
+
+  def close(self) -> None:
+    """
+    接続中の全クライアントのストリームを終わらせる (ワーカーの終了時に呼ぶ)。
+    ブラウザは retry の秒数後に、残っている別のワーカーへ接続し直す
+    """
+    with self._lock:
+      clients = [client for clients in self._clients.values() for client in clients]
+    for client in clients:
+      client.put(None)
+
+  def current(self, band_id: int) -> tuple[dict[tuple[str, int], tuple[str, ...]], int]:
+    """
+    バンドの現在の集計結果 ({(日付の文字列, 時間): 参加可能なメンバー名}, メンバー数) を返す (ポーリング用)。
+    ストリームで見られていて最新のバンドは、配信用に持っている集計結果を使う。
+    """
+    with self._lock:
+      if band_id in self._snapshots and band_id in self._totals and band_id not in self._dirty:
+        return self._snapshots[band_id], self._totals[band_id]
+    return self._compute(band_id)
+
+  def mark_dirty(self, band_id: int) -> None:
+    """バンドの集計し直しを予約する"""
+    with self._lock:
+      if band_id not in self._clients:
+        return
+      self._dirty.add(band_id)
+    self._wakeup.set()
+
+  # --- 内部ヘルパーメソッド ---
+
+  def _ensure_started(self) -> None:
+    with self._lock:
+      if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+        return
+      self._pid = os.getpid()
+      self._thread = threading.Thread(target=self._run, name="band-broadcaster", daemon=True)
+      self._thread.start()
+      subscribed, self._subscribed = self._subscribed, True
+
+    if not subscribed:
+      bus.subscribe(self._on_event)
+      bus.on_flush(self._mark_all_dirty)
+    bus.start()
+
+  def _on_event(self, event: Event) -> None:
+    if event.kind in (SCHEDULE_UPDATED, BAND_CHANGED, BAND_DELETED, MEMBER_ADDED, MEMBER_REMOVED):
+      if event.band_id:
+        self.mark_dirty(event.band_id)
+    elif event.kind in (SCHEDULES_DELETED, USER_CHANGED, USER_DELETED):
+      # どのバンドに影響するかはイベントからわからないため、見られている全バンドを集計し直す
+      self._mark_all_dirty()
+
+  def _mark_all_dirty(self) -> None:
+    # イベントを取りこぼした可能性がある場合などに、見られている全バンドを集計し直す
+    with self._lock:
+      self._dirty.update(self._clients)
+    self._wakeup.set()
+
+  def _run(self) -> None:
+    while True:
+      self._wakeup.wait()
+      # 短時間に続いた保存(自動保存など)をまとめて処理する
+      time.sleep(self._coalesce_seconds)
+      with self._lock:
+        self._wakeup.clear()
+        dirty, self._dirty = self._dirty, set()
+
+      for band_id in dirty:
+        try:
+          self._broadcast(band_id)
+        except Exception as e:
+          log_error("スケジュールの変更の配信中にエラーが発生しました", "broadcast", e, band_id=band_id)
+
+  def _compute(self, band_id: int) -> tuple[dict[tuple[str, int], tuple[str, ...]], int]:
+    # 差分の基準になるので、レプリカの遅延で変更前の内容に戻って見えないようにプライマリから読む
+    # iter_schedules はジェネレータで、読み始めたときに接続を選ぶので、集計もブロックの中で行う
+    with primary_reads():
+      members = BandDatabaseManager().get_users(band_id)
+      member_map = {member.id: member.name for member in members}
+      schedules = ScheduleDatabaseManager().iter_schedules(band_id=band_id)
+      _, schedules_detail, _ = aggregate_schedules(schedules, member_map)
+    return cell_map(schedules_detail), len(members)
+
+  def _broadcast(self, band_id: int) -> None:
+    snapshot, total = self._compute(band_id)
+
+    with self._lock:
+      clients = list(self._clients.get(band_id, ()))
+      if not clients:
+        return
+      previous = self._snapshots.get(band_id, {})
+      self._snapshots[band_id] = snapshot
+      total_changed = self._totals.get(band_id) != total
+      self._totals[band_id] = total
+
+    changed = []
+    for key in previous.keys() | snapshot.keys():
+      names = snapshot.get(key, ())
+      if previous.get(key, ()) != names:
+        date_str, hour = key
+        changed.append({"date": date_str, "hour": hour, "count": len(names), "members": list(names)})
+    if not changed and not total_changed:
+      return
+
+    event = {"cells": changed, "total_members": total}
+    for client in clients:
+      client.put(event)
+
+
+# プロセス内で共有するブロードキャスター
+broadcaster = BandBroadcaster()
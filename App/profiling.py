@@ -0,0 +1,254 @@
+"""
+本番で遅いリクエストを調べるための、リクエスト単位のプロファイリング。
+
+X-Profile-Token ヘッダーに PROFILE_TOKEN を付けたリクエスト、または PROFILE_SAMPLE_RATE の割合で選んだリクエストについて、
+処理中のスレッドのスタックを PROFILE_INTERVAL_MS ごとに記録し、tracemalloc でメモリ使用量のピークを測る。
+結果は PROFILE_DIR に collapsed stack 形式 (<id>.collapsed) で保存する。
+flamegraph.pl や speedscope (https://www.speedscope.app) でそのまま開ける。
+計測した内容 (ルールのパターン・ステータス・時間・ピーク) は <id>.json に保存し、/profiles で一覧できる。
+パスやクエリに含まれるトークンを残さないよう、パスは /feed/<token>.ics のようなルールのパターンで記録する。
+
+tracemalloc はプロセス全体で1つなので、同時に処理している他のリクエストの確保もピークに含まれる。
+"""
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from functools import lru_cache
+from types import FrameType
+from typing import Callable
+
+import greenlet
+from flask import g, request
+from gevent import monkey
+
+from .app_init_ import app
+from const import PROFILE_DIR, PROFILE_INTERVAL_MS, PROFILE_KEEP, PROFILE_SAMPLE_RATE, PROFILE_TOKEN
+
+
+PROFILE_HEADER = "X-Profile-Token"
+
+# gevent のパッチが当たっていても、本物のスレッドで記録するための元の関数
+_start_new_thread = monkey.get_original("_thread", "start_new_thread")
+_allocate_lock = monkey.get_original("_thread", "allocate_lock")
+_get_ident = monkey.get_original("_thread", "get_ident")
+_sleep = monkey.get_original("time", "sleep")
+
+
+def authorized(token: str | None) -> bool:
+  """プロファイリングのトークンが正しいか (トークンが設定されていなければ常に False)"""
+  return bool(PROFILE_TOKEN) and token is not None and hmac.compare_digest(token, PROFILE_TOKEN)
+
+
+class _Tracing:
+  """同時にプロファイルしているリクエストがある間だけ tracemalloc を動かす"""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._users = 0
+    self._started = False
+
+  def acquire(self) -> None:
+    with self._lock:
+      if self._users == 0 and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        self._started = True
+      self._users += 1
+      tracemalloc.reset_peak()
+
+  def release(self) -> int:
+    """このリクエストの間のピーク(バイト)を返す"""
+    with self._lock:
+      _, peak = tracemalloc.get_traced_memory()
+      self._users -= 1
+      if self._users == 0 and self._started:
+        tracemalloc.stop()
+        self._started = False
+      return peak
+
+
+_tracing = _Tracing()
+
+
+class StackSampler:
+  """
+  リクエストを処理しているスレッド (gevent ではグリーンレット) のスタックを一定間隔で記録し、collapsed stack にまとめるクラス。
+  記録はパッチされていない本物のスレッドで行う (グリーンレットでは、処理中のリクエストが切り替えるまで動けないため)。
+  """
+
+  def __init__(self, frame_of: Callable[[], FrameType | None], interval: float):
+    self._frame_of = frame_of
+    self._interval = interval
+    self._stopping = False
+    self._done = _allocate_lock()
+    self.stacks: Counter[str] = Counter()
+
+  def start(self) -> None:
+    self._done.acquire()
+    _start_new_thread(self._run, ())
+
+  def stop(self) -> None:
+    self._stopping = True
+    # 記録するスレッドが終わるまで待つ (長くても1回の間隔分)
+    self._done.acquire()
+    self._done.release()
+
+  def collapsed(self) -> str:
+    """"呼び出し元;...;関数 回数" の行にする (回数の多い順)"""
+    return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+  # --- 内部ヘルパーメソッド ---
+
+  def _run(self) -> None:
+    try:
+      while not self._stopping:
+        _sleep(self._interval)
+        frame = self._frame_of()
+        if frame is None:
+          continue
+        names = []
+        while frame is not None:
+          code = frame.f_code
+          names.append(f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})")
+          frame = frame.f_back
+        self.stacks[";".join(reversed(names))] += 1
+    finally:
+      self._done.release()
+
+
+def _current_frame_source() -> Callable[[], FrameType | None]:
+  """このリクエストを処理しているスレッド (gevent ではグリーンレット) の、その時点のフレームを返す関数を作る"""
+  thread_id = _get_ident()
+  if not monkey.is_module_patched("threading"):
+    return lambda: sys._current_frames().get(thread_id)
+
+  current = greenlet.getcurrent()
+
+  def frame_of() -> FrameType | None:
+    # 切り替えられて待っている間は gr_frame に、実行中はスレッドの現在のフレームにある
+    frame = current.gr_frame
+    if frame is None and not current.dead:
+      frame = sys._current_frames().get(thread_id)
+    return frame
+  return frame_of
+
+
+@lru_cache(maxsize=4096)
+def _short_path(path: str) -> str:
+  """アプリのファイルは相対パス、ライブラリはパッケージ以下のパスにする (; は collapsed stack の区切りなので使わない)"""
+  for root in sorted((p for p in sys.path if p), key=len, reverse=True):
+    if path.startswith(root + os.sep):
+      path = path[len(root) + 1:]
+      break
+  return path.replace(";", "_")
+
+
+class RequestProfile:
+  """1つのリクエストのプロファイル"""
+
+  def __init__(self):
+    self.started_at = datetime.now()
+    self._started = time.perf_counter()
+    self._sampler = StackSampler(_current_frame_source(), PROFILE_INTERVAL_MS / 1000)
+    _tracing.acquire()
+    self._sampler.start()
+
+  def finish(self, status: int) -> str:
+    """計測を終えて保存し、プロファイルのIDを返す"""
+    self._sampler.stop()
+    peak = _tracing.release()
+    duration_ms = (time.perf_counter() - self._started) * 1000
+
+    # パスやクエリにはトークン (/feed/<token>.ics, /join?token=...) が入るので、ルールのパターンだけを残す
+    path = _route_pattern()
+    slug = re.sub(r"[^A-Za-z0-9]+", "-", path).strip("-") or "index"
+    profile_id = f"{self.started_at:%Y%m%d-%H%M%S-%f}-{slug}"[:120]
+    meta = {
+      "id": profile_id,
+      "created_at": self.started_at.isoformat(timespec="seconds"),
+      "method": request.method,
+      "path": path,
+      "status": status,
+      "duration_ms": round(duration_ms, 1),
+      "peak_kib": round(peak / 1024, 1),
+      "samples": sum(self._sampler.stacks.values()),
+      "interval_ms": PROFILE_INTERVAL_MS,
+    }
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(os.path.join(PROFILE_DIR, f"{profile_id}.collapsed"), "w", encoding="utf-8") as f:
+      f.write(self._sampler.collapsed())
+    with open(os.path.join(PROFILE_DIR, f"{profile_id}.json"), "w", encoding="utf-8") as f:
+      json.dump(meta, f, ensure_ascii=False)
+    _prune()
+    return profile_id
+
+
+def _route_pattern() -> str:
+  """リクエストに一致したルールのパターン (/feed/<token>.ics など)。一致するルールがなければ "(no route)" """
+  return request.url_rule.rule if request.url_rule is not None else "(no route)"
+
+
+def recent_profiles(limit: int = 100) -> list[dict]:
+  """保存されているプロファイルの情報を新しい順に返す"""
+  if not os.path.isdir(PROFILE_DIR):
+    return []
+  profiles = []
+  for name in sorted(os.listdir(PROFILE_DIR), reverse=True):
+    if not name.endswith(".json"):
+      continue
+    try:
+      with open(os.path.join(PROFILE_DIR, name), encoding="utf-8") as f:
+        profiles.append(json.load(f))
+    except (OSError, ValueError):
+      continue
+    if len(profiles) >= limit:
+      break
+  return profiles
+
+
+def _prune() -> None:
+  """古いプロファイルを削除して PROFILE_KEEP 件にする (ファイル名は日時で始まるので名前順で古い順になる)"""
+  names = sorted(name for name in os.listdir(PROFILE_DIR) if name.endswith(".json"))
+  for name in names[:-PROFILE_KEEP] if PROFILE_KEEP > 0 else []:
+    profile_id = name[:-len(".json")]
+    for suffix in (".json", ".collapsed"):
+      try:
+        os.remove(os.path.join(PROFILE_DIR, profile_id + suffix))
+      except OSError:
+        pass
+
+
+# --- リクエストのフック ---
+
+@app.before_request
+def start_profile():
+  """ヘッダーのトークンが正しいか、サンプリングで選ばれたリクエストのプロファイルを始める"""
+  if authorized(request.headers.get(PROFILE_HEADER)) or (
+    PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+  ):
+    # プロファイルの一覧・ダウンロード自体は計測しない
+    if request.endpoint not in ("profiles_index", "profile_file"):
+      g.profile = RequestProfile()
+
+
+@app.after_request
+def finish_profile(response):
+  profile = g.pop("profile", None)
+  if profile is not None:
+    response.headers["X-Profile-Id"] = profile.finish(response.status_code)
+  return response
+
+
+@app.teardown_request
+def abandon_profile(error):
+  """例外で after_request が呼ばれなかった場合も、サンプリングのスレッドを止めて保存する"""
+  profile = g.pop("profile", None)
+  if profile is not None:
+    profile.finish(500)
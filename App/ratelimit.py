@@ -0,0 +1,126 @@
+import math
+import threading
+import time
+
+from flask import jsonify
+
+from const import (
+  SAVE_BURST, SAVE_GLOBAL_RATE_PER_SECOND, SAVE_INTERVAL_MS,
+  SAVE_MAX_INTERVAL_MS, SAVE_RATE_PER_SECOND,
+)
+
+
+class TokenBucket:
+  """
+  rate 個/秒で補充され、最大 capacity 個まで貯まるトークンバケット。
+  スレッドセーフではないので、呼び出し側でロックする。
+  """
+
+  __slots__ = ("rate", "capacity", "tokens", "updated")
+
+  def __init__(self, rate: float, capacity: float, now: float):
+    self.rate = rate
+    self.capacity = capacity
+    self.tokens = capacity
+    self.updated = now
+
+  def refill(self, now: float) -> None:
+    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+    self.updated = now
+
+  def take(self, now: float) -> bool:
+    """トークンを1つ使う。足りなければ使わずに False を返す"""
+    self.refill(now)
+    if self.tokens >= 1:
+      self.tokens -= 1
+      return True
+    return False
+
+  def wait_seconds(self) -> float:
+    """次のトークンが1つ貯まるまでの秒数 (refill した直後に呼ぶ)"""
+    if self.tokens >= 1:
+      return 0.0
+    return (1 - self.tokens) / self.rate
+
+  def is_full(self, now: float) -> bool:
+    return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class Admission:
+  """保存を受け付けるかどうかと、クライアントが次に保存するまでの待ち時間"""
+
+  __slots__ = ("allowed", "retry_after", "next_save_ms")
+
+  def __init__(self, allowed: bool, retry_after: float, next_save_ms: int):
+    self.allowed = allowed
+    self.retry_after = retry_after    # 拒否した場合、再送してよくなるまでの秒数
+    self.next_save_ms = next_save_ms  # 次の自動保存までに空けてほしい時間
+
+
+class SaveLimiter:
+  """
+  自動保存のアドミッション制御。
+  ユーザーごとのバケットで1人が連打できる回数を、プロセス全体のバケットで合計の書き込みの量を制限する。
+  受け付けた場合も、全体のバケットの減り具合に応じて次の保存までの間隔を長くするよう返す。
+  バケットはプロセスごとに持つので、ワーカーが複数ある場合の上限はその数だけ緩くなる。
+  """
+
+  # これを超えたら、満タンに戻った(しばらく保存していない)ユーザーのバケットを捨てる
+  MAX_TRACKED_USERS = 10000
+
+  def __init__(
+    self, rate: float = SAVE_RATE_PER_SECOND, burst: int = SAVE_BURST,
+    global_rate: float = SAVE_GLOBAL_RATE_PER_SECOND,
+    interval_ms: int = SAVE_INTERVAL_MS, max_interval_ms: int = SAVE_MAX_INTERVAL_MS,
+  ):
+    self._rate = rate
+    self._burst = burst
+    self._interval_ms = interval_ms
+    self._max_interval_ms = max_interval_ms
+    self._lock = threading.Lock()
+    self._buckets: dict[int, TokenBucket] = {}
+    # 全体では2秒分までの集中を受け付ける
+    self._global = TokenBucket(global_rate, max(1.0, global_rate * 2), time.monotonic())
+
+  def admit(self, user_id: int) -> Admission:
+    now = time.monotonic()
+    with self._lock:
+      bucket = self._buckets.get(user_id)
+      if bucket is None:
+        if len(self._buckets) >= self.MAX_TRACKED_USERS:
+          self._evict_idle(now)
+        bucket = self._buckets[user_id] = TokenBucket(self._rate, self._burst, now)
+
+      bucket.refill(now)
+      self._global.refill(now)
+      if bucket.tokens < 1 or self._global.tokens < 1:
+        retry_after = max(bucket.wait_seconds(), self._global.wait_seconds())
+        return Admission(False, retry_after, self._max_interval_ms)
+
+      bucket.take(now)
+      self._global.take(now)
+      # 全体のバケットが空に近いほど、間隔を上限に近づける
+      pressure = 1 - self._global.tokens / self._global.capacity
+      next_save_ms = self._interval_ms + (self._max_interval_ms - self._interval_ms) * pressure
+      # 提案どおりに保存すれば、そのユーザーのバケットで拒否されないようにする
+      next_save_ms = max(next_save_ms, bucket.wait_seconds() * 1000)
+      return Admission(True, 0.0, int(next_save_ms))
+
+  def _evict_idle(self, now: float) -> None:
+    for user_id in [user_id for user_id, bucket in self._buckets.items() if bucket.is_full(now)]:
+      del self._buckets[user_id]
+
+
+def too_many_requests(admission: Admission):
+  """保存を拒否したときの 429 レスポンス。Retry-After は秒単位の整数にする"""
+  retry_after = max(1, math.ceil(admission.retry_after))
+  response = jsonify({
+    "status": "error",
+    "message": "Too many requests",
+    "retry_after_ms": int(admission.retry_after * 1000),
+  })
+  response.headers["Retry-After"] = str(retry_after)
+  return response, 429
+
+
+save_limiter = SaveLimiter()
@@ -0,0 +1,200 @@
+import heapq
+from datetime import date, timedelta
+from typing import Iterable, Literal
+
+
+HOURS_PER_DAY = 24
+
+
+class Recommendation:
+  """おすすめの練習枠を格納するためのデータクラス"""
+
+  def __init__(self, day: date, start_hour: int, length: int, member_ids: list[int]):
+    self.day = day
+    self.start_hour = start_hour
+    self.length = length
+    self.member_ids = member_ids
+
+  @property
+  def count(self) -> int:
+    return len(self.member_ids)
+
+  def __repr__(self):
+    return (
+      f"Recommendation(day='{self.day}', start_hour={self.start_hour}, "
+      f"length={self.length}, member_ids={self.member_ids})"
+    )
+
+
+class AvailabilityIndex:
+  """
+  バンド期間内のメンバーごとの空き状況をビットセット(int)として保持するクラス。
+  ビット位置は (開始日からの日数 * 24 + 時) で表す。
+  """
+
+  def __init__(self, start_date: date, end_date: date, start_hour: int, end_hour: int):
+    self.start_date = start_date
+    self.days = max((end_date - start_date).days + 1, 0)
+    self.start_hour = start_hour
+    self.end_hour = end_hour
+    self.members: dict[int, int] = {}
+    self.busy = 0
+
+    self.window = self._day_mask(start_hour, end_hour)
+    self._start_masks: dict[int, int] = {}
+
+  # --- 構築 ---
+
+  def to_bits(self, schedule: dict[date, list[Literal[0, 1]]]) -> int:
+    """schedule辞書をこのインデックスのビットセットに変換する"""
+    bits = 0
+    for day, hour_list in schedule.items():
+      day_index = (day - self.start_date).days
+      if not 0 <= day_index < self.days:
+        continue
+      # 時刻の若い順に下位ビットへ並べるため、逆順の2進数文字列として一括で変換する
+      day_bits = int("".join(["1" if v else "0" for v in reversed(hour_list[:HOURS_PER_DAY])]) or "0", 2)
+      bits |= day_bits << (day_index * HOURS_PER_DAY)
+    return bits & self.window
+
+  def add_member(self, user_id: int, schedule: dict[date, list[Literal[0, 1]]]) -> None:
+    """メンバーの空き状況を登録する"""
+    self.members[user_id] = self.to_bits(schedule)
+
+  def add_busy(self, schedule: dict[date, list[Literal[0, 1]]]) -> None:
+    """既にバンド練が入っている枠を候補から除外する"""
+    self.busy |= self.to_bits(schedule)
+
+  def add_conflicts(self, user_id: int, slots: Iterable[tuple[date, int]]) -> None:
+    """メンバーが所属する他バンドのバンド練と重なる枠 (日付, 時) を、そのメンバーの空きから外す"""
+    if user_id not in self.members:
+      return
+    busy = 0
+    for day, hour in slots:
+      day_index = (day - self.start_date).days
+      if 0 <= day_index < self.days:
+        busy |= 1 << (day_index * HOURS_PER_DAY + hour)
+    self.members[user_id] &= ~busy
+
+  # --- 検索 ---
+
+  def recommend(
+    self, length: int = 1, top_k: int = 10,
+    required_ids: Iterable[int] = (), min_count: int = 1
+  ) -> list[Recommendation]:
+    """
+    length時間連続で参加できるメンバー数の多い順に、上位top_k件の枠を返す。
+    required_idsのメンバーが全員参加できない枠は候補から除く。
+    同数の場合は日時の早い枠を優先する。
+    """
+    if length < 1 or top_k < 1 or not self.members:
+      return []
+
+    # 各メンバーについて「その時刻からlength時間連続で空いている」開始位置のビットセットを作る
+    blocks = {user_id: self._block_starts(bits, length) for user_id, bits in self.members.items()}
+
+    candidates = self._block_starts(self.window & ~self.busy, length)
+    for user_id in required_ids:
+      candidates &= blocks.get(user_id, 0)
+    if not candidates:
+      return []
+
+    planes = self._count_planes(blocks.values(), candidates)
+
+    # 人数の多い方から、ちょうどその人数になる枠を集めていく
+    picked: list[int] = []
+    upper = 0
+    for count in range(len(blocks), max(min_count, 1) - 1, -1):
+      at_least = self._at_least(planes, count) & candidates
+      exact = at_least & ~upper
+      upper = at_least
+      while exact and len(picked) < top_k:
+        lowest = exact & -exact
+        picked.append(lowest.bit_length() - 1)
+        exact ^= lowest
+      if len(picked) >= top_k:
+        break
+
+    results = []
+    for position in picked:
+      bit = 1 << position
+      member_ids = [user_id for user_id, starts in blocks.items() if starts & bit]
+      day_index, hour = divmod(position, HOURS_PER_DAY)
+      results.append(Recommendation(
+        self.start_date + timedelta(days=day_index), hour, length, member_ids
+      ))
+    return results
+
+  # --- 内部ヘルパーメソッド ---
+
+  def _block_starts(self, bits: int, length: int) -> int:
+    """length時間連続で1が続く区間の開始位置だけを残す"""
+    starts = bits
+    for shift in range(1, length):
+      starts &= bits >> shift
+
+    # 日をまたぐ区間は無効なので、終了時刻に収まる開始位置だけに絞る
+    if length not in self._start_masks:
+      self._start_masks[length] = self._day_mask(self.start_hour, self.end_hour - length + 1)
+    return starts & self._start_masks[length]
+
+  def _day_mask(self, first_hour: int, last_hour: int) -> int:
+    """first_hour〜last_hourだけを1にした1日分のマスクを、期間の日数分並べる"""
+    day_mask = 0
+    for hour in range(max(first_hour, 0), min(last_hour, HOURS_PER_DAY - 1) + 1):
+      day_mask |= 1 << hour
+    mask = 0
+    for day_index in range(self.days):
+      mask |= day_mask << (day_index * HOURS_PER_DAY)
+    return mask
+
+  def _count_planes(self, bitsets: Iterable[int], mask: int) -> list[int]:
+    """
+    ビットスライス方式の加算器で、各位置のビットの立っている数を2進数の桁ごとのビットセットにする。
+    planes[i] は「カウントの第iビット」を全位置ぶん並べたもの。
+    """
+    planes: list[int] = []
+    for bits in bitsets:
+      carry = bits & mask
+      for i, plane in enumerate(planes):
+        if not carry:
+          break
+        planes[i] = plane ^ carry
+        carry &= plane
+      if carry:
+        planes.append(carry)
+    return planes
+
+  def _at_least(self, planes: list[int], threshold: int) -> int:
+    """カウントがthreshold以上になる位置のビットセットを返す"""
+    if threshold <= 0:
+      return self.window
+    if threshold.bit_length() > len(planes):
+      return 0
+    full = self.window
+    greater = 0
+    equal = full
+    for i in range(len(planes) - 1, -1, -1):
+      plane = planes[i]
+      if (threshold >> i) & 1:
+        equal &= plane
+      else:
+        greater |= equal & plane
+        equal &= ~plane & full
+    return greater | equal
+
+
+def top_recommendations(
+  index: AvailabilityIndex, lengths: Iterable[int], top_k: int = 10,
+  required_ids: Iterable[int] = (), min_count: int = 1
+) -> list[Recommendation]:
+  """複数の練習時間(length)の候補をまとめて、人数・時間の長さ・日時の順に上位top_k件を返す"""
+  required_ids = list(required_ids)
+  results: list[Recommendation] = []
+  for length in set(lengths):
+    results.extend(index.recommend(length, top_k, required_ids, min_count))
+
+  return heapq.nsmallest(
+    top_k, results,
+    key=lambda r: (-r.count, -r.length, r.day, r.start_hour)
+  )
@@ -0,0 +1,101 @@
+"""
+トップページに表示する、ユーザーの今後のバンド練。
+
+所属する全てのバンドのバンド練(user_id=0)を1クエリで読み、連続する時間をまとめた練習枠にする。
+結果はユーザーごとにキャッシュし、バンド練の保存などの無効化イベントを受けるまで使い回す。
+キャッシュには当日以降の全ての枠を入れておき、終わった枠と件数の絞り込みは表示するたびに行う。
+"""
+from contextlib import nullcontext
+from datetime import date, datetime
+
+from .db.base import primary_reads
+from .db.cache import practice_cache
+from .db.schedule import ScheduleDatabaseManager
+from .grid import WEEKDAYS, practice_color
+
+
+class PracticeBlock:
+  """連続する時間をまとめたバンド練の枠を格納するためのデータクラス (end_hour はその時間を含まない)"""
+
+  __slots__ = ("band_id", "band_name", "color", "day", "start_hour", "end_hour")
+
+  def __init__(self, band_id: int, band_name: str, color: str, day: date, start_hour: int, end_hour: int):
+    self.band_id = band_id
+    self.band_name = band_name
+    self.color = color
+    self.day = day
+    self.start_hour = start_hour
+    self.end_hour = end_hour
+
+  @property
+  def date_label(self) -> str:
+    return f"{self.day:%m/%d} ({WEEKDAYS[self.day.weekday()]})"
+
+  @property
+  def time_label(self) -> str:
+    return f"{self.start_hour:02d}:00 - {self.end_hour:02d}:00"
+
+  def __repr__(self):
+    return (
+      f"PracticeBlock(band_id={self.band_id}, day='{self.day}', "
+      f"start_hour={self.start_hour}, end_hour={self.end_hour})"
+    )
+
+
+def merge_hours(hours: list) -> list[tuple[int, int]]:
+  """24時間分の 0/1 のリストを、チェックが連続する (開始時, 終了時) のリストにする"""
+  ranges = []
+  start = None
+  for hour, checked in enumerate(hours):
+    if checked == 1 and start is None:
+      start = hour
+    elif checked != 1 and start is not None:
+      ranges.append((start, hour))
+      start = None
+  if start is not None:
+    ranges.append((start, len(hours)))
+  return ranges
+
+
+def upcoming_practices(user_id: int, limit: int, now: datetime | None = None) -> list[PracticeBlock]:
+  """まだ終わっていないバンド練の枠を、早い順に limit 件まで返す"""
+  now = now or datetime.now()
+  blocks = practice_cache.get(user_id)
+  if blocks is None:
+    generation = practice_cache.begin()
+    # キャッシュに入れる内容は、レプリカの遅延の影響を受けないようにプライマリから読む
+    with primary_reads() if practice_cache.active else nullcontext():
+      rows = ScheduleDatabaseManager().get_upcoming_practice_days(user_id, now.date())
+    if rows is None:
+      return []
+    blocks = _to_blocks(rows)
+    practice_cache.put(user_id, blocks, frozenset(row["band_id"] for row in rows), generation)
+
+  today, hour = now.date(), now.hour
+  upcoming = []
+  for block in blocks:
+    if block.day > today or (block.day == today and block.end_hour > hour):
+      upcoming.append(block)
+      if len(upcoming) >= limit:
+        break
+  return upcoming
+
+
+def _to_blocks(rows: list[dict]) -> tuple[PracticeBlock, ...]:
+  """日付順の行を、(日付, 開始時, バンドの並び順) の順に並べた枠にする"""
+  keyed = []
+  for row in rows:
+    if row["day"] is None or not isinstance(row["hours"], list):
+      continue
+    try:
+      day = date.fromisoformat(row["day"])
+    except ValueError:
+      continue
+    color = practice_color(row["color_index"])
+    for start, end in merge_hours(row["hours"]):
+      keyed.append((
+        (day, start, row["color_index"]),
+        PracticeBlock(row["band_id"], row["name"], color, day, start, end),
+      ))
+  keyed.sort(key=lambda item: item[0])
+  return tuple(block for _, block in keyed)
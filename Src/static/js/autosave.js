@@ -0,0 +1,119 @@
+/*
+ * スケジュール/バンド練の自動保存
+ * - 変更が落ち着いてから (DEBOUNCE_MS) 保存する
+ * - サーバーが返す next_save_ms より短い間隔では保存しない (混雑時はサーバーが間隔を長くする)
+ * - 保存できたら onSaved(送った内容) を呼ぶ (差分だけを送る画面で、送った分を未保存から外すため)
+ * - 429 のときは Retry-After まで、通信エラーやその他のエラーのときは指数バックオフで待つ (どちらも揺らぎを加える)
+ */
+function createAutosave({ url, buildBody, statusElement, onSaved }) {
+  const DEBOUNCE_MS = 1000;
+  const MAX_DEBOUNCE_MS = 10000;  // 変更が続いていても、これ以上は保存を遅らせない
+  const DEFAULT_INTERVAL_MS = 3000;
+  const BACKOFF_BASE_MS = 2000;
+  const BACKOFF_MAX_MS = 60000;
+
+  let version = 0;        // 変更のたびに増やす
+  let savedVersion = 0;   // 保存が完了した時点の version
+  let intervalMs = DEFAULT_INTERVAL_MS;
+  let notBefore = 0;      // この時刻(ms)までは保存しない
+  let failures = 0;
+  let timer = null;
+  let saving = false;
+  let dirtySince = 0;     // 未保存の変更が最初に入った時刻(ms)
+
+  const isDirty = () => version !== savedVersion;
+
+  const setStatus = (text) => {
+    if (statusElement) statusElement.textContent = text;
+  };
+
+  // 多数のクライアントが同時に再送しないよう、待ち時間を 50%〜100% の範囲でばらつかせる
+  const jitter = (ms) => ms / 2 + Math.random() * ms / 2;
+
+  function schedule() {
+    if (saving || !isDirty()) return;
+    clearTimeout(timer);
+    const now = Date.now();
+    const debounce = Math.min(DEBOUNCE_MS, dirtySince + MAX_DEBOUNCE_MS - now);
+    timer = setTimeout(save, Math.max(0, debounce, notBefore - now));
+  }
+
+  async function save() {
+    timer = null;
+    if (saving || !isDirty()) return;
+    saving = true;
+    const sendingVersion = version;
+    const body = buildBody();
+    setStatus('保存中...');
+
+    try {
+      const response = await fetch(url, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(body),
+      });
+
+      if (response.status === 202) {
+        // オフラインのため Service Worker に保存が積まれた (オンライン復帰後に自動で送信される)
+        savedVersion = sendingVersion;
+        failures = 0;
+        notBefore = Date.now() + intervalMs;
+        if (onSaved) onSaved(body);
+        setStatus('オフライン: 接続が戻ったら保存します');
+      } else if (response.ok) {
+        const data = await response.json().catch(() => ({}));
+        savedVersion = sendingVersion;
+        failures = 0;
+        intervalMs = data.next_save_ms || DEFAULT_INTERVAL_MS;
+        notBefore = Date.now() + intervalMs;
+        dirtySince = Date.now();
+        if (onSaved) onSaved(body);
+        setStatus(isDirty() ? '変更あり' : '保存済み');
+      } else if (response.status === 429) {
+        const retryAfter = parseFloat(response.headers.get('Retry-After')) || BACKOFF_BASE_MS / 1000;
+        notBefore = Date.now() + retryAfter * 1000 + jitter(retryAfter * 1000);
+        setStatus('混雑しています: 少し待ってから保存します');
+      } else if (response.status === 409) {
+        // アーカイブされたバンドには保存できないので、再試行しない
+        savedVersion = sendingVersion;
+        failures = 0;
+        setStatus('アーカイブされたバンドのため保存できません');
+      } else {
+        backoff();
+        setStatus('保存に失敗しました: 再試行します');
+      }
+    } catch (error) {
+      console.error('Error saving schedule:', error);
+      backoff();
+      setStatus('エラーが発生しました: 再試行します');
+    } finally {
+      saving = false;
+      schedule();
+    }
+  }
+
+  function backoff() {
+    failures += 1;
+    const ms = Math.min(BACKOFF_MAX_MS, BACKOFF_BASE_MS * 2 ** (failures - 1));
+    notBefore = Date.now() + jitter(ms);
+  }
+
+  // ページを離れるときは、待ち時間に関わらず未保存の変更を送る
+  document.addEventListener('visibilitychange', () => {
+    if (document.visibilityState === 'hidden' && isDirty() && !saving) {
+      clearTimeout(timer);
+      save();
+    }
+  });
+
+  return {
+    // 変更があったときに呼ぶ
+    markDirty() {
+      if (!isDirty()) dirtySince = Date.now();
+      version += 1;
+      setStatus('変更あり');
+      schedule();
+    },
+    isDirty,
+  };
+}
@@ -15,45 +15,23 @@ document.addEventListener('DOMContentLoaded', () => {
     const allCheckboxes = document.querySelectorAll('.schedule-checkbox');
     const dateHeaders = document.querySelectorAll('.date-header');
     const timeLabels = document.querySelectorAll('.time-label');
-    let isDirty = false;
 
     // チェックボックスが変更されたら、変更フラグを立てる
     allCheckboxes.forEach(checkbox => {
       checkbox.addEventListener('change', () => {
-        isDirty = true;
-        saveStatus.textContent = '変更あり';
+        autosave.markDirty();
       });
     });
 
-    // 3秒ごとに変更をチェックして自動保存
-    setInterval(async () => {
-      if (!isDirty) return;
-
-      saveStatus.textContent = '保存中...';
-      const scheduleData = collectScheduleData();
-      const bandId = parseInt(bandSelector.value, 10);
-
-      try {
-        const response = await fetch('/band-practice/save', {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({
-            band_id: bandId,
-            schedule: scheduleData,
-          }),
-        });
-
-        if (response.ok) {
-          isDirty = false;
-          saveStatus.textContent = '保存済み';
-        } else {
-          saveStatus.textContent = '保存に失敗しました';
-        }
-      } catch (error) {
-        console.error('Error saving schedule:', error);
-        saveStatus.textContent = 'エラーが発生しました';
-      }
-    }, 3000);
+    // 変更が落ち着いたら、サーバーが指定する間隔を守って自動保存する (autosave.js)
+    const autosave = createAutosave({
+      url: '/band-practice/save',
+      statusElement: saveStatus,
+      buildBody: () => ({
+        band_id: parseInt(bandSelector.value, 10),
+        schedule: collectScheduleData(),
+      }),
+    });
 
     // 現在のチェックボックスの状態からスケジュールデータを収集する関数
     function collectScheduleData() {
@@ -85,8 +63,7 @@ document.addEventListener('DOMContentLoaded', () => {
             cb.closest('.schedule-cell').classList.add('cell-highlight');
         });
         if (changedCount > 0) {
-            isDirty = true;
-            saveStatus.textContent = '変更あり';
+            autosave.markDirty();
         }
         setTimeout(() => {
             columnCheckboxes.forEach(cb => cb.closest('.schedule-cell').classList.remove('cell-highlight'));
@@ -108,8 +85,7 @@ document.addEventListener('DOMContentLoaded', () => {
             cb.closest('.schedule-cell').classList.add('cell-highlight');
         });
         if (changedCount > 0) {
-            isDirty = true;
-            saveStatus.textContent = '変更あり';
+            autosave.markDirty();
         }
         setTimeout(() => {
             rowCheckboxes.forEach(cb => cb.closest('.schedule-cell').classList.remove('cell-highlight'));
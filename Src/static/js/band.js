@@ -7,46 +7,60 @@ document.addEventListener('DOMContentLoaded', () => {
     return;
   }
 
+  // ツールチップの内容を組み立てる (参加可能メンバーと、他バンドのバンド練と重なっているメンバー)
+  const buildTooltip = (cell) => {
+    const count = cell.dataset.count;
+    const members = cell.dataset.members;
+    const conflicts = cell.dataset.conflicts;
+    let html = '';
+    if (count > 0 && members) {
+      html += `<strong>${count}人参加可能:</strong><br>${members.replace(/,/g, '<br>')}`;
+    }
+    if (conflicts) {
+      if (html) html += '<br>';
+      html += `<strong>他バンドの練習と重複:</strong><br>${conflicts.replace(/,/g, '<br>')}`;
+    }
+    return html;
+  };
+
+  // リアルタイム更新で後からメンバーが入るマスもあるため、全てのマスにリスナーを付ける
   scheduleCells.forEach(cell => {
-    if (cell.dataset.members) {
-      cell.addEventListener('mouseover', (event) => {
-        const count = cell.dataset.count;
-        const members = cell.dataset.members;
-        if (count > 0 && members) {
-          tooltip.innerHTML = `<strong>${count}人参加可能:</strong><br>${members.replace(/,/g, '<br>')}`;
-          tooltip.classList.add('is-visible');
-          tooltip.style.left = `${event.pageX + 10}px`;
-          tooltip.style.top = `${event.pageY + 10}px`;
-        }
-      });
+    cell.addEventListener('mouseover', (event) => {
+      const html = buildTooltip(cell);
+      if (html) {
+        tooltip.innerHTML = html;
+        tooltip.classList.add('is-visible');
+        tooltip.style.left = `${event.pageX + 10}px`;
+        tooltip.style.top = `${event.pageY + 10}px`;
+      }
+    });
 
-      cell.addEventListener('mousemove', (event) => {
-        if (tooltip.classList.contains('is-visible')) {
-          tooltip.style.left = `${event.pageX + 10}px`;
-          tooltip.style.top = `${event.pageY + 10}px`;
-        }
-      });
+    cell.addEventListener('mousemove', (event) => {
+      if (tooltip.classList.contains('is-visible')) {
+        tooltip.style.left = `${event.pageX + 10}px`;
+        tooltip.style.top = `${event.pageY + 10}px`;
+      }
+    });
 
-      cell.addEventListener('mouseout', () => {
-        tooltip.classList.remove('is-visible');
-      });
+    cell.addEventListener('mouseout', () => {
+      tooltip.classList.remove('is-visible');
+    });
 
-      cell.addEventListener('touchstart', (event) => {
+    cell.addEventListener('touchstart', (event) => {
+      const html = buildTooltip(cell);
+      document.querySelectorAll('.schedule-tooltip.is-visible').forEach(t => t.classList.remove('is-visible'));
+      if (html) {
+        // 表示する内容がないマスでは、スクロールできるようにタッチ操作を止めない
         event.preventDefault();
-        const count = cell.dataset.count;
-        const members = cell.dataset.members;
-        document.querySelectorAll('.schedule-tooltip.is-visible').forEach(t => t.classList.remove('is-visible'));
-        if (count > 0 && members) {
-          tooltip.innerHTML = `<strong>${count}人参加可能:</strong><br>${members.replace(/,/g, '<br>')}`;
-          tooltip.classList.add('is-visible');
-          const rect = cell.getBoundingClientRect();
-          tooltip.style.left = `${rect.left + window.scrollX + rect.width / 2 - tooltip.offsetWidth / 2}px`;
-          tooltip.style.top = `${rect.top + window.scrollY + rect.height + 5}px`;
-        } else {
-          tooltip.classList.remove('is-visible');
-        }
-      });
-    }
+        tooltip.innerHTML = html;
+        tooltip.classList.add('is-visible');
+        const rect = cell.getBoundingClientRect();
+        tooltip.style.left = `${rect.left + window.scrollX + rect.width / 2 - tooltip.offsetWidth / 2}px`;
+        tooltip.style.top = `${rect.top + window.scrollY + rect.height + 5}px`;
+      } else {
+        tooltip.classList.remove('is-visible');
+      }
+    });
   });
 
   document.addEventListener('touchstart', (event) => {
@@ -60,6 +74,82 @@ document.addEventListener('DOMContentLoaded', () => {
     }
   });
 
+  // --- 他のメンバーの保存をリアルタイムに反映 ---
+  const scheduleTable = document.querySelector('.schedule-table');
+  const streamUrl = scheduleTable && scheduleTable.dataset.streamUrl;
+  if (streamUrl && window.EventSource) {
+    const cellMap = new Map();
+    scheduleCells.forEach(cell => {
+      cellMap.set(`${cell.dataset.date}|${cell.dataset.hour}`, cell);
+    });
+
+    const updateCell = (cell, count, members, totalMembers) => {
+      cell.dataset.count = count;
+      if (members.length > 0) {
+        cell.dataset.members = members.join(',');
+      } else {
+        delete cell.dataset.members;
+      }
+      cell.title = `${count} / ${totalMembers} 人`;
+      cell.innerHTML = count > 0 ? `<span>${count}</span>` : '';
+    };
+
+    const applyCells = (data, replaceAll) => {
+      const totalMembers = data.total_members;
+      scheduleTable.dataset.totalMembers = totalMembers;
+
+      // ポーリングでは全てのマスが送られてくるので、含まれていないマスは0人にする
+      const changed = new Set();
+      data.cells.forEach(change => {
+        const key = `${change.date}|${change.hour}`;
+        const cell = cellMap.get(key);
+        if (cell) {
+          updateCell(cell, change.count, change.members, totalMembers);
+          changed.add(key);
+        }
+      });
+      if (replaceAll) {
+        cellMap.forEach((cell, key) => {
+          if (!changed.has(key) && cell.dataset.count !== '0') updateCell(cell, 0, [], totalMembers);
+        });
+      }
+
+      // メンバー数が変わった場合は、変更のなかったマスの表示人数も更新する
+      scheduleCells.forEach(cell => {
+        cell.title = `${cell.dataset.count} / ${totalMembers} 人`;
+      });
+    };
+
+    // ストリームが閉じられた (プロキシがSSEを通さないなど) 場合は、一定間隔のポーリングに切り替える
+    const cellsUrl = scheduleTable.dataset.cellsUrl;
+    const pollMs = (parseInt(scheduleTable.dataset.pollSeconds, 10) || 30) * 1000;
+    let pollTimer = null;
+    const poll = async () => {
+      try {
+        const response = await fetch(cellsUrl);
+        if (response.ok) applyCells(await response.json(), true);
+      } catch (error) {
+        // 通信エラーの場合は次の回に取り直す
+      }
+      pollTimer = setTimeout(poll, pollMs);
+    };
+
+    const source = new EventSource(streamUrl);
+    source.addEventListener('cells', (event) => applyCells(JSON.parse(event.data), false));
+    source.addEventListener('error', () => {
+      // 通信エラーの場合 (CONNECTING) はブラウザが再接続する
+      if (source.readyState === EventSource.CLOSED && !pollTimer) {
+        pollTimer = setTimeout(poll, pollMs);
+      }
+    });
+
+    // ページを離れるときに接続を閉じる
+    window.addEventListener('pagehide', () => {
+      source.close();
+      clearTimeout(pollTimer);
+    });
+  }
+
   // --- スクロール検知機能を追加 ---
   const tableWrapper = document.querySelector('.table-wrapper');
   if (tableWrapper) {
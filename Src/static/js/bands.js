@@ -1,63 +1,99 @@
 document.addEventListener('DOMContentLoaded', () => {
-  // --- 1. バンドカードクリックによるページ遷移処理 ---
-  const bandCards = document.querySelectorAll('.band-card');
-
-  bandCards.forEach(card => {
-    card.addEventListener('click', (event) => {
-      // クリックされたのがコピーボタン等のアクションエリアでなければ遷移
-      if (!event.target.closest('.band-actions')) {
-        const token = card.dataset.token;
-        if (token) {
-          window.location.href = `/band?token=${token}`;
-        }
+  // カードは後から読み込んで追加されるため、リスナーはコンテナに1つだけ登録する
+  const container = document.querySelector('.bands-container');
+
+  container.addEventListener('click', (event) => {
+    const copyButton = event.target.closest('.copy-btn');
+    if (copyButton) {
+      copyInviteUrl(copyButton);
+      return;
+    }
+
+    const loadMoreButton = event.target.closest('.load-more-btn');
+    if (loadMoreButton) {
+      loadMore(loadMoreButton);
+      return;
+    }
+
+    // --- バンドカードクリックによるページ遷移処理 ---
+    // クリックされたのがコピーボタン等のアクションエリアでなければ遷移
+    const card = event.target.closest('.band-card');
+    if (card && !event.target.closest('.band-actions')) {
+      const token = card.dataset.token;
+      if (token) {
+        window.location.href = `/band?token=${token}`;
       }
-    });
+    }
   });
 
 
-  // --- 2. 既存のコピーボタンの処理 ---
-  const copyButtons = document.querySelectorAll('.copy-btn');
+  // --- 続き (またはアーカイブ済み) のバンドを読み込む ---
+  async function loadMore(button) {
+    if (button.disabled) return;
+    button.disabled = true;
 
-  copyButtons.forEach(button => {
-    button.addEventListener('click', (event) => {
-      // クリックされたボタンに関連する要素を取得
-      const bandActions = event.target.closest('.band-actions');
-      if (!bandActions) return;
+    const params = new URLSearchParams({ archived: button.dataset.archived });
+    if (button.dataset.after) params.set('after', button.dataset.after);
 
-      const urlInput = bandActions.querySelector('input[type="text"]');
-      const feedbackElement = bandActions.querySelector('.copy-feedback');
+    try {
+      const response = await fetch(`/bands/page?${params}`);
+      if (!response.ok) throw new Error(`Failed to load bands: ${response.status}`);
+      const data = await response.json();
 
-      if (!urlInput || !feedbackElement) return;
+      document.getElementById(button.dataset.target).insertAdjacentHTML('beforeend', data.html);
+      if (data.next) {
+        button.dataset.after = data.next;
+        button.textContent = 'さらに表示';
+        button.disabled = false;
+      } else {
+        button.remove();
+      }
+    } catch (error) {
+      console.error('バンドの読み込みに失敗しました: ', error);
+      button.disabled = false;
+    }
+  }
 
-      const urlToCopy = urlInput.value;
 
-      // クリップボードにコピー
-      navigator.clipboard.writeText(urlToCopy).then(() => {
-        // 成功時のフィードバック
-        feedbackElement.textContent = 'コピーしました！';
-        feedbackElement.style.opacity = '1';
+  // --- 招待URLのコピー処理 ---
+  function copyInviteUrl(button) {
+    // クリックされたボタンに関連する要素を取得
+    const bandActions = button.closest('.band-actions');
+    if (!bandActions) return;
 
-        // 2秒後にフィードバックを非表示にする
-        setTimeout(() => {
-          feedbackElement.style.opacity = '0';
-        }, 2000);
-      }).catch(err => {
-        // 失敗時のフィードバック
-        console.error('URLのコピーに失敗しました: ', err);
-        feedbackElement.textContent = 'コピーに失敗しました';
-        feedbackElement.style.color = '#fff';
-        feedbackElement.style.backgroundColor = '#e74c3c'; // エラー色
-        feedbackElement.style.opacity = '1';
+    const urlInput = bandActions.querySelector('input[type="text"]');
+    const feedbackElement = bandActions.querySelector('.copy-feedback');
 
+    if (!urlInput || !feedbackElement) return;
+
+    const urlToCopy = urlInput.value;
+
+    // クリップボードにコピー
+    navigator.clipboard.writeText(urlToCopy).then(() => {
+      // 成功時のフィードバック
+      feedbackElement.textContent = 'コピーしました！';
+      feedbackElement.style.opacity = '1';
+
+      // 2秒後にフィードバックを非表示にする
+      setTimeout(() => {
+        feedbackElement.style.opacity = '0';
+      }, 2000);
+    }).catch(err => {
+      // 失敗時のフィードバック
+      console.error('URLのコピーに失敗しました: ', err);
+      feedbackElement.textContent = 'コピーに失敗しました';
+      feedbackElement.style.color = '#fff';
+      feedbackElement.style.backgroundColor = '#e74c3c'; // エラー色
+      feedbackElement.style.opacity = '1';
+
+      setTimeout(() => {
+        feedbackElement.style.opacity = '0';
+         // 少し待ってから元のスタイルに戻す
         setTimeout(() => {
-          feedbackElement.style.opacity = '0';
-           // 少し待ってから元のスタイルに戻す
-          setTimeout(() => {
-            feedbackElement.style.color = '#fff';
-            feedbackElement.style.backgroundColor = '#2c3e50';
-          }, 300);
-        }, 2000);
-      });
+          feedbackElement.style.color = '#fff';
+          feedbackElement.style.backgroundColor = '#2c3e50';
+        }, 300);
+      }, 2000);
     });
-  });
-});
\ No newline at end of file
+  }
+});
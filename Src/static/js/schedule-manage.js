@@ -2,11 +2,41 @@ document.addEventListener('DOMContentLoaded', () => {
   const bandSelector = document.getElementById('band-selector');
   const saveStatus = document.getElementById('save-status');
   const commentInput = document.getElementById('comment-input'); // 備考欄の要素を取得
-  let isDirty = false; // スケジュールや備考欄に変更があったかどうかのフラグ
-
-  const dateHeaders = document.querySelectorAll('.date-header');
-  const timeLabels = document.querySelectorAll('.time-label');
-  const allCheckboxes = document.querySelectorAll('.schedule-checkbox');
+  const tableWrapper = document.querySelector('.table-wrapper');
+  const scheduleTable = document.querySelector('.schedule-table');
+  const headerRow = scheduleTable.querySelector('thead tr');
+  const hourRows = new Map(
+    Array.from(scheduleTable.querySelectorAll('tbody tr')).map(row => [
+      parseInt(row.querySelector('.time-label').dataset.hour, 10), row,
+    ])
+  );
+
+  // 編集できる期間のうち、サーバーが最初に描画するのは1週間分だけ。残りはスクロールに合わせて読み込む
+  const windowUrl = scheduleTable.dataset.windowUrl;
+  const rangeStart = scheduleTable.dataset.rangeStart;
+  const rangeEnd = scheduleTable.dataset.rangeEnd;
+  const windowDays = parseInt(scheduleTable.dataset.windowDays, 10);
+  // 端からこの距離(px)までスクロールしたら、次の週を読み込む
+  const LOAD_THRESHOLD_PX = 300;
+
+  // 日付(ISO形式) -> 24時間分の 0/1。読み込み済みの日付だけを持つ
+  const schedule = new Map();
+  // 保存していない変更がある日付
+  const dirtyDates = new Set();
+  // 「デフォルトを適用」したが、まだ読み込んでいない日付に適用する内容
+  let pendingDefault = null;
+
+  const headerDates = () => Array.from(headerRow.querySelectorAll('.date-header'), th => th.dataset.date);
+  let loadedStart = headerDates()[0];
+  let loadedEnd = headerDates().slice(-1)[0];
+  let loading = false;
+
+  // サーバーが描画した分のチェック状態を読み取る
+  scheduleTable.querySelectorAll('.schedule-checkbox').forEach(checkbox => {
+    const date = checkbox.dataset.date;
+    if (!schedule.has(date)) schedule.set(date, Array(24).fill(0));
+    schedule.get(date)[parseInt(checkbox.dataset.hour, 10)] = checkbox.checked ? 1 : 0;
+  });
 
   // バンドセレクターが変更されたらページをリロード
   bandSelector.addEventListener('change', () => {
@@ -14,69 +44,160 @@ document.addEventListener('DOMContentLoaded', () => {
     window.location.href = `/schedule-manage?band_id=${selectedBandId}`;
   });
 
-  // チェックボックスが変更されたら、変更フラグを立てる
-  allCheckboxes.forEach(checkbox => {
-    checkbox.addEventListener('change', () => {
-      isDirty = true;
-      saveStatus.textContent = '変更あり';
+  // 変更が落ち着いたら、サーバーが指定する間隔を守って自動保存する (autosave.js)。
+  // 変更した日付だけを送り、サーバー側で既存のスケジュールに反映する
+  const autosave = createAutosave({
+    url: '/schedule-manage/save',
+    statusElement: saveStatus,
+    buildBody: () => ({
+      band_id: bandSelector.value,
+      partial: true,
+      schedule: Object.fromEntries(Array.from(dirtyDates, date => [date, schedule.get(date).slice()])),
+      // 備考欄が存在する場合のみ、その値を取得
+      comment: commentInput ? commentInput.value : '',
+    }),
+    onSaved: (body) => {
+      // 送った後にさらに変更された日付は、次の保存で送る
+      for (const [date, hours] of Object.entries(body.schedule)) {
+        if (hours.join() === schedule.get(date).join()) dirtyDates.delete(date);
+      }
+    },
+  });
+
+  function setHour(date, hour, checked) {
+    schedule.get(date)[hour] = checked ? 1 : 0;
+    dirtyDates.add(date);
+  }
+
+  // --- 1つのリスナーで表全体のイベントを処理する ---
+
+  scheduleTable.addEventListener('change', (event) => {
+    const checkbox = event.target.closest('.schedule-checkbox');
+    if (!checkbox) return;
+    setHour(checkbox.dataset.date, parseInt(checkbox.dataset.hour, 10), checkbox.checked);
+    autosave.markDirty();
+  });
+
+  // 縦軸・横軸タップでの一括チェック/解除機能
+  scheduleTable.addEventListener('click', (event) => {
+    const header = event.target.closest('.date-header');
+    const label = event.target.closest('.time-label');
+    let checkboxes;
+    if (header) {
+      checkboxes = scheduleTable.querySelectorAll(`.schedule-checkbox[data-date="${header.dataset.date}"]`);
+    } else if (label) {
+      checkboxes = hourRows.get(parseInt(label.dataset.hour, 10)).querySelectorAll('.schedule-checkbox');
+    } else {
+      return;
+    }
+
+    const targetCheckedState = !Array.from(checkboxes).every(cb => cb.checked);
+    let changedCount = 0;
+    checkboxes.forEach(cb => {
+      if (cb.checked !== targetCheckedState) {
+        cb.checked = targetCheckedState;
+        setHour(cb.dataset.date, parseInt(cb.dataset.hour, 10), targetCheckedState);
+        changedCount++;
+      }
+      cb.closest('.schedule-cell').classList.add('cell-highlight');
     });
+    if (changedCount > 0) {
+      autosave.markDirty();
+    }
+    setTimeout(() => {
+      checkboxes.forEach(cb => cb.closest('.schedule-cell').classList.remove('cell-highlight'));
+    }, 300);
   });
 
-  // 備考欄が変更されたら、変更フラグを立てる
+  // 備考欄が変更されたら保存する
   if (commentInput) {
-    commentInput.addEventListener('input', () => {
-      isDirty = true;
-      saveStatus.textContent = '変更あり';
-    });
+    commentInput.addEventListener('input', () => autosave.markDirty());
   }
 
-  // 3秒ごとに変更をチェックして自動保存
-  setInterval(async () => {
-    if (!isDirty) return;
+  // --- 週ごとの読み込み ---
+
+  function addDays(isoDate, days) {
+    const d = new Date(`${isoDate}T00:00:00Z`);
+    d.setUTCDate(d.getUTCDate() + days);
+    return d.toISOString().slice(0, 10);
+  }
+
+  function buildColumn(day) {
+    const hours = day.hours || Array(24).fill(0);
+    if (pendingDefault) {
+      // 「デフォルトを適用」した後に読み込んだ日付にも適用する
+      const defaults = pendingDefault[day.date] || Array(24).fill(0);
+      if (defaults.join() !== hours.join()) dirtyDates.add(day.date);
+      schedule.set(day.date, defaults.slice());
+    } else {
+      schedule.set(day.date, hours.slice());
+    }
+
+    const th = document.createElement('th');
+    th.className = 'date-header';
+    th.dataset.date = day.date;
+    th.append(day.label, document.createElement('br'), day.weekday);
+
+    const cells = new Map();
+    for (const hour of hourRows.keys()) {
+      const td = document.createElement('td');
+      td.className = 'schedule-cell';
+      const checkbox = document.createElement('input');
+      checkbox.type = 'checkbox';
+      checkbox.className = 'schedule-checkbox';
+      checkbox.dataset.date = day.date;
+      checkbox.dataset.hour = hour;
+      checkbox.checked = schedule.get(day.date)[hour] === 1;
+      td.append(checkbox);
+      cells.set(hour, td);
+    }
+    return { th, cells };
+  }
 
-    saveStatus.textContent = '保存中...';
-    const scheduleData = collectScheduleData();
-    const bandId = bandSelector.value;
-    // 備考欄が存在する場合のみ、その値を取得
-    const comment = commentInput ? commentInput.value : '';
+  async function loadWeek(direction) {
+    if (loading) return;
+    const start = direction > 0 ? addDays(loadedEnd, 1) : addDays(loadedStart, -windowDays);
+    if ((direction > 0 && start > rangeEnd) || (direction < 0 && loadedStart <= rangeStart)) return;
 
+    loading = true;
     try {
-      const response = await fetch('/schedule-manage/save', {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-          band_id: bandId,
-          schedule: scheduleData,
-          comment: comment,
-        }),
-      });
-
-      if (response.ok) {
-        isDirty = false;
-        saveStatus.textContent = '保存済み';
+      const params = new URLSearchParams({ band_id: bandSelector.value, start, days: windowDays });
+      const response = await fetch(`${windowUrl}?${params}`);
+      if (!response.ok) throw new Error(`Failed to load week: ${response.status}`);
+      const data = await response.json();
+      const days = data.days.filter(day => !schedule.has(day.date));
+      if (days.length === 0) return;
+
+      const columns = days.map(buildColumn);
+      const widthBefore = scheduleTable.offsetWidth;
+      if (direction > 0) {
+        headerRow.append(...columns.map(c => c.th));
+        for (const [hour, row] of hourRows) row.append(...columns.map(c => c.cells.get(hour)));
+        loadedEnd = days[days.length - 1].date;
       } else {
-        saveStatus.textContent = '保存に失敗しました';
+        // 時間の列 (先頭のセル) の直後に追加し、表示中の位置がずれないようにスクロール位置を戻す
+        headerRow.firstElementChild.after(...columns.map(c => c.th));
+        for (const [hour, row] of hourRows) row.firstElementChild.after(...columns.map(c => c.cells.get(hour)));
+        loadedStart = days[0].date;
+        tableWrapper.scrollLeft += scheduleTable.offsetWidth - widthBefore;
       }
+      if (dirtyDates.size > 0) autosave.markDirty();
     } catch (error) {
-      console.error('Error saving schedule:', error);
-      saveStatus.textContent = 'エラーが発生しました';
+      console.error('Error loading schedule window:', error);
+      return;
+    } finally {
+      loading = false;
+    }
+    // 表が画面の幅より狭い間は続けて読み込む
+    maybeLoad();
+  }
+
+  function maybeLoad() {
+    if (tableWrapper.scrollLeft + tableWrapper.clientWidth > tableWrapper.scrollWidth - LOAD_THRESHOLD_PX) {
+      loadWeek(1);
+    } else if (tableWrapper.scrollLeft < LOAD_THRESHOLD_PX) {
+      loadWeek(-1);
     }
-  }, 3000);
-
-  // 現在のチェックボックスの状態からスケジュールデータを収集する関数
-  function collectScheduleData() {
-    const schedule = {};
-    allCheckboxes.forEach(checkbox => {
-      const date = checkbox.dataset.date;
-      const hour = parseInt(checkbox.dataset.hour, 10);
-
-      if (!schedule[date]) {
-        // 表示されている時間帯に関わらず、常に24時間分の配列を確保
-        schedule[date] = Array(24).fill(0);
-      }
-      schedule[date][hour] = checkbox.checked ? 1 : 0;
-    });
-    return schedule;
   }
 
   // 「デフォルトを適用」ボタンの処理
@@ -90,17 +211,22 @@ document.addEventListener('DOMContentLoaded', () => {
         const response = await fetch('/schedule-manage/default-schedule');
         if (!response.ok) throw new Error('Failed to fetch default schedule');
         const defaultSchedule = await response.json();
-        allCheckboxes.forEach(checkbox => {
+        pendingDefault = defaultSchedule;
+
+        // 読み込み済みの日付はその場で、まだ読み込んでいない日付は読み込んだときに適用する
+        let changed = false;
+        scheduleTable.querySelectorAll('.schedule-checkbox').forEach(checkbox => {
           const date = checkbox.dataset.date;
           const hour = parseInt(checkbox.dataset.hour, 10);
-          const shouldBeChecked = defaultSchedule[date] && defaultSchedule[date][hour] === 1;
+          const shouldBeChecked = Boolean(defaultSchedule[date] && defaultSchedule[date][hour] === 1);
           if (checkbox.checked !== shouldBeChecked) {
             checkbox.checked = shouldBeChecked;
-            isDirty = true; // 変更があったことをマーク
+            setHour(date, hour, shouldBeChecked);
+            changed = true;
           }
         });
-        if (isDirty) {
-          saveStatus.textContent = '変更あり'; // 変更があった場合のみ表示を更新
+        if (changed) {
+          autosave.markDirty(); // 変更があった場合のみ保存する
         }
       } catch (error) {
         console.error('Error applying default schedule:', error);
@@ -109,102 +235,21 @@ document.addEventListener('DOMContentLoaded', () => {
     });
   }
 
-  // 縦軸・横軸タップでの一括チェック/解除機能
-  dateHeaders.forEach(header => {
-    header.addEventListener('click', () => {
-      const targetDate = header.dataset.date;
-      const columnCheckboxes = Array.from(allCheckboxes).filter(cb => cb.dataset.date === targetDate);
-      const targetCheckedState = !columnCheckboxes.every(cb => cb.checked);
-      let changedCount = 0;
-      columnCheckboxes.forEach(cb => {
-        if (cb.checked !== targetCheckedState) {
-          cb.checked = targetCheckedState;
-          changedCount++;
-        }
-        cb.closest('.schedule-cell').classList.add('cell-highlight');
-      });
-      if (changedCount > 0) {
-        isDirty = true;
-        saveStatus.textContent = '変更あり';
-      }
-      setTimeout(() => {
-        columnCheckboxes.forEach(cb => cb.closest('.schedule-cell').classList.remove('cell-highlight'));
-      }, 300);
-    });
-  });
-
-  timeLabels.forEach(label => {
-    label.addEventListener('click', () => {
-      const targetHour = label.dataset.hour;
-      const rowCheckboxes = Array.from(allCheckboxes).filter(cb => cb.dataset.hour === targetHour);
-      const targetCheckedState = !rowCheckboxes.every(cb => cb.checked);
-      let changedCount = 0;
-      rowCheckboxes.forEach(cb => {
-        if (cb.checked !== targetCheckedState) {
-          cb.checked = targetCheckedState;
-          changedCount++;
-        }
-        cb.closest('.schedule-cell').classList.add('cell-highlight');
-      });
-      if (changedCount > 0) {
-        isDirty = true;
-        saveStatus.textContent = '変更あり';
-      }
-      setTimeout(() => {
-        rowCheckboxes.forEach(cb => cb.closest('.schedule-cell').classList.remove('cell-highlight'));
-      }, 300);
-    });
-  });
+  const toggleScrollClass = () => {
+    // scrollLeftが0より大きい（＝少しでも横にスクロールされている）場合
+    if (tableWrapper.scrollLeft > 0) {
+      scheduleTable.classList.add('is-scrolled');
+    } else {
+      scheduleTable.classList.remove('is-scrolled');
+    }
+  };
 
-  const tableWrapper = document.querySelector('.table-wrapper');
-  if (tableWrapper) {
-    const scheduleTable = tableWrapper.querySelector('.schedule-table');
-
-    const toggleScrollClass = () => {
-      // scrollLeftが0より大きい（＝少しでも横にスクロールされている）場合
-      if (tableWrapper.scrollLeft > 0) {
-        scheduleTable.classList.add('is-scrolled');
-      } else {
-        scheduleTable.classList.remove('is-scrolled');
-      }
-    };
+  toggleScrollClass();
 
+  tableWrapper.addEventListener('scroll', () => {
     toggleScrollClass();
+    maybeLoad();
+  }, { passive: true });
 
-    tableWrapper.addEventListener('scroll', toggleScrollClass, { passive: true });
-  }
-
-  /**
-   * ページ読み込み時に、今日の日付が画面の左端付近に表示されるよう
-   * 自動でスクロールする機能（レスポンシブ・固定列対応版）
-   */
-  const scrollToToday = () => {
-    const tableWrapper = document.querySelector('.table-wrapper');
-    if (!tableWrapper) return;
-
-    const today = new Date();
-    const year = today.getFullYear();
-    const month = String(today.getMonth() + 1).padStart(2, '0');
-    const day = String(today.getDate()).padStart(2, '0');
-    const todayDateString = `${year}-${month}-${day}`;
-
-    const todayHeader = document.querySelector(`.date-header[data-date="${todayDateString}"]`);
-    const cornerCell = document.querySelector('.corner-cell');
-
-    if (todayHeader && cornerCell) {
-      const columnWidth = todayHeader.offsetWidth;
-
-      const offsetFactor = 0.8;
-      const offset = columnWidth * offsetFactor;
-
-      const scrollPosition = todayHeader.offsetLeft;
-      const fixedColumnWidth = cornerCell.offsetWidth;
-
-      const correctScrollLeft = scrollPosition - fixedColumnWidth - offset;
-
-      tableWrapper.scrollLeft = Math.max(0, correctScrollLeft);
-    }
-  };
-
-  scrollToToday();
-});
\ No newline at end of file
+  maybeLoad();
+});
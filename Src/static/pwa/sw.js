@@ -0,0 +1,259 @@
+/*
+ * Jappy Service Worker
+ * - 静的ファイル(CSS/JS/アイコン)をインストール時にキャッシュし、以降はキャッシュから返す
+ * - /bands, /band のページは stale-while-revalidate (キャッシュを即表示し、裏で更新)
+ * - スケジュール/バンド練の自動保存が通信エラーで失敗した場合は IndexedDB に積み、
+ *   オンラインに戻ったときに順番どおり再送する
+ * - ログアウトなどでユーザーが変わるときは、ページのキャッシュと未送信の保存を破棄する
+ */
+
+// 静的ファイルを更新したらバージョンを上げる (古いキャッシュは activate 時に削除される)
+const CACHE_VERSION = 'v8';
+const STATIC_CACHE = `jappy-static-${CACHE_VERSION}`;
+const PAGE_CACHE = `jappy-pages-${CACHE_VERSION}`;
+
+const PRECACHE_URLS = [
+  '/static/css/base.css',
+  '/static/css/top.css',
+  '/static/css/account.css',
+  '/static/css/usage.css',
+  '/static/css/band/band.css',
+  '/static/css/band/bands.css',
+  '/static/css/band/band-edit.css',
+  '/static/css/band/band-gen.css',
+  '/static/css/band-practice/band-practice.css',
+  '/static/css/schedule/manage.css',
+  '/static/js/theme-color.js',
+  '/static/js/autosave.js',
+  '/static/js/band.js',
+  '/static/js/bands.js',
+  '/static/js/band-practice.js',
+  '/static/js/schedule-manage.js',
+  '/static/icons/favicon.ico',
+  '/static/icons/jappy.png',
+  '/static/icons/icon-128.png',
+  '/static/icons/icon-256.png',
+  '/static/icons/icon-512.png',
+];
+
+// stale-while-revalidate で返すページ
+const SWR_PATHS = ['/bands', '/band'];
+
+// 通信エラー時にキューへ積む保存API
+const QUEUED_SAVE_PATHS = ['/schedule-manage/save', '/band-practice/save'];
+
+// ログイン中のユーザーが変わる (ログアウト・アカウント削除・ログインし直し) リクエスト
+const SESSION_PATHS = ['/logout', '/delete-account', '/login'];
+
+const DB_NAME = 'jappy-sw';
+const DB_STORE = 'pending-saves';
+const SYNC_TAG = 'replay-saves';
+
+
+// --- ライフサイクル ---
+
+self.addEventListener('install', (event) => {
+  event.waitUntil(
+    caches.open(STATIC_CACHE)
+      .then(cache => cache.addAll(PRECACHE_URLS))
+      .then(() => self.skipWaiting())
+  );
+});
+
+self.addEventListener('activate', (event) => {
+  event.waitUntil((async () => {
+    const keys = await caches.keys();
+    await Promise.all(
+      keys
+        .filter(key => key.startsWith('jappy-') && key !== STATIC_CACHE && key !== PAGE_CACHE)
+        .map(key => caches.delete(key))
+    );
+    await self.clients.claim();
+    await replayPendingSaves();
+  })());
+});
+
+
+// --- fetch ---
+
+self.addEventListener('fetch', (event) => {
+  const request = event.request;
+  const url = new URL(request.url);
+  if (url.origin !== self.location.origin) return;
+
+  if (request.method === 'POST' && QUEUED_SAVE_PATHS.includes(url.pathname)) {
+    event.respondWith(saveWithQueue(request));
+    return;
+  }
+
+  // ログイン中のユーザーが変わる操作では、ユーザーごとのページキャッシュと未送信の保存を破棄する。
+  // 積まれた保存は送るときのCookieで認証されるため、残しておくと次にログインした人の保存として送られてしまう
+  if (SESSION_PATHS.includes(url.pathname)) {
+    event.waitUntil(clearUserData());
+    return;
+  }
+
+  if (request.method !== 'GET') return;
+
+  // /assets/ はファイル名にハッシュが入っているので、キャッシュがあれば常にそれを使ってよい
+  if (url.pathname.startsWith('/static/') || url.pathname.startsWith('/assets/')) {
+    event.respondWith(cacheFirst(request));
+    return;
+  }
+
+  if (request.mode === 'navigate' && SWR_PATHS.includes(url.pathname)) {
+    event.respondWith(staleWhileRevalidate(request, event));
+  }
+});
+
+async function clearUserData() {
+  await Promise.all([
+    caches.delete(PAGE_CACHE),
+    withStore('readwrite', store => store.clear()),
+  ]);
+}
+
+async function cacheFirst(request) {
+  const cache = await caches.open(STATIC_CACHE);
+  const cached = await cache.match(request);
+  if (cached) return cached;
+
+  const response = await fetch(request);
+  if (response.ok) {
+    cache.put(request, response.clone());
+  }
+  return response;
+}
+
+async function staleWhileRevalidate(request, event) {
+  const cache = await caches.open(PAGE_CACHE);
+  const cached = await cache.match(request);
+
+  const network = fetch(request).then(response => {
+    // ログイン画面などへのリダイレクトはキャッシュしない
+    if (response.ok && !response.redirected) {
+      cache.put(request, response.clone());
+    }
+    return response;
+  });
+
+  if (cached) {
+    event.waitUntil(network.catch(() => {}));
+    return cached;
+  }
+  return network;
+}
+
+
+// --- 保存APIのキュー ---
+
+async function saveWithQueue(request) {
+  const body = await request.clone().text();
+  try {
+    // 先に積まれている保存がある場合は、順番を守るためそちらを先に送る
+    await replayPendingSaves();
+    if (await countPendingSaves() > 0) {
+      throw new TypeError('pending saves remain');
+    }
+    return await fetch(request);
+  } catch (error) {
+    await enqueueSave(request.url, body);
+    if (self.registration.sync) {
+      try {
+        await self.registration.sync.register(SYNC_TAG);
+      } catch (e) {
+        // Background Sync 非対応の場合は online 時のメッセージで再送する
+      }
+    }
+    return new Response(
+      JSON.stringify({ status: 'queued', message: 'Saved offline. Will retry when online.' }),
+      { status: 202, headers: { 'Content-Type': 'application/json' } }
+    );
+  }
+}
+
+self.addEventListener('sync', (event) => {
+  if (event.tag === SYNC_TAG) {
+    event.waitUntil(replayPendingSaves());
+  }
+});
+
+self.addEventListener('message', (event) => {
+  if (event.data && event.data.type === SYNC_TAG) {
+    event.waitUntil(replayPendingSaves());
+  }
+});
+
+let replaying = null;
+
+// 積まれた保存を古い順に再送する。通信エラーになった時点で中断し、残りは次回に回す
+function replayPendingSaves() {
+  if (!replaying) {
+    replaying = (async () => {
+      const entries = await readPendingSaves();
+      for (const entry of entries) {
+        let response;
+        try {
+          response = await fetch(entry.url, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: entry.body,
+            credentials: 'same-origin',
+          });
+        } catch (error) {
+          return;
+        }
+        // 混雑による拒否(429)や一時的なサーバーエラーは、後で再送する
+        if (response.status === 429 || response.status >= 500) {
+          return;
+        }
+        // 成功、または再送しても成功しないエラー(4xx)はキューから外す
+        await deletePendingSave(entry.id);
+      }
+    })().finally(() => {
+      replaying = null;
+    });
+  }
+  return replaying;
+}
+
+
+// --- IndexedDB ---
+
+function openDb() {
+  return new Promise((resolve, reject) => {
+    const request = indexedDB.open(DB_NAME, 1);
+    request.onupgradeneeded = () => {
+      request.result.createObjectStore(DB_STORE, { keyPath: 'id', autoIncrement: true });
+    };
+    request.onsuccess = () => resolve(request.result);
+    request.onerror = () => reject(request.error);
+  });
+}
+
+async function withStore(mode, callback) {
+  const db = await openDb();
+  return new Promise((resolve, reject) => {
+    const tx = db.transaction(DB_STORE, mode);
+    const result = callback(tx.objectStore(DB_STORE));
+    tx.oncomplete = () => resolve(result && 'result' in result ? result.result : undefined);
+    tx.onerror = () => reject(tx.error);
+  });
+}
+
+function enqueueSave(url, body) {
+  return withStore('readwrite', store => store.add({ url, body, queuedAt: Date.now() }));
+}
+
+function readPendingSaves() {
+  // autoIncrement のキー順 = 積まれた順
+  return withStore('readonly', store => store.getAll());
+}
+
+function countPendingSaves() {
+  return withStore('readonly', store => store.count());
+}
+
+function deletePendingSave(id) {
+  return withStore('readwrite', store => store.delete(id));
+}
@@ -1,5 +1,7 @@
 import os
-from App.app_init_ import app
+from App.app_init_ import create_app
+
+app = create_app()
 
 if __name__ == "__main__":
   os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
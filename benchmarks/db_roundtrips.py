@@ -0,0 +1,136 @@
+"""
+DatabaseManager の1操作あたりの時間を、変更前の方式と比較するベンチマーク
+
+  DATABASE_URL=postgresql://... python -m benchmarks.db_roundtrips [--repeat 200]
+
+変更前: 操作ごとに新しく接続し、文を1つずつ実行して結果を待つ (BEGIN/各文/COMMITで往復が増える)
+変更後: プールの接続を使い、パイプラインモードで文・通知・COMMITをまとめて送る。読み取りはプリペアドステートメント
+
+実際の効果はDBとの往復時間(RTT)に比例するため、本番と同じネットワーク越しのDBで実行すること。
+検証用のユーザーとバンドを作成し、終了時に削除する。
+"""
+import argparse
+import json
+import statistics
+import time
+import uuid
+from datetime import date, time as dtime, timedelta
+
+import psycopg
+from psycopg.rows import dict_row
+
+from App.db.band import BandDatabaseManager
+from App.db.base import PREPARE, USE_POOL, close_pools
+from App.db.schedule import ScheduleDatabaseManager
+from App.db.user import UserDatabaseManager
+from const import DATABASE_URL
+
+
+def measure(func, repeat: int) -> list[float]:
+  func()  # 接続やプリペアドステートメントの準備を除くため、1回目は計測しない
+  timings = []
+  for _ in range(repeat):
+    started = time.perf_counter()
+    func()
+    timings.append((time.perf_counter() - started) * 1000)
+  return timings
+
+
+def summary(timings: list[float]) -> str:
+  timings = sorted(timings)
+  p95 = timings[int(len(timings) * 0.95) - 1]
+  return f"mean {statistics.mean(timings):7.2f} ms  p50 {statistics.median(timings):7.2f} ms  p95 {p95:7.2f} ms"
+
+
+# --- 変更前の方式 (比較用) ---
+
+def legacy_connection() -> psycopg.Connection:
+  conn = psycopg.connect(DATABASE_URL)
+  conn.row_factory = dict_row # type: ignore
+  return conn
+
+
+def legacy_get_user(email: str) -> None:
+  with legacy_connection() as conn:
+    with conn.cursor() as cur:
+      cur.execute("SELECT id, email, name FROM users WHERE email = %s;", (email,))
+      cur.fetchone()
+
+
+def legacy_update_schedule(user_id: int, band_id: int, schedule: str) -> None:
+  with legacy_connection() as conn:
+    with conn.cursor() as cur:
+      cur.execute("""
+        INSERT INTO schedules (user_id, band_id, schedule, comment)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (user_id, band_id) DO UPDATE
+        SET schedule = EXCLUDED.schedule, comment = EXCLUDED.comment;
+      """, (user_id, band_id, schedule, ""))
+      conn.commit()
+      cur.execute("SELECT * FROM schedules WHERE user_id = %s AND band_id = %s;", (user_id, band_id))
+      cur.fetchone()
+
+
+def legacy_remove_and_add_member(user_id: int, band_id: int) -> None:
+  with legacy_connection() as conn:
+    with conn.cursor() as cur:
+      cur.execute("DELETE FROM band_user WHERE user_id = %s AND band_id = %s;", (user_id, band_id))
+      cur.execute("DELETE FROM schedules WHERE user_id = %s AND band_id = %s;", (user_id, band_id))
+      conn.commit()
+  with legacy_connection() as conn:
+    with conn.cursor() as cur:
+      cur.execute("INSERT INTO band_user (user_id, band_id) VALUES (%s, %s);", (user_id, band_id))
+      conn.commit()
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(prog="python -m benchmarks.db_roundtrips")
+  parser.add_argument("--repeat", type=int, default=200)
+  args = parser.parse_args()
+
+  user_db = UserDatabaseManager()
+  band_db = BandDatabaseManager()
+  schedule_db = ScheduleDatabaseManager()
+
+  email = f"bench-{uuid.uuid4().hex}@example.invalid"
+  user_id = user_db.add(email, "benchmark")
+  if user_id is None:
+    raise SystemExit("DATABASE_URL のDBに接続できませんでした")
+  today = date.today()
+  band_id, token = band_db.create("benchmark", today, today + timedelta(days=29), dtime(9), dtime(22), user_id)
+
+  schedule = {today + timedelta(days=n): [n % 2] * 24 for n in range(30)}
+  schedule_json = json.dumps({d.isoformat(): v for d, v in schedule.items()})
+
+  cases = [
+    ("get_user", lambda: legacy_get_user(email), lambda: user_db.get_user(email=email)),
+    ("get_band", None, lambda: band_db.get_band(token=token)),
+    ("get_schedules(band)", None, lambda: schedule_db.get_schedules(band_id=band_id)),
+    (
+      "update_schedule",
+      lambda: legacy_update_schedule(user_id, band_id, schedule_json),
+      lambda: schedule_db.update_schedule(user_id, schedule, band_id, ""),
+    ),
+    (
+      "remove_member + add_member",
+      lambda: legacy_remove_and_add_member(user_id, band_id),
+      lambda: (band_db.remove_member(user_id, band_id), band_db.add_member(user_id, band_id)),
+    ),
+  ]
+
+  print(f"pool={'on' if USE_POOL else 'off'} prepare={'on' if PREPARE else 'off'} repeat={args.repeat}")
+  try:
+    for name, legacy, current in cases:
+      print(f"\n{name}")
+      if legacy:
+        print(f"  before  {summary(measure(legacy, args.repeat))}")
+      print(f"  after   {summary(measure(current, args.repeat))}")
+  finally:
+    band_db.delete_band(band_id)
+    schedule_db.delete_schedules(user_id)
+    user_db.delete(user_id)
+    close_pools()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,149 @@
+"""
+招待リンクへの参加が集中したときの /join の応答時間を、同時に参加する人数ごとに測る負荷試験
+
+  DATABASE_URL=postgresql://... python -m benchmarks.join_storm [--levels 1,50,100,500] [--batch]
+
+検証用のバンドと、最も多い同時参加数の分のユーザーを作成し (終了時に削除する)、
+各段階で指定した人数のスレッドが同時に /join?token=... を送る。段階ごとにメンバーを作成者だけに戻してから測る。
+応答時間の分布 (p50/p95/p99/最大) と、1人のときの p50 に対する比を表示する。人数を増やしても比が大きく伸びなければよい。
+--batch を付けると、同じバンドへの同時の参加を1つのINSERTにまとめる (JOIN_BATCHING=1 と同じ)。
+
+本番と同じく無効化イベントの受信を始めてから測るので、トークンとユーザーはキャッシュから引かれる。
+アプリを同じプロセスで動かすため、応答時間にはGILの待ちも含まれる。接続の数は DATABASE_POOL_MAX_SIZE で変えられる。
+"""
+import argparse
+import statistics
+import threading
+import time
+import uuid
+from datetime import date, time as dtime, timedelta
+from unittest import mock
+
+from App.app_init_ import create_app
+from App.db.base import _get_connection, close_pools, open_pools
+from App.db.events import bus
+
+
+def seed(users: int) -> tuple[str, int, list[str], list[int]]:
+  """バンドを1つと、参加するユーザーを作成する。(トークン, バンドID, メールアドレス, ユーザーID) を返す"""
+  prefix = f"join-{uuid.uuid4().hex}"
+  today = date.today()
+  with _get_connection() as conn:
+    with conn.cursor() as cur:
+      with cur.copy("COPY users (email, name) FROM STDIN") as copy:
+        for n in range(users + 1):
+          copy.write_row((f"{prefix}-{n}@example.invalid", f"member{n}"))
+      cur.execute("SELECT id, email FROM users WHERE email LIKE %s ORDER BY id;", (f"{prefix}-%",))
+      rows = cur.fetchall()
+      creator_id = rows[0]["id"]
+      cur.execute("""
+        INSERT INTO bands (name, creator_user_id, token, start_date, end_date, start_time, end_time)
+        VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id;
+      """, ("join-storm", creator_id, prefix, today, today + timedelta(days=30), dtime(9), dtime(22)))
+      band_id = cur.fetchone()["id"]
+      cur.execute("INSERT INTO band_user (user_id, band_id) VALUES (%s, %s);", (creator_id, band_id))
+    conn.commit()
+  return prefix, band_id, [row["email"] for row in rows[1:]], [row["id"] for row in rows]
+
+
+def reset_members(band_id: int, creator_id: int) -> None:
+  with _get_connection() as conn:
+    conn.execute("DELETE FROM band_user WHERE band_id = %s AND user_id <> %s;", (band_id, creator_id))
+    conn.commit()
+
+
+def member_count(band_id: int) -> int:
+  with _get_connection() as conn:
+    return conn.execute("SELECT count(*) AS n FROM band_user WHERE band_id = %s;", (band_id,)).fetchone()["n"]
+
+
+def cleanup(band_id: int, user_ids: list[int]) -> None:
+  with _get_connection() as conn:
+    conn.execute("DELETE FROM band_user WHERE band_id = %s;", (band_id,))
+    conn.execute("DELETE FROM bands WHERE id = %s;", (band_id,))
+    conn.execute("DELETE FROM users WHERE id = ANY(%s);", (user_ids,))
+    conn.commit()
+
+
+def storm(app, token: str, emails: list[str]) -> tuple[list[float], list[int]]:
+  """len(emails) 人が同時に参加する。応答時間(ms)とステータスコードのリストを返す"""
+  clients = []
+  for email in emails:
+    client = app.test_client()
+    with client.session_transaction() as session:
+      session["_user_id"] = email
+      session["_fresh"] = True
+    clients.append(client)
+
+  timings: list[float] = []
+  statuses: list[int] = []
+  lock = threading.Lock()
+  barrier = threading.Barrier(len(clients))
+
+  def join(client) -> None:
+    barrier.wait()
+    started = time.perf_counter()
+    response = client.get(f"/join?token={token}")
+    elapsed = (time.perf_counter() - started) * 1000
+    with lock:
+      timings.append(elapsed)
+      statuses.append(response.status_code)
+
+  threads = [threading.Thread(target=join, args=(client,)) for client in clients]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  return timings, statuses
+
+
+def percentile(values: list[float], q: float) -> float:
+  ordered = sorted(values)
+  return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(prog="python -m benchmarks.join_storm")
+  parser.add_argument("--levels", default="1,50,100,500", help="同時に参加する人数 (カンマ区切り)")
+  parser.add_argument("--batch", action="store_true", help="同じバンドへの同時の参加を1つのINSERTにまとめる")
+  args = parser.parse_args()
+  levels = [int(level) for level in args.levels.split(",")]
+
+  app = create_app()
+  app.secret_key = app.secret_key or "join-storm"
+  open_pools()
+  bus.start()
+  # キャッシュは受信を始めるまで使われないので、接続を待つ
+  deadline = time.monotonic() + 10
+  while not bus.active and time.monotonic() < deadline:
+    time.sleep(0.1)
+  if not bus.active:
+    print("無効化イベントの受信を開始できませんでした。キャッシュなしで測ります")
+
+  token, band_id, emails, user_ids = seed(max(levels))
+  print(f"JOIN_BATCHING={'1' if args.batch else '0'}")
+  print(f"{'concurrency':>11} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'p50 ratio':>9}")
+  baseline = None
+  try:
+    with mock.patch("App.joins.JOIN_BATCHING", args.batch):
+      for level in levels:
+        reset_members(band_id, user_ids[0])
+        timings, statuses = storm(app, token, emails[:level])
+        errors = sum(1 for status in statuses if status != 302)
+        members = member_count(band_id) - 1
+        p50 = statistics.median(timings)
+        baseline = baseline or p50
+        print(
+          f"{level:>11} {p50:>8.1f} {percentile(timings, 0.95):>8.1f} {percentile(timings, 0.99):>8.1f}"
+          f" {max(timings):>8.1f} {p50 / baseline:>8.1f}x"
+          + (f"  エラー {errors} 件" if errors else "")
+          + (f"  参加できたのは {members} 人" if members != level else "")
+        )
+  finally:
+    cleanup(band_id, user_ids)
+    bus.stop()
+    close_pools()
+
+
+if __name__ == "__main__":
+  main()
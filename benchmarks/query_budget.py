@@ -0,0 +1,303 @@
+"""
+エンドポイントごとに発行するSQLの数・接続の数・応答時間を測り、予算 (query_budgets.json) と比べる
+
+  DATABASE_URL=postgresql://... python -m benchmarks.query_budget [--repeat 5]
+  DATABASE_URL=postgresql://... python -m benchmarks.query_budget --update   予算を今回の計測値で書き換える
+
+検証用のユーザー・バンド・スケジュールを作成し、ログインした状態で各ルートにリクエストを送る (終了時に削除する)。
+キャッシュの有無で回数が変わらないよう、リクエストごとにプロセス内のキャッシュを空にしてから測る。
+SQLの数・接続の数を1つでも予算より多く使ったら失敗として、
+予算との差と、そのリクエストで2回以上発行した文 (ループの中のクエリ) を表示して終了コード 1 で終わる。
+予算がないルートを追加した場合や query_budgets.json がない場合も失敗するので、
+ENDPOINTS に追加するか SKIPPED に理由を書いて --update し、query_budgets.json をコミットする。
+SQLの数・接続の数はデータとコードだけで決まるので、CIのPostgreSQLで測っても本番と同じになる。
+
+応答時間 (中央値) は表示するだけで、DBやマシンによってぶれるので既定では予算と比べない。
+本番に近いPostgreSQLで --latency-tolerance を付けて --update すると p50_ms も記録し、
+以降 --latency-tolerance を付けて実行したときだけ、記録した値の --latency-tolerance 倍を超えたら失敗にする。
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+from collections import Counter
+from datetime import date, time as dtime, timedelta
+from unittest import mock
+
+from App.app_init_ import create_app
+from App.db.base import _get_connection, close_pools, count_queries
+from App.db.cache import feed_cache, record_cache
+from App.db.conflict import conflict_index
+from App.export import make_feed_token
+from App.ratelimit import Admission, save_limiter
+
+
+BUDGETS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "query_budgets.json")
+
+# (メソッド, URL, JSONの本文)。URLと本文の {} は Fixture の属性で置き換える
+ENDPOINTS = [
+  ("GET", "/", None),
+  ("GET", "/top", None),
+  ("GET", "/usage", None),
+  ("GET", "/account", None),
+  ("GET", "/bands", None),
+  ("GET", "/bands/page?archived=1", None),
+  ("GET", "/band?token={token}", None),
+  ("GET", "/band?token={archived_token}", None),
+  ("GET", "/band/cells?token={token}", None),
+  ("GET", "/band/recommend?token={token}", None),
+  ("GET", "/band/edit?token={token}", None),
+  ("GET", "/band-gen", None),
+  ("GET", "/join?token={token}", None),
+  ("GET", "/schedule-manage", None),
+  ("GET", "/schedule-manage?band_id={band_id}", None),
+  ("GET", "/schedule-manage/window?band_id={band_id}&start={start}&days=7", None),
+  ("GET", "/schedule-manage/default-schedule", None),
+  ("POST", "/schedule-manage/save", {"band_id": "{band_id}", "partial": True, "schedule": {"{start}": [1] * 24}}),
+  ("GET", "/band-practice", None),
+  ("GET", "/band-practice?band_id={band_id}", None),
+  ("POST", "/band-practice/save", {"band_id": "{band_id}", "schedule": {"{start}": [0] * 18 + [1] * 6}}),
+  ("GET", "/band/export/availability.csv?token={token}", None),
+  ("GET", "/band/export/practice.csv?token={token}", None),
+  ("GET", "/band/export/practice.ics?token={token}", None),
+  ("GET", "/feed/{feed_token}.ics", None),
+]
+
+# 計測しないルートと理由
+SKIPPED = {
+  "/static/<path:filename>": "静的ファイル",
+  "/assets/<path:filename>": "静的ファイル",
+  "/sw.js": "静的ファイル",
+  "/login": "Googleのログイン画面への転送",
+  "/callback": "Googleのログインからの戻り先",
+  "/logout": "セッションを消すだけ",
+  "/resist": "登録済みのユーザーは転送されるだけ",
+  "/band/stream": "終わらないレスポンス (SSE)",
+  "/band/archive": "検証用のデータを変えてしまう",
+  "/band/unarchive": "検証用のデータを変えてしまう",
+  "/band/delete": "検証用のデータを変えてしまう",
+  "/band/leave": "検証用のデータを変えてしまう",
+  "/delete-account": "検証用のデータを変えてしまう",
+  "/jobs/<int:job_id>": "ジョブがあるときだけ意味がある",
+  "/profiles": "トークンが必要な運用向けのページ",
+  "/profiles/<profile_id>.collapsed": "トークンが必要な運用向けのページ",
+}
+
+
+class Fixture:
+  """検証用に作成したデータを格納するためのデータクラス"""
+
+  def __init__(self, prefix: str, email: str, user_ids: list[int], band_ids: list[int], tokens: list[str]):
+    self.prefix = prefix
+    self.email = email
+    self.user_ids = user_ids
+    self.band_ids = band_ids
+    self.band_id = band_ids[0]
+    self.token = tokens[0]
+    self.archived_token = tokens[-1]
+    self.start = date.today().isoformat()
+    self.feed_token = make_feed_token(user_ids[0])
+
+
+def seed(members: int, bands: int, days: int) -> Fixture:
+  """ログインするユーザーが bands 個のバンド (最後の1つはアーカイブ済み) に所属するデータを COPY で作成する"""
+  today = date.today()
+  prefix = f"budget-{uuid.uuid4().hex}"
+
+  with _get_connection() as conn:
+    with conn.cursor() as cur:
+      with cur.copy("COPY users (email, name) FROM STDIN") as copy:
+        for n in range(members):
+          copy.write_row((f"{prefix}-{n}@example.invalid", f"member{n}"))
+      cur.execute("SELECT id FROM users WHERE email LIKE %s ORDER BY id;", (f"{prefix}-%",))
+      user_ids = [row["id"] for row in cur.fetchall()]
+
+      band_ids, tokens = [], []
+      for n in range(bands):
+        token = f"{prefix}-{n}"
+        cur.execute("""
+          INSERT INTO bands (name, creator_user_id, token, start_date, end_date, start_time, end_time, archived)
+          VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING id;
+        """, (
+          f"band{n}", user_ids[0], token, today, today + timedelta(days=days - 1),
+          dtime(9), dtime(22), n == bands - 1,
+        ))
+        band_ids.append(cur.fetchone()["id"])
+        tokens.append(token)
+
+      hours = lambda n: [int((hour + n) % 3 == 0) for hour in range(24)]
+      schedule = lambda n: json.dumps({(today + timedelta(days=d)).isoformat(): hours(n + d) for d in range(days)})
+      with cur.copy("COPY band_user (user_id, band_id) FROM STDIN") as copy:
+        for band_id in band_ids:
+          for user_id in user_ids:
+            copy.write_row((user_id, band_id))
+      with cur.copy("COPY schedules (user_id, band_id, schedule, comment) FROM STDIN") as copy:
+        for n, user_id in enumerate(user_ids):
+          # band_id = 0 はデフォルトのスケジュール
+          for band_id in [0, *band_ids]:
+            copy.write_row((user_id, band_id, schedule(n), f"comment{n}"))
+        for band_id in band_ids:
+          copy.write_row((0, band_id, schedule(1), ""))
+    conn.commit()
+  return Fixture(prefix, f"{prefix}-0@example.invalid", user_ids, band_ids, tokens)
+
+
+def cleanup(fixture: Fixture) -> None:
+  with _get_connection() as conn:
+    conn.execute("DELETE FROM schedules WHERE band_id = ANY(%s) OR user_id = ANY(%s);", (fixture.band_ids, fixture.user_ids))
+    conn.execute("DELETE FROM band_user WHERE band_id = ANY(%s);", (fixture.band_ids,))
+    conn.execute("DELETE FROM band_snapshots WHERE band_id = ANY(%s);", (fixture.band_ids,))
+    conn.execute("DELETE FROM bands WHERE id = ANY(%s);", (fixture.band_ids,))
+    conn.execute("DELETE FROM users WHERE id = ANY(%s);", (fixture.user_ids,))
+    conn.commit()
+
+
+def fill(value, fixture: Fixture):
+  """URL・本文の {} を Fixture の値で置き換える (band_id は数値にする)"""
+  if isinstance(value, str):
+    filled = value.format(**vars(fixture))
+    return int(filled) if value == "{band_id}" else filled
+  if isinstance(value, dict):
+    return {fill(k, fixture): fill(v, fixture) for k, v in value.items()}
+  if isinstance(value, list):
+    return [fill(v, fixture) for v in value]
+  return value
+
+
+def measure(client, method: str, url: str, body, repeat: int) -> dict:
+  """キャッシュを空にしてリクエストを repeat 回送り、1回目の回数と応答時間の中央値を返す"""
+  runs = []
+  for _ in range(repeat):
+    record_cache.clear()
+    feed_cache.clear()
+    conflict_index.clear()
+    with count_queries() as stats:
+      started = time.perf_counter()
+      response = client.open(url, method=method, json=body)
+      response.get_data()  # ストリーミングのレスポンスも最後まで読む
+      elapsed = (time.perf_counter() - started) * 1000
+    if response.status_code >= 400:
+      raise RuntimeError(f"{method} {url} が {response.status_code} を返しました")
+    runs.append((stats, elapsed))
+
+  stats = runs[0][0]
+  return {
+    "statements": stats.statements,
+    "connections": stats.connections,
+    "p50_ms": round(statistics.median(elapsed for _, elapsed in runs), 1),
+    "repeated": [(query, count) for query, count in Counter(stats.queries).most_common() if count > 1],
+  }
+
+
+def compare(name: str, result: dict, budget: dict | None, tolerance: float | None) -> list[str]:
+  """予算を超えた項目の説明を返す (超えていなければ空)。tolerance が None なら応答時間は比べない"""
+  if not budget or budget.get("statements") is None:
+    return ["予算が記録されていません (--update で記録してください)"]
+  problems = []
+  for key in ("statements", "connections"):
+    if result[key] > budget[key]:
+      problems.append(f"{key}: {budget[key]} -> {result[key]} (+{result[key] - budget[key]})")
+  if tolerance is not None and budget.get("p50_ms") is not None:
+    # 数ミリ秒のぶれで失敗しないよう、5ms の余裕を持たせる
+    limit = budget["p50_ms"] * tolerance + 5
+    if result["p50_ms"] > limit:
+      problems.append(f"p50_ms: {budget['p50_ms']} -> {result['p50_ms']} (上限 {limit:.1f})")
+  return problems
+
+
+def uncovered_routes(app, fixture: Fixture) -> list[str]:
+  """ENDPOINTS でも SKIPPED でもないルート (新しく追加されたルート) を返す"""
+  adapter = app.url_map.bind("localhost")
+  covered = set()
+  for method, url, _ in ENDPOINTS:
+    rule, _ = adapter.match(fill(url, fixture).split("?")[0], method=method, return_rule=True)
+    covered.add(rule.rule)
+  return sorted({rule.rule for rule in app.url_map.iter_rules()} - covered - set(SKIPPED))
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(prog="python -m benchmarks.query_budget")
+  parser.add_argument("--members", type=int, default=8)
+  parser.add_argument("--bands", type=int, default=6)
+  parser.add_argument("--days", type=int, default=60)
+  parser.add_argument("--repeat", type=int, default=5)
+  parser.add_argument(
+    "--latency-tolerance", type=float, default=None,
+    help="応答時間も予算と比べる (記録した p50_ms の何倍まで許すか)。--update と一緒に付けると p50_ms を記録する",
+  )
+  parser.add_argument("--update", action="store_true", help="予算を今回の計測値で書き換える")
+  args = parser.parse_args()
+
+  app = create_app()
+  app.secret_key = app.secret_key or "query-budget"
+  # SECRET_KEY がないとフィードのトークンを発行できないので、計測の間だけ仮の鍵を使う
+  mock.patch("App.export.SECRET_KEY", app.secret_key).start()
+  try:
+    with open(BUDGETS_PATH, encoding="utf-8") as f:
+      budgets = json.load(f)
+  except FileNotFoundError:
+    budgets = None
+
+  fixture = seed(args.members, args.bands, args.days)
+  failures = {
+    rule: ["計測するエンドポイントがありません (ENDPOINTS に追加するか SKIPPED に理由を書いてください)"]
+    for rule in uncovered_routes(app, fixture)
+  }
+  results = {}
+  try:
+    client = app.test_client()
+    with client.session_transaction() as session:
+      session["_user_id"] = fixture.email
+      session["_fresh"] = True
+
+    # 保存の回数制限で 429 にならないよう、常に受け付ける
+    with mock.patch.object(save_limiter, "admit", return_value=Admission(True, 0.0, 3000)):
+      for method, url, body in ENDPOINTS:
+        name = f"{method} {url}"
+        result = measure(client, method, fill(url, fixture), fill(body, fixture), args.repeat)
+        results[name] = result
+        problems = compare(name, result, (budgets or {}).get(name), args.latency_tolerance)
+        if problems and not args.update:
+          failures[name] = problems
+  finally:
+    cleanup(fixture)
+    close_pools()
+
+  print(f"{'endpoint':<64} {'statements':>10} {'connections':>11} {'p50 ms':>8}")
+  for name, result in results.items():
+    budget = (budgets or {}).get(name) or {}
+    mark = "  NG" if name in failures else ""
+    print(
+      f"{name:<64} {result['statements']:>4} / {budget.get('statements', '-')!s:<4}"
+      f" {result['connections']:>4} / {budget.get('connections', '-')!s:<4}"
+      f" {result['p50_ms']:>8}{mark}"
+    )
+
+  if args.update:
+    keys = ("statements", "connections", "p50_ms") if args.latency_tolerance is not None else ("statements", "connections")
+    updated = {name: {key: result[key] for key in keys} for name, result in results.items()}
+    with open(BUDGETS_PATH, "w", encoding="utf-8") as f:
+      json.dump(updated, f, ensure_ascii=False, indent=2)
+      f.write("\n")
+    print(f"\n{BUDGETS_PATH} を更新しました")
+    return
+
+  if budgets is None:
+    print(f"\n{BUDGETS_PATH} がありません (--update で記録してコミットしてください)")
+  if failures:
+    print("\n予算を超えたエンドポイント:")
+    for name, problems in failures.items():
+      print(f"\n  {name}")
+      for problem in problems:
+        print(f"    {problem}")
+      for query, count in results.get(name, {}).get("repeated", []):
+        print(f"    {count:>4} 回  {query}")
+    sys.exit(1)
+  print("\nすべてのエンドポイントが予算内です")
+
+
+if __name__ == "__main__":
+  main()
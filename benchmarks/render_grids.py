@@ -0,0 +1,166 @@
+"""
+日付 × 時間の表の描画時間を、変更前のテンプレートと比較するベンチマーク
+
+  python -m benchmarks.render_grids [--members 20] [--repeat 20]
+
+変更前: テンプレートの内側のループで日付ごとに isoformat() し、入れ子の辞書を .get() で引く
+変更後: App/grid.py で作った行とセルをそのまま出力する (行を作る時間も含めて測る)
+
+30日・90日・180日の表 (9時〜22時) を、バンドのページとスケジュール入力のページについて描画する。
+続けて、テンプレートのコンパイルにかかる時間をバイトコードキャッシュの有無で比較する。
+DBには接続しない。
+"""
+import argparse
+import random
+import re
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+from App.app_init_ import app
+from App.grid import availability_rows, checkbox_rows, date_headers
+
+
+# --- 変更前のテンプレート (表の部分だけ) ---
+
+LEGACY_BAND_GRID = """
+<thead><tr><th class="corner-cell">時間</th>
+{% for day in dates %}{% set weekdays = ['月', '火', '水', '木', '金', '土', '日'] %}
+<th data-date="{{ day.isoformat() }}">{{ day.strftime('%m/%d') }}<br>{{ weekdays[day.weekday()] }}</th>
+{% endfor %}</tr></thead>
+<tbody>
+{% for hour in times %}<tr>
+<td class="time-label"><span class="time-full">{{ "%02d:00" | format(hour) }}</span><span class="time-short">{{ hour }}</span></td>
+{% for day in dates %}
+  {% set count = schedules_agg.get(day.isoformat(), {}).get(hour, 0) %}
+  {% set members_list = schedules_detail.get(day.isoformat(), {}).get(hour, []) %}
+  {% set conflicts_list = conflicts_detail.get(day.isoformat(), {}).get(hour, []) %}
+  <td data-date="{{ day.isoformat() }}" data-hour="{{ hour }}" data-count="{{ count }}"
+    {% if members_list %} data-members="{{ members_list|join(',') }}"{% endif %}
+    {% if conflicts_list %} class="has-conflict" data-conflicts="{{ conflicts_list|join(',') }}"{% endif %}
+    title="{{ count }} / {{ total_members }} 人">{% if count > 0 %}<span>{{ count }}</span>{% endif %}</td>
+{% endfor %}</tr>{% endfor %}
+</tbody>
+"""
+
+LEGACY_MANAGE_GRID = """
+<thead><tr><th class="corner-cell">時間</th>
+{% for day in dates %}{% set weekdays = ['月', '火', '水', '木', '金', '土', '日'] %}
+<th class="date-header" data-date="{{ day.isoformat() }}">{{ day.strftime('%m/%d') }}<br>{{ weekdays[day.weekday()] }}</th>
+{% endfor %}</tr></thead>
+<tbody>
+{% for hour in times %}<tr>
+<td class="time-label" data-hour="{{ hour }}"><span class="time-full">{{ "%02d:00" | format(hour) }}</span><span class="time-short">{{ hour }}</span></td>
+{% for day in dates %}
+<td class="schedule-cell"><input type="checkbox" class="schedule-checkbox" data-date="{{ day.isoformat() }}" data-hour="{{ hour }}"
+  {% if schedule_data.get(day.isoformat()) and schedule_data[day.isoformat()][hour] == 1 %} checked{% endif %}></td>
+{% endfor %}</tr>{% endfor %}
+</tbody>
+"""
+
+
+def sample_data(days: int, members: int):
+  rng = random.Random(days)
+  dates = [date.today() + timedelta(days=n) for n in range(days)]
+  hours = list(range(9, 23))
+  names = [f"メンバー{n}" for n in range(members)]
+
+  schedules_agg = defaultdict(lambda: defaultdict(int))
+  schedules_detail = defaultdict(lambda: defaultdict(list))
+  conflicts_detail = defaultdict(lambda: defaultdict(list))
+  for day in dates:
+    for hour in hours:
+      available = [name for name in names if rng.random() < 0.4]
+      if available:
+        schedules_agg[day.isoformat()][hour] = len(available)
+        schedules_detail[day.isoformat()][hour] = available
+      if rng.random() < 0.05:
+        conflicts_detail[day.isoformat()][hour] = names[:2]
+
+  schedule_data = {day.isoformat(): [int(rng.random() < 0.3) for _ in range(24)] for day in dates}
+  return dates, hours, schedules_agg, schedules_detail, conflicts_detail, schedule_data
+
+
+def measure(func, repeat: int) -> float:
+  func()
+  timings = []
+  for _ in range(repeat):
+    started = time.perf_counter()
+    func()
+    timings.append((time.perf_counter() - started) * 1000)
+  return statistics.median(timings)
+
+
+def normalize(html: str) -> str:
+  return re.sub(r"\s+", "", html)
+
+
+def compile_times(repeat: int) -> tuple[float, float]:
+  """band.html (と読み込むテンプレート) を新しい環境でコンパイルする時間。(キャッシュなし, キャッシュあり)"""
+  loader = FileSystemLoader(app.jinja_loader.searchpath)  # type: ignore
+  names = ["band/band.html", "band/band-grid.html", "head.html", "header.html"]
+
+  def compile_all(bytecode_cache=None):
+    env = Environment(loader=loader, autoescape=True, bytecode_cache=bytecode_cache)
+    for name in names:
+      env.get_template(name)
+
+  with tempfile.TemporaryDirectory() as directory:
+    cache = FileSystemBytecodeCache(directory)
+    compile_all(cache)  # キャッシュを作っておく
+    return measure(compile_all, repeat), measure(lambda: compile_all(cache), repeat)
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(prog="python -m benchmarks.render_grids")
+  parser.add_argument("--members", type=int, default=20)
+  parser.add_argument("--repeat", type=int, default=20)
+  args = parser.parse_args()
+
+  env = app.jinja_env
+  legacy_band = env.from_string(LEGACY_BAND_GRID)
+  legacy_manage = env.from_string(LEGACY_MANAGE_GRID)
+  band_grid = env.get_template("band/band-grid.html")
+  manage_grid = env.get_template("schedule/manage-grid.html")
+
+  print(f"members={args.members} hours=9-22 repeat={args.repeat} (中央値)")
+  for days in (30, 90, 180):
+    dates, hours, agg, detail, conflicts, schedule_data = sample_data(days, args.members)
+
+    def band_before():
+      return legacy_band.render(
+        dates=dates, times=hours, schedules_agg=agg, schedules_detail=detail,
+        conflicts_detail=conflicts, total_members=args.members,
+      )
+
+    def band_after():
+      headers = date_headers(dates)
+      rows = availability_rows(headers, hours, agg, detail, conflicts)
+      return band_grid.render(headers=headers, rows=rows, total_members=args.members)
+
+    def manage_before():
+      return legacy_manage.render(dates=dates, times=hours, schedule_data=schedule_data)
+
+    def manage_after():
+      headers = date_headers(dates)
+      return manage_grid.render(headers=headers, rows=checkbox_rows(headers, hours, schedule_data))
+
+    # 出力が変わっていないことを確かめる (空白の違いは除く)
+    assert normalize(band_before()) == normalize(band_after()), "band grid output differs"
+    assert normalize(manage_before()) == normalize(manage_after()), "manage grid output differs"
+
+    print(f"\n{days} 日 ({days * len(hours)} マス)")
+    for name, before, after in (("band", band_before, band_after), ("schedule-manage", manage_before, manage_after)):
+      before_ms, after_ms = measure(before, args.repeat), measure(after, args.repeat)
+      print(f"  {name:<16} before {before_ms:8.2f} ms  after {after_ms:8.2f} ms  ({before_ms / after_ms:.1f}x)")
+
+  without_cache, with_cache = compile_times(args.repeat)
+  print(f"\nband.html のコンパイル  キャッシュなし {without_cache:7.2f} ms  バイトコードキャッシュ {with_cache:7.2f} ms")
+
+
+if __name__ == "__main__":
+  main()
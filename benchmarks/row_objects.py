@@ -0,0 +1,118 @@
+"""
+大量の行を読むときの、行オブジェクトの作り方による時間とメモリ使用量を比較するベンチマーク
+
+  DATABASE_URL=postgresql://... python -m benchmarks.row_objects [--members 1000] [--days 30] [--repeat 20]
+
+変更前: SELECT * を dict_row で辞書にし、__dict__ を持つクラスに **row で渡す
+変更後: 列を明示して args_row で __slots__ のクラスに位置で渡す (中間の辞書を作らない)
+
+tracemalloc のピークは、読み込んだ行オブジェクトをすべて保持した状態で測る。
+検証用のユーザーとバンドを作成し、終了時に削除する (作成は benchmarks.schedule_memory と同じ)。
+"""
+import argparse
+import statistics
+import time
+import tracemalloc
+
+from psycopg.rows import dict_row
+
+from App.db.band import BandDatabaseManager
+from App.db.base import _get_connection, _get_read_connection, close_pools
+from App.db.schedule import ScheduleDatabaseManager
+
+from .schedule_memory import seed
+
+
+# --- 変更前の方式 (比較用) ---
+
+class LegacyUser:
+  def __init__(self, id, email, name):
+    self.id = id
+    self.email = email
+    self.name = name
+
+
+class LegacySchedule:
+  def __init__(self, id, user_id, band_id, schedule, comment):
+    self.id = id
+    self.user_id = user_id
+    self.band_id = band_id
+    self.schedule = schedule
+    self.comment = comment
+
+
+def legacy_get_users(band_id: int) -> list[LegacyUser]:
+  with _get_read_connection() as conn:
+    with conn.cursor(row_factory=dict_row) as cur:
+      cur.execute("""
+        SELECT u.id, u.email, u.name FROM users u
+        JOIN band_user bu ON u.id = bu.user_id WHERE bu.band_id = %s;
+      """, (band_id,))
+      return [LegacyUser(**row) for row in cur.fetchall()]
+
+
+def legacy_get_schedules(band_id: int) -> list[LegacySchedule]:
+  deserialize = ScheduleDatabaseManager()._deserialize_schedule
+  with _get_read_connection() as conn:
+    with conn.cursor(row_factory=dict_row) as cur:
+      cur.execute("SELECT * FROM schedules WHERE band_id = %s;", (band_id,))
+      schedules = []
+      for row in cur.fetchall():
+        row['schedule'] = deserialize(row['schedule'])
+        schedules.append(LegacySchedule(**row))
+      return schedules
+
+
+def measure(func, repeat: int) -> tuple[float, float]:
+  """(1回あたりの時間の中央値 ms, 結果を保持した状態のピークのメモリ使用量 KiB) を返す"""
+  func()  # 接続やプリペアドステートメントの準備を除くため、1回目は計測しない
+  timings = []
+  for _ in range(repeat):
+    started = time.perf_counter()
+    func()
+    timings.append((time.perf_counter() - started) * 1000)
+
+  tracemalloc.start()
+  result = func()
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  del result
+  return statistics.median(timings), peak / 1024
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(prog="python -m benchmarks.row_objects")
+  parser.add_argument("--members", type=int, default=1000)
+  parser.add_argument("--days", type=int, default=30)
+  parser.add_argument("--repeat", type=int, default=20)
+  args = parser.parse_args()
+
+  band_db = BandDatabaseManager()
+  schedule_db = ScheduleDatabaseManager()
+  band_id, user_ids = seed(args.members, args.days)
+
+  cases = [
+    # 無効化バスを起動していないので、get_users のキャッシュは使われず毎回DBから読む
+    ("users (band members)", lambda: legacy_get_users(band_id), lambda: band_db.get_users(band_id)),
+    ("schedules (band)", lambda: legacy_get_schedules(band_id), lambda: schedule_db.get_schedules(band_id=band_id)),
+  ]
+
+  print(f"members={args.members} days={args.days} repeat={args.repeat}")
+  try:
+    for name, legacy, current in cases:
+      print(f"\n{name}")
+      for label, func in (("before", legacy), ("after", current)):
+        elapsed, peak = measure(func, args.repeat)
+        print(f"  {label:<7} p50 {elapsed:8.2f} ms  peak {peak:10.1f} KiB")
+  finally:
+    with _get_connection() as conn:
+      conn.execute("DELETE FROM schedules WHERE band_id = %s OR user_id = ANY(%s);", (band_id, user_ids))
+      conn.execute("DELETE FROM band_user WHERE band_id = %s;", (band_id,))
+      conn.execute("DELETE FROM bands WHERE id = %s;", (band_id,))
+      conn.execute("DELETE FROM users WHERE id = ANY(%s);", (user_ids,))
+      conn.commit()
+    close_pools()
+
+
+if __name__ == "__main__":
+  main()
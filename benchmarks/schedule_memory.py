@@ -0,0 +1,109 @@
+"""
+メンバーが多いバンドの集計で、スケジュールをまとめて読む場合と少しずつ読む場合のメモリ使用量を比較するベンチマーク
+
+  DATABASE_URL=postgresql://... python -m benchmarks.schedule_memory [--members 1000] [--days 90] [--batch-size 200]
+
+まとめて読む:   get_schedules でバンドの全行をリストにしてから集計する
+少しずつ読む:   iter_schedules (サーバーサイドカーソル) で batch_size 件ずつ読みながら集計する
+
+tracemalloc のピークは集計結果そのもの(日付・時間ごとのメンバー名)も含む。
+検証用のユーザーとバンドを作成し、終了時に削除する。
+"""
+import argparse
+import json
+import random
+import time
+import tracemalloc
+import uuid
+from datetime import date, time as dtime, timedelta
+
+from App.aggregate import aggregate_schedules
+from App.db.band import BandDatabaseManager
+from App.db.base import _get_connection, close_pools
+from App.db.schedule import ScheduleDatabaseManager
+
+
+def measure(func) -> tuple[float, float]:
+  """(ピークのメモリ使用量 MiB, 経過時間 ms) を返す"""
+  tracemalloc.start()
+  started = time.perf_counter()
+  func()
+  elapsed = (time.perf_counter() - started) * 1000
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return peak / 1024 / 1024, elapsed
+
+
+def seed(members: int, days: int) -> tuple[int, list[int]]:
+  """検証用のバンドとメンバー、スケジュールを COPY でまとめて作成する"""
+  today = date.today()
+  prefix = f"bench-{uuid.uuid4().hex}"
+  rng = random.Random(0)
+
+  with _get_connection() as conn:
+    with conn.cursor() as cur:
+      with cur.copy("COPY users (email, name) FROM STDIN") as copy:
+        for n in range(members):
+          copy.write_row((f"{prefix}-{n}@example.invalid", f"member{n}"))
+      cur.execute("SELECT id FROM users WHERE email LIKE %s ORDER BY id;", (f"{prefix}-%",))
+      user_ids = [row["id"] for row in cur.fetchall()]
+
+      cur.execute("""
+        INSERT INTO bands (name, creator_user_id, token, start_date, end_date, start_time, end_time)
+        VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id;
+      """, ("benchmark", user_ids[0], prefix, today, today + timedelta(days=days - 1), dtime(9), dtime(22)))
+      band_id = cur.fetchone()["id"]
+
+      with cur.copy("COPY band_user (user_id, band_id) FROM STDIN") as copy:
+        for user_id in user_ids:
+          copy.write_row((user_id, band_id))
+      with cur.copy("COPY schedules (user_id, band_id, schedule, comment) FROM STDIN") as copy:
+        for user_id in user_ids:
+          schedule = {
+            (today + timedelta(days=n)).isoformat(): [int(rng.random() < 0.3) for _ in range(24)]
+            for n in range(days)
+          }
+          copy.write_row((user_id, band_id, json.dumps(schedule), ""))
+    conn.commit()
+  return band_id, user_ids
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(prog="python -m benchmarks.schedule_memory")
+  parser.add_argument("--members", type=int, default=1000)
+  parser.add_argument("--days", type=int, default=90)
+  parser.add_argument("--batch-size", type=int, default=200)
+  args = parser.parse_args()
+
+  band_db = BandDatabaseManager()
+  schedule_db = ScheduleDatabaseManager()
+
+  band_id, user_ids = seed(args.members, args.days)
+  member_map = {member.id: member.name for member in band_db.get_users(band_id)}
+
+  cases = [
+    ("get_schedules + 集計", lambda: aggregate_schedules(schedule_db.get_schedules(band_id=band_id), member_map)),
+    (
+      f"iter_schedules(batch_size={args.batch_size}) + 集計",
+      lambda: aggregate_schedules(schedule_db.iter_schedules(band_id=band_id, batch_size=args.batch_size), member_map),
+    ),
+  ]
+
+  print(f"members={args.members} days={args.days}")
+  try:
+    for name, func in cases:
+      func()  # 接続の準備を除くため、1回目は計測しない
+      peak, elapsed = measure(func)
+      print(f"  {name:<40} peak {peak:8.1f} MiB  {elapsed:8.1f} ms")
+  finally:
+    with _get_connection() as conn:
+      conn.execute("DELETE FROM schedules WHERE band_id = %s OR user_id = ANY(%s);", (band_id, user_ids))
+      conn.execute("DELETE FROM band_user WHERE band_id = %s;", (band_id,))
+      conn.execute("DELETE FROM bands WHERE id = %s;", (band_id,))
+      conn.execute("DELETE FROM users WHERE id = ANY(%s);", (user_ids,))
+      conn.commit()
+    close_pools()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,112 @@
+"""
+ワーカーの起動時間と、fork したワーカー間で共有されるメモリを測るベンチマーク (Linux用)
+
+  python -m benchmarks.worker_boot [--runs 10] [--workers 4] [--requests 50]
+
+1. 起動時間: 新しいプロセスで create_app() して最初のリクエストを返すまでの時間。
+   変更前と同じく Google の認証ライブラリを import 時に読み込む場合 (eager) と比較する。
+2. 共有メモリ: 親プロセスでアプリを読み込んでから fork し、各ワーカーでリクエストを処理してGCを動かした後の
+   Private_Dirty (そのワーカーだけが持つメモリ) を、fork 前に gc.freeze() した場合としない場合で比較する。
+
+DBに接続しないページ (/, /sw.js) だけを使うので、DATABASE_URL がなくても実行できる。
+"""
+import argparse
+import gc
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+BOOT_SCRIPT = """
+import sys, time
+started = time.perf_counter()
+if {eager}:
+  import google_auth_oauthlib.flow, google.oauth2.id_token, google.auth.transport.requests
+from App.app_init_ import create_app
+app = create_app()
+app.test_client().get("/")
+print(time.perf_counter() - started, len(sys.modules))
+"""
+
+
+def boot_times(eager: bool, runs: int) -> tuple[list[float], int]:
+  timings, modules = [], 0
+  for _ in range(runs):
+    # DBに接続できない場合は受信スレッドのエラーも出力されるので、最後の行だけを読む
+    output = subprocess.run(
+      [sys.executable, "-c", BOOT_SCRIPT.format(eager=eager)],
+      capture_output=True, text=True, check=True,
+    ).stdout.strip().splitlines()[-1].split()
+    timings.append(float(output[0]) * 1000)
+    modules = int(output[1])
+  return timings, modules
+
+
+def memory_kib(field: str) -> int:
+  with open("/proc/self/smaps_rollup") as f:
+    for line in f:
+      if line.startswith(field + ":"):
+        return int(line.split()[1])
+  return 0
+
+
+def forked_private_dirty(workers: int, requests: int, freeze: bool) -> list[int]:
+  """fork したワーカーごとの Private_Dirty (KiB) を返す"""
+  from App.app_init_ import create_app, preload
+
+  app = create_app()
+  preload()
+  if freeze:
+    gc.freeze()
+
+  results = []
+  for _ in range(workers):
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+      os.close(read_fd)
+      client = app.test_client()
+      for _ in range(requests):
+        client.get("/")
+        client.get("/sw.js")
+      gc.collect()
+      os.write(write_fd, json.dumps(memory_kib("Private_Dirty")).encode())
+      os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+      results.append(json.loads(f.read()))
+    os.waitpid(pid, 0)
+
+  if freeze:
+    gc.unfreeze()
+  return results
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(prog="python -m benchmarks.worker_boot")
+  parser.add_argument("--runs", type=int, default=10)
+  parser.add_argument("--workers", type=int, default=4)
+  parser.add_argument("--requests", type=int, default=50)
+  args = parser.parse_args()
+
+  print(f"起動時間 (create_app + 最初のリクエスト, {args.runs} 回の中央値)")
+  for label, eager in (("eager (変更前)", True), ("lazy", False)):
+    timings, modules = boot_times(eager, args.runs)
+    print(f"  {label:<14} {statistics.median(timings):7.1f} ms  modules {modules}")
+
+  # 2つの条件を同じプロセスで測ると後の方が有利になるため、それぞれ子プロセスで測る
+  print(f"\nfork 後のワーカーごとの Private_Dirty ({args.workers} ワーカー, {args.requests} リクエスト)")
+  for label, freeze in (("gc.freeze なし", False), ("gc.freeze あり", True)):
+    script = (
+      "import json; from benchmarks.worker_boot import forked_private_dirty; "
+      f"print(json.dumps(forked_private_dirty({args.workers}, {args.requests}, {freeze})))"
+    )
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout
+    sizes = json.loads(output.strip().splitlines()[-1])
+    print(f"  {label:<14} mean {statistics.mean(sizes) / 1024:7.1f} MiB  max {max(sizes) / 1024:7.1f} MiB")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,174 @@
+"""
+静的ファイルのビルドスクリプト
+
+  python build_assets.py
+
+Src/static 以下のCSS/JS/アイコンを次のように加工して Src/static/dist に出力する。
+  - CSS/JSを圧縮(minify)する
+  - 共通CSS(base.css)と各ページのCSSを1ファイルにまとめる (bundles/<ページ>.css)
+  - ファイル名に内容のハッシュを付け、対応表を manifest.json に書き出す
+  - gzip版(.gz)と、brotliがインストールされていればbrotli版(.br)を事前に作成する
+  - Pillowがインストールされていればアイコンを最適化し、足りないサイズを生成する
+"""
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+
+from App.assets import BASE_CSS, DIST_DIR, MANIFEST_PATH, STATIC_DIR, page_bundle_name
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+try:
+  from PIL import Image
+except ImportError:
+  Image = None
+
+
+# ビルド対象外 (古いアイコンなど、どのページからも参照されていないもの)
+EXCLUDE_DIRS = {"dist", "pwa", os.path.join("icons", "old"), os.path.join("icons", "oldver2")}
+
+# 元画像から縮小して生成するアイコン: 出力パス -> (元画像, 一辺のピクセル数)
+RESIZED_ICONS = {
+  "icons/icon-192.png": ("icons/icon-2404.png", 192),
+}
+
+# 圧縮版を作成する拡張子と、作成する最小サイズ
+COMPRESS_EXTENSIONS = {".css", ".js", ".json", ".ico", ".svg"}
+COMPRESS_MIN_SIZE = 512
+
+
+# --- minify ---
+
+def minify_css(source: str) -> str:
+  """コメントと余分な空白を取り除く (セレクタ内の空白は意味があるので残す)"""
+  source = re.sub(r"/\*.*?\*/", "", source, flags=re.S)
+  source = re.sub(r"\s+", " ", source)
+  source = re.sub(r"\s*([{};,>])\s*", r"\1", source)
+  source = re.sub(r":\s+", ":", source)
+  source = source.replace(";}", "}")
+  return source.strip()
+
+
+def minify_js(source: str) -> str:
+  """
+  行頭のインデント・空行・行全体のコメントだけを取り除く。
+  文字列やテンプレートリテラルの中身は書き換えないように、行単位の安全な処理にとどめる。
+  """
+  source = re.sub(r"^\s*/\*.*?\*/\s*$", "", source, flags=re.S | re.M)
+  lines = []
+  for line in source.splitlines():
+    stripped = line.strip()
+    if not stripped or stripped.startswith("//"):
+      continue
+    lines.append(stripped)
+  return "\n".join(lines) + "\n"
+
+
+# --- 出力 ---
+
+def hashed_name(path: str, content: bytes) -> str:
+  """css/band/band.css -> css/band/band.<hash>.css"""
+  digest = hashlib.sha256(content).hexdigest()[:10]
+  root, ext = os.path.splitext(path)
+  return f"{root}.{digest}{ext}"
+
+
+def write_output(path: str, content: bytes, manifest: dict) -> None:
+  """ハッシュ付きのファイル名で書き出し、必要なら圧縮版も作成する"""
+  output = hashed_name(path, content)
+  output_path = os.path.join(DIST_DIR, output)
+  os.makedirs(os.path.dirname(output_path), exist_ok=True)
+  with open(output_path, "wb") as f:
+    f.write(content)
+
+  if os.path.splitext(path)[1] in COMPRESS_EXTENSIONS and len(content) >= COMPRESS_MIN_SIZE:
+    with open(output_path + ".gz", "wb") as f:
+      f.write(gzip.compress(content, compresslevel=9, mtime=0))
+    if brotli:
+      with open(output_path + ".br", "wb") as f:
+        f.write(brotli.compress(content, quality=11))
+
+  manifest["files"][path] = output.replace(os.sep, "/")
+
+
+def optimize_png(path: str, size: int | None = None) -> bytes:
+  """PNGを(必要なら縮小して)最適化する。Pillowがなければそのまま返す"""
+  source_path = os.path.join(STATIC_DIR, path)
+  if not Image:
+    with open(source_path, "rb") as f:
+      return f.read()
+
+  with Image.open(source_path) as image:
+    if size:
+      image = image.resize((size, size), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def iter_static_files():
+  for root, dirs, files in os.walk(STATIC_DIR):
+    rel_root = os.path.relpath(root, STATIC_DIR)
+    dirs[:] = [d for d in dirs if os.path.normpath(os.path.join(rel_root, d)) not in EXCLUDE_DIRS]
+    for name in sorted(files):
+      yield os.path.normpath(os.path.join(rel_root, name)).replace(os.sep, "/")
+
+
+def build() -> dict:
+  if os.path.isdir(DIST_DIR):
+    shutil.rmtree(DIST_DIR)
+  os.makedirs(DIST_DIR)
+
+  manifest: dict = {"files": {}}
+  minified_css: dict[str, str] = {}
+
+  for path in iter_static_files():
+    ext = os.path.splitext(path)[1]
+    source_path = os.path.join(STATIC_DIR, path)
+
+    if ext == ".css":
+      with open(source_path, encoding="utf-8") as f:
+        minified_css[path] = minify_css(f.read())
+      write_output(path, minified_css[path].encode("utf-8"), manifest)
+    elif ext == ".js":
+      with open(source_path, encoding="utf-8") as f:
+        write_output(path, minify_js(f.read()).encode("utf-8"), manifest)
+    elif ext == ".png":
+      write_output(path, optimize_png(path), manifest)
+    else:
+      with open(source_path, "rb") as f:
+        write_output(path, f.read(), manifest)
+
+  # 共通CSS + ページのCSS を1ファイルにまとめる
+  for path, css in minified_css.items():
+    if path == BASE_CSS:
+      continue
+    bundle = minified_css.get(BASE_CSS, "") + "\n" + css
+    write_output(page_bundle_name(path), bundle.encode("utf-8"), manifest)
+
+  for path, (source, size) in RESIZED_ICONS.items():
+    if Image:
+      write_output(path, optimize_png(source, size), manifest)
+
+  with open(MANIFEST_PATH, "w", encoding="utf-8") as f:
+    json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+  return manifest
+
+
+if __name__ == "__main__":
+  result = build()
+  total = sum(
+    os.path.getsize(os.path.join(DIST_DIR, name)) for name in result["files"].values()
+  )
+  print(f"{len(result['files'])} files -> {DIST_DIR} ({total / 1024:.1f} KiB before compression)")
+  if not brotli:
+    print("brotli がインストールされていないため、.br は作成していません")
+  if not Image:
+    print("Pillow がインストールされていないため、アイコンの最適化・縮小はしていません")
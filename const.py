@@ -17,4 +17,75 @@ GOOGLE_CLIENT_SECRET = os.environ.get("GOOGLE_CLIENT_SECRET")
 REDIRECT_URI = os.environ.get("REDIRECT_URI")
 SECRET_KEY = os.environ.get("SECRET_KEY")
 
-DATABASE_URL = os.getenv("DATABASE_URL", "")
\ No newline at end of file
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+
+# カレンダー(iCalendar)出力で使用するタイムゾーン
+CALENDAR_TIMEZONE = os.getenv("CALENDAR_TIMEZONE", "Asia/Tokyo")
+
+# 読み取り専用のレプリカ (カンマ区切りで複数指定できる。未設定ならすべてDATABASE_URLを使う)
+# 接続するロールに pg_read_all_stats を付けると、更新の少ない時間帯にもレプリカの遅延を0と判定できる
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+# レプリカの遅延がこの秒数を超えたら、読み取りもプライマリで行う
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+
+# コネクションプール (psycopg_pool) の大きさ (0にするとプールを使わず、毎回接続する)
+DATABASE_POOL_MIN_SIZE = int(os.getenv("DATABASE_POOL_MIN_SIZE", "1"))
+DATABASE_POOL_MAX_SIZE = int(os.getenv("DATABASE_POOL_MAX_SIZE", "10"))
+# サーバー側のプリペアドステートメントを使うか (トランザクションモードのPgBouncerを挟む場合などは0にする)
+DATABASE_PREPARED_STATEMENTS = os.getenv("DATABASE_PREPARED_STATEMENTS", "1") != "0"
+
+# 自動保存のアドミッション制御 (ユーザーごとのトークンバケット)
+# 1ユーザーあたり平均 SAVE_RATE_PER_SECOND 回/秒、連続で SAVE_BURST 回まで受け付ける
+SAVE_RATE_PER_SECOND = float(os.getenv("SAVE_RATE_PER_SECOND", "0.5"))
+SAVE_BURST = int(os.getenv("SAVE_BURST", "5"))
+# プロセス全体で受け付ける保存の回数/秒。これに近づくほど、クライアントに長めの保存間隔を返す
+SAVE_GLOBAL_RATE_PER_SECOND = float(os.getenv("SAVE_GLOBAL_RATE_PER_SECOND", "50"))
+# 混雑していないときの自動保存の間隔(ミリ秒)と、混雑時に返す間隔の上限
+SAVE_INTERVAL_MS = int(os.getenv("SAVE_INTERVAL_MS", "3000"))
+SAVE_MAX_INTERVAL_MS = int(os.getenv("SAVE_MAX_INTERVAL_MS", "30000"))
+
+# Jinjaのテンプレートをコンパイルした結果の保存先 (ワーカーの起動のたびにコンパイルし直さない)。空にすると保存しない
+JINJA_BYTECODE_CACHE_DIR = os.getenv("JINJA_BYTECODE_CACHE_DIR", os.path.join(BASE_DIR, "__pycache__", "jinja"))
+
+# アーカイブしたバンドのスナップショットを作った後、メンバーのスケジュールの行を削除するか。
+# 削除した行はスナップショットに含め、アーカイブの解除時に戻す
+BAND_SNAPSHOT_RELEASE_ROWS = os.getenv("BAND_SNAPSHOT_RELEASE_ROWS", "0") == "1"
+
+# バックグラウンドジョブ (App/jobs.py)
+# ワーカープロセスごとにジョブを実行するスレッドの数 (0 にするとそのプロセスでは実行しない)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# 通知を受け取れなかった場合に、新しいジョブを確認する間隔(秒)
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "5"))
+# 実行中のジョブを他のワーカーが取らない時間(秒)。これを過ぎても終わらないジョブは、落ちたものとして再実行する
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+# 失敗したジョブを再実行する回数の上限と、再実行までの待ち時間(秒、失敗するたびに2倍)
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "10"))
+
+# リクエストごとのプロファイリング (App/profiling.py)
+# このトークンを X-Profile-Token ヘッダーに付けたリクエストをプロファイルする。空にするとヘッダーでは有効にならず、一覧も見られない
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+# ヘッダーがなくてもプロファイルするリクエストの割合 (0〜1)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# スタックを記録する間隔(ミリ秒)
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "2"))
+# プロファイルの保存先と、残しておく件数
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(BASE_DIR, "profiles"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "200"))
+
+# データベース層のログ (App/db/log.py)
+# 出力を待つログの上限。あふれた分は捨てる (リクエストを待たせない)
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# 同じメソッド・同じ種類のエラーを LOG_RATE_LIMIT_WINDOW_SECONDS 秒に LOG_RATE_LIMIT_BURST 件まで出力する
+LOG_RATE_LIMIT_BURST = int(os.getenv("LOG_RATE_LIMIT_BURST", "5"))
+LOG_RATE_LIMIT_WINDOW_SECONDS = float(os.getenv("LOG_RATE_LIMIT_WINDOW_SECONDS", "60"))
+
+# 招待リンクからの参加 (/join)
+# 同じバンドへの同時の参加を1つのINSERTにまとめる (1でまとめる)
+JOIN_BATCHING = os.getenv("JOIN_BATCHING", "0") == "1"
+# 1回のINSERTでまとめる人数の上限
+JOIN_BATCH_MAX_SIZE = int(os.getenv("JOIN_BATCH_MAX_SIZE", "100"))
+
+# バンドのページのリアルタイム更新 (/band/stream)
+# ストリームを使えない (プロキシがSSEを通さないなど) ページは STREAM_POLL_SECONDS ごとのポーリング (/band/cells) で更新する
+STREAM_POLL_SECONDS = int(os.getenv("STREAM_POLL_SECONDS", "30"))
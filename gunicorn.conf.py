@@ -0,0 +1,86 @@
+"""
+本番用の gunicorn の設定
+
+  gunicorn -c gunicorn.conf.py
+
+- preload_app: マスタープロセスでアプリを1回だけ読み込んでから fork する。
+  ワーカーは読み込み済みのモジュールをコピーオンライトで共有するので、起動が速くメモリも少なくて済む。
+- gc.freeze(): fork 前にある全オブジェクトをGCの対象から外す。
+  GCが共有中のオブジェクトに触れてページがコピーされる (共有が崩れる) のを防ぐ。
+- プール・受信スレッドはワーカーごとに fork 後に作り、終了時に閉じる。
+- SSE (/band/stream) の接続を保持するため、gevent ワーカーを使う。
+  リクエストはグリーンレットで処理され、待機中のストリームはスレッドを占有しないので、
+  1つのワーカーで数百のストリームを開いたまま通常のリクエストも処理できる (上限は worker_connections)。
+- gevent のモンキーパッチは、アプリを読み込む (preload_app) 前にこのファイルで当てる。
+  後から当てると、読み込み時に作ったロックやキューがグリーンレットを切り替えずにワーカー全体を止めてしまう。
+  psycopg はパッチ済みの select で待つので、DBの待ち時間にも他のリクエストを処理できる。
+
+ワーカー数などは環境変数で変えられる (WEB_CONCURRENCY, GUNICORN_WORKER_CONNECTIONS, PORT)。
+"""
+from gevent import monkey
+
+monkey.patch_all()
+
+import gc
+import multiprocessing
+import os
+import signal
+
+import gevent
+
+
+wsgi_app = "app:app"
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "gevent"
+# ワーカーごとに同時に処理する接続 (開いているストリームを含む) の上限
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+preload_app = True
+
+timeout = 60
+# 終了の合図から、処理中のリクエストを待つ秒数
+graceful_timeout = 30
+keepalive = 5
+
+
+def when_ready(server):
+  """アプリの読み込み後、最初の fork の前にマスタープロセスで呼ばれる"""
+  from App.app_init_ import preload
+
+  preload()
+  gc.freeze()
+
+
+def pre_fork(server, worker):
+  # 再起動したワーカーのために、前回の fork 以降に作られたオブジェクトも対象から外す
+  gc.freeze()
+
+
+def post_fork(server, worker):
+  from App.app_init_ import init_worker
+
+  init_worker()
+
+
+def post_worker_init(worker):
+  """
+  SIGTERM を受けたら、先にSSEのストリームを終わらせてから通常の終了処理に進む。
+  ストリームは終わらないリクエストなので、そのままだと graceful_timeout まで待たされる。
+  """
+  from App.app_init_ import close_streams
+
+  handle_exit = worker.handle_exit
+
+  def handle_exit_and_close_streams(sig, frame):
+    # シグナルハンドラはイベントループのコールバックで呼ばれ、待つ処理ができないので、別のグリーンレットで閉じる
+    gevent.spawn(close_streams)
+    handle_exit(sig, frame)
+
+  signal.signal(signal.SIGTERM, handle_exit_and_close_streams)
+
+
+def worker_exit(server, worker):
+  from App.app_init_ import shutdown_worker
+
+  shutdown_worker()
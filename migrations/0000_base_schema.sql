@@ -0,0 +1,36 @@
+-- 既存のテーブル定義 (アプリのクエリから必要な列と制約をまとめたもの)
+-- すでにテーブルがある環境では何も変更しない
+
+CREATE TABLE IF NOT EXISTS users (
+  id SERIAL PRIMARY KEY,
+  email TEXT NOT NULL UNIQUE,
+  name TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS bands (
+  id SERIAL PRIMARY KEY,
+  name TEXT NOT NULL,
+  creator_user_id INTEGER NOT NULL,
+  token TEXT NOT NULL UNIQUE,
+  start_date DATE NOT NULL,
+  end_date DATE NOT NULL,
+  start_time TIME NOT NULL,
+  end_time TIME NOT NULL,
+  archived BOOLEAN NOT NULL DEFAULT FALSE
+);
+
+CREATE TABLE IF NOT EXISTS band_user (
+  user_id INTEGER NOT NULL,
+  band_id INTEGER NOT NULL,
+  UNIQUE (user_id, band_id)
+);
+
+-- band_id = 0 は個人のデフォルトスケジュール、user_id = 0 はバンド練のスケジュール
+CREATE TABLE IF NOT EXISTS schedules (
+  id SERIAL PRIMARY KEY,
+  user_id INTEGER NOT NULL,
+  band_id INTEGER NOT NULL,
+  schedule JSONB,
+  comment TEXT,
+  UNIQUE (user_id, band_id)
+);
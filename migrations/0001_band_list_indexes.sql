@@ -0,0 +1,9 @@
+-- migrate: no-transaction
+-- バンド一覧 (終了日の新しい順、アーカイブ済みは別に読み込む) とメンバーの取得のためのインデックス。
+-- 本番のテーブルをロックしないよう、トランザクションの外で CONCURRENTLY で作る。
+
+-- band_user の UNIQUE (user_id, band_id) ではバンドIDからメンバーを引けないため
+CREATE INDEX CONCURRENTLY IF NOT EXISTS band_user_band_id_user_id_idx ON band_user (band_id, user_id);
+
+-- get_bands の WHERE archived = ... ORDER BY end_date DESC, id DESC と、(end_date, id) < (...) の続きの読み込み
+CREATE INDEX CONCURRENTLY IF NOT EXISTS bands_archived_end_date_id_idx ON bands (archived, end_date DESC, id DESC);
@@ -0,0 +1,9 @@
+-- アーカイブしたバンドの集計結果 (zlibで圧縮したJSON)。バンドのページはこれを読むだけで表示する
+-- released が TRUE の場合、schedules の行は削除済みで、data に元の行が含まれている
+
+CREATE TABLE IF NOT EXISTS band_snapshots (
+  band_id INTEGER PRIMARY KEY,
+  data BYTEA NOT NULL,
+  released BOOLEAN NOT NULL DEFAULT FALSE,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
@@ -0,0 +1,22 @@
+-- バックグラウンドジョブのキュー (App/jobs.py)
+-- status: queued (待機中) / running (実行中) / done (完了) / failed (再実行の上限に達した)
+
+CREATE TABLE IF NOT EXISTS jobs (
+  id BIGSERIAL PRIMARY KEY,
+  kind TEXT NOT NULL,
+  payload JSONB NOT NULL DEFAULT '{}',
+  -- 同じキーのジョブは1つしか作らない (二重送信などで同じ処理を何度も登録しない)
+  idempotency_key TEXT UNIQUE,
+  status TEXT NOT NULL DEFAULT 'queued',
+  attempts INTEGER NOT NULL DEFAULT 0,
+  max_attempts INTEGER NOT NULL,
+  run_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  locked_until TIMESTAMPTZ,
+  last_error TEXT,
+  created_by INTEGER,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- 実行できるジョブを探すためのインデックス (完了したジョブは含めない)
+CREATE INDEX IF NOT EXISTS jobs_runnable_idx ON jobs (run_at) WHERE status IN ('queued', 'running');
@@ -0,0 +1,76 @@
+import os
+import re
+
+import psycopg
+
+from const import DATABASE_URL
+
+
+MIGRATIONS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# この行で始まるファイルはトランザクションの外で1文ずつ実行する (CREATE INDEX CONCURRENTLY など)
+NO_TRANSACTION_MARKER = "-- migrate: no-transaction"
+
+_FILE_PATTERN = re.compile(r"^(\d{4})_[\w-]+\.sql$")
+
+
+def connect(autocommit: bool = False) -> psycopg.Connection:
+  """マイグレーション用にプライマリへ接続する"""
+  return psycopg.connect(DATABASE_URL, autocommit=autocommit)
+
+
+def migration_files() -> list[tuple[str, str]]:
+  """(バージョン, ファイルパス) を番号順に返す"""
+  files = []
+  for name in sorted(os.listdir(MIGRATIONS_DIR)):
+    match = _FILE_PATTERN.match(name)
+    if match:
+      files.append((match.group(1), os.path.join(MIGRATIONS_DIR, name)))
+  return files
+
+
+def split_statements(source: str) -> list[str]:
+  """行末の ; で区切って1文ずつに分ける (関数定義のような ; を含む文はトランザクション内のファイルに書く)"""
+  statements, current = [], []
+  for line in source.splitlines():
+    if line.strip().startswith("--"):
+      continue
+    current.append(line)
+    if line.rstrip().endswith(";"):
+      statement = "\n".join(current).strip()
+      if statement != ";":
+        statements.append(statement)
+      current = []
+  if "\n".join(current).strip():
+    statements.append("\n".join(current).strip())
+  return statements
+
+
+def ensure_version_table(conn: psycopg.Connection) -> None:
+  conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+      version TEXT PRIMARY KEY,
+      applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+  """)
+
+
+def applied_versions(conn: psycopg.Connection) -> set[str]:
+  return {row[0] for row in conn.execute("SELECT version FROM schema_migrations;").fetchall()}
+
+
+def apply(version: str, path: str) -> None:
+  """マイグレーションを1つ適用し、適用済みとして記録する"""
+  with open(path, encoding="utf-8") as f:
+    source = f.read()
+
+  if source.startswith(NO_TRANSACTION_MARKER):
+    with connect(autocommit=True) as conn:
+      for statement in split_statements(source):
+        conn.execute(statement)
+      conn.execute("INSERT INTO schema_migrations (version) VALUES (%s);", (version,))
+  else:
+    with connect() as conn:
+      conn.execute(source)
+      conn.execute("INSERT INTO schema_migrations (version) VALUES (%s);", (version,))
+      conn.commit()
@@ -0,0 +1,39 @@
+"""
+スキーマのマイグレーションを適用する
+
+  python -m migrations          未適用のマイグレーションを番号順に適用する
+  python -m migrations --list   適用状況を表示する
+
+データの移行を伴う変更 (schedules のパーティション化など) は個別のスクリプトで行う。
+  python -m migrations.partition_schedules --help
+"""
+import argparse
+import os
+
+from . import apply, applied_versions, connect, ensure_version_table, migration_files
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(prog="python -m migrations")
+  parser.add_argument("--list", action="store_true", help="適用状況を表示する")
+  args = parser.parse_args()
+
+  with connect() as conn:
+    ensure_version_table(conn)
+    conn.commit()
+    applied = applied_versions(conn)
+
+  for version, path in migration_files():
+    name = os.path.basename(path)
+    if args.list:
+      print(f"[{'x' if version in applied else ' '}] {name}")
+    elif version not in applied:
+      print(f"適用中: {name}")
+      apply(version, path)
+
+  if not args.list:
+    print("マイグレーションは最新です")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,224 @@
+"""
+schedules テーブルをオンラインのままパーティション化する
+
+  python -m migrations.partition_schedules prepare [--partitions 16]
+  python -m migrations.partition_schedules copy [--batch-size 5000] [--sleep 0.05]
+  python -m migrations.partition_schedules verify
+  python -m migrations.partition_schedules swap
+  python -m migrations.partition_schedules cleanup
+
+パーティションの構成:
+  schedules                 PARTITION BY LIST (band_id)
+    schedules_defaults      band_id = 0 (個人のデフォルトスケジュール)
+    schedules_bands         それ以外 (DEFAULT)。PARTITION BY HASH (band_id)
+      schedules_bands_p00 ... schedules_bands_pNN
+
+手順:
+  1. prepare  新しいテーブル schedules_partitioned を作り、schedules への書き込みを
+              トリガーで新しいテーブルにも反映し始める
+  2. copy     既存の行をid順に少しずつコピーする (アプリは止めなくてよい)
+  3. verify   件数と内容のチェックサムを比較する
+  4. swap     短いロックの間に最終確認をして、テーブル名を入れ替える
+  5. cleanup  動作を確認したら、元のテーブル (schedules_old) を削除する
+"""
+import argparse
+import time
+
+import psycopg
+from psycopg import sql
+
+from . import connect
+
+
+NEW_TABLE = "schedules_partitioned"
+OLD_TABLE = "schedules_old"
+SEQUENCE = "schedules_partitioned_id_seq"
+TRIGGER = "schedules_mirror"
+
+COLUMNS = ("id", "user_id", "band_id", "schedule", "comment")
+
+
+MIRROR_FUNCTION_SQL = f"""
+CREATE OR REPLACE FUNCTION {TRIGGER}() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'DELETE'
+     OR (TG_OP = 'UPDATE' AND (OLD.user_id, OLD.band_id) IS DISTINCT FROM (NEW.user_id, NEW.band_id)) THEN
+    DELETE FROM {NEW_TABLE} WHERE band_id = OLD.band_id AND user_id = OLD.user_id;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    INSERT INTO {NEW_TABLE} (id, user_id, band_id, schedule, comment)
+    VALUES (NEW.id, NEW.user_id, NEW.band_id, NEW.schedule, NEW.comment)
+    ON CONFLICT (band_id, user_id) DO UPDATE
+    SET id = EXCLUDED.id, schedule = EXCLUDED.schedule, comment = EXCLUDED.comment;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# 行の内容のチェックサム。jsonbのテキスト表現は正規化されているので、そのまま比較できる
+CHECKSUM_SQL = """
+  SELECT count(*) AS rows, coalesce(sum(hashtext(
+    user_id || ':' || band_id || ':' || coalesce(schedule::text, '') || ':' || coalesce(comment, '')
+  )::bigint), 0) AS checksum
+  FROM {table};
+"""
+
+
+def prepare(partitions: int) -> None:
+  """パーティション化したテーブルを作り、既存テーブルへの書き込みの反映を始める"""
+  table = sql.Identifier(NEW_TABLE)
+  with connect() as conn:
+    conn.execute(sql.SQL("CREATE SEQUENCE IF NOT EXISTS {};").format(sql.Identifier(SEQUENCE)))
+    # 列の型やNOT NULLは既存のテーブルに合わせる
+    conn.execute(sql.SQL(
+      "CREATE TABLE {} (LIKE schedules) PARTITION BY LIST (band_id);"
+    ).format(table))
+    conn.execute(sql.SQL(
+      "ALTER TABLE {} ALTER COLUMN id SET DEFAULT nextval({});"
+    ).format(table, sql.Literal(SEQUENCE)))
+    conn.execute(sql.SQL("ALTER SEQUENCE {} OWNED BY {}.id;").format(sql.Identifier(SEQUENCE), table))
+    # ON CONFLICT (user_id, band_id) はこの主キーを使う。パーティションキーを含める必要がある
+    conn.execute(sql.SQL("ALTER TABLE {} ADD PRIMARY KEY (band_id, user_id);").format(table))
+    # user_id だけで引く処理 (アカウント削除など) のため
+    conn.execute(sql.SQL("CREATE INDEX ON {} (user_id);").format(table))
+
+    conn.execute(sql.SQL(
+      "CREATE TABLE schedules_defaults PARTITION OF {} FOR VALUES IN (0);"
+    ).format(table))
+    conn.execute(sql.SQL(
+      "CREATE TABLE schedules_bands PARTITION OF {} DEFAULT PARTITION BY HASH (band_id);"
+    ).format(table))
+    for remainder in range(partitions):
+      conn.execute(sql.SQL(
+        "CREATE TABLE {} PARTITION OF schedules_bands FOR VALUES WITH (MODULUS {}, REMAINDER {});"
+      ).format(
+        sql.Identifier(f"schedules_bands_p{remainder:02d}"),
+        sql.Literal(partitions), sql.Literal(remainder),
+      ))
+
+    conn.execute(MIRROR_FUNCTION_SQL)
+    conn.execute(sql.SQL(
+      "CREATE TRIGGER {0} AFTER INSERT OR UPDATE OR DELETE ON schedules "
+      "FOR EACH ROW EXECUTE FUNCTION {0}();"
+    ).format(sql.Identifier(TRIGGER)))
+    conn.commit()
+  print(f"{NEW_TABLE} を作成しました ({partitions} パーティション)。続けて copy を実行してください")
+
+
+def copy(batch_size: int, sleep: float) -> None:
+  """
+  既存の行をid順にコピーする。1バッチごとにコミットするので、長いロックは取らない。
+  コピー中の行は FOR KEY SHARE でロックするため、同時に削除された行が復活することはない。
+  トリガーで先に反映された行の方が新しいので、競合した場合はコピーしない。
+  """
+  columns = sql.SQL(", ").join(map(sql.Identifier, COLUMNS))
+  copy_sql = sql.SQL("""
+    WITH source AS (
+      SELECT {columns} FROM schedules
+      WHERE id > %s AND id <= %s
+      FOR KEY SHARE
+    )
+    INSERT INTO {table} ({columns})
+    SELECT {columns} FROM source
+    ON CONFLICT (band_id, user_id) DO NOTHING;
+  """).format(columns=columns, table=sql.Identifier(NEW_TABLE))
+
+  with connect(autocommit=True) as conn:
+    row = conn.execute("SELECT coalesce(min(id), 0), coalesce(max(id), 0) FROM schedules;").fetchone()
+    low, high = row[0] - 1, row[1]
+    copied = 0
+    started = time.monotonic()
+    while low < high:
+      upper = min(low + batch_size, high)
+      with conn.transaction():
+        copied += conn.execute(copy_sql, (low, upper)).rowcount
+      low = upper
+      print(f"\r{low}/{high} (コピー済み {copied} 行)", end="", flush=True)
+      if sleep:
+        time.sleep(sleep)
+  print(f"\nコピーが完了しました ({time.monotonic() - started:.1f} 秒)。続けて verify を実行してください")
+
+
+def checksums(conn: psycopg.Connection) -> tuple[tuple[int, int], tuple[int, int]]:
+  old = conn.execute(sql.SQL(CHECKSUM_SQL).format(table=sql.Identifier("schedules"))).fetchone()
+  new = conn.execute(sql.SQL(CHECKSUM_SQL).format(table=sql.Identifier(NEW_TABLE))).fetchone()
+  return tuple(old), tuple(new)
+
+
+def verify() -> bool:
+  with connect() as conn:
+    # 2つのテーブルを同じ時点で比較する
+    conn.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;")
+    old, new = checksums(conn)
+  print(f"schedules: {old[0]} 行 (checksum {old[1]})")
+  print(f"{NEW_TABLE}: {new[0]} 行 (checksum {new[1]})")
+  if old != new:
+    print("一致しません。copy をもう一度実行してください")
+    return False
+  print("一致しました。swap を実行できます")
+  return True
+
+
+def swap() -> None:
+  """テーブル名を入れ替える。ロックしている間は schedules への読み書きが待たされる"""
+  with connect() as conn:
+    conn.execute("SET LOCAL lock_timeout = '5s';")
+    conn.execute("LOCK TABLE schedules IN ACCESS EXCLUSIVE MODE;")
+    old, new = checksums(conn)
+    if old != new:
+      conn.rollback()
+      raise SystemExit("内容が一致しないため入れ替えを中止しました。copy と verify を実行してください")
+
+    old_sequence = conn.execute("SELECT pg_get_serial_sequence('schedules', 'id');").fetchone()[0]
+    conn.execute(sql.SQL("DROP TRIGGER {} ON schedules;").format(sql.Identifier(TRIGGER)))
+    conn.execute(sql.SQL("DROP FUNCTION {}();").format(sql.Identifier(TRIGGER)))
+    conn.execute(sql.SQL("ALTER TABLE schedules RENAME TO {};").format(sql.Identifier(OLD_TABLE)))
+    conn.execute(sql.SQL("ALTER TABLE {} RENAME TO schedules;").format(sql.Identifier(NEW_TABLE)))
+
+    # 新しいテーブルのidが、これまでに払い出したidと重ならないようにする
+    next_id = conn.execute("SELECT coalesce(max(id), 0) + 1 FROM schedules;").fetchone()[0]
+    if old_sequence:
+      next_id = max(next_id, conn.execute("SELECT nextval(%s);", (old_sequence,)).fetchone()[0])
+    conn.execute("SELECT setval(%s, %s, false);", (SEQUENCE, next_id))
+    conn.commit()
+  print(f"入れ替えました。元のテーブルは {OLD_TABLE} として残っています。確認後に cleanup を実行してください")
+
+
+def cleanup() -> None:
+  with connect() as conn:
+    conn.execute(sql.SQL("DROP TABLE {};").format(sql.Identifier(OLD_TABLE)))
+    conn.commit()
+  print(f"{OLD_TABLE} を削除しました")
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(
+    prog="python -m migrations.partition_schedules",
+    description="schedules テーブルをオンラインのままパーティション化する",
+  )
+  commands = parser.add_subparsers(dest="command", required=True)
+  prepare_parser = commands.add_parser("prepare")
+  prepare_parser.add_argument("--partitions", type=int, default=16, help="ハッシュパーティションの数")
+  copy_parser = commands.add_parser("copy")
+  copy_parser.add_argument("--batch-size", type=int, default=5000)
+  copy_parser.add_argument("--sleep", type=float, default=0.05, help="バッチごとの待ち時間(秒)")
+  commands.add_parser("verify")
+  commands.add_parser("swap")
+  commands.add_parser("cleanup")
+  args = parser.parse_args()
+
+  if args.command == "prepare":
+    prepare(args.partitions)
+  elif args.command == "copy":
+    copy(args.batch_size, args.sleep)
+  elif args.command == "verify":
+    raise SystemExit(0 if verify() else 1)
+  elif args.command == "swap":
+    swap()
+  elif args.command == "cleanup":
+    cleanup()
+
+
+if __name__ == "__main__":
+  main()
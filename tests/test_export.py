@@ -0,0 +1,43 @@
+"""エクスポートのストリーミング中にDBのエラーが起きたときの確認 (DBには接続しない)"""
+from datetime import date, time
+from unittest import mock
+
+import psycopg
+import pytest
+
+from App.app_init_ import create_app
+from App.db.band import Band
+from App.db.schedule import Schedule
+
+
+@pytest.fixture
+def client():
+  app = create_app()
+  app.secret_key = app.secret_key or "test"
+  client = app.test_client()
+  with client.session_transaction() as session:
+    session["_user_id"] = "member@example.invalid"
+    session["_fresh"] = True
+  return client
+
+
+def test_csv_export_is_not_truncated_silently(client):
+  band = Band(3, "band", 1, "token", date(2026, 1, 5), date(2026, 1, 6), time(9), time(10), False)
+  cursor = mock.MagicMock()
+  cursor.__enter__.return_value = cursor
+  cursor.__iter__.side_effect = lambda: _rows_then_error(Schedule(1, 7, 3, {}, ""))
+  conn = mock.MagicMock()
+  conn.__enter__.return_value = conn
+  conn.cursor.return_value = cursor
+
+  with mock.patch("App.Views.export._get_member_band", return_value=(band, {7: "member"})), \
+      mock.patch("App.db.schedule._get_read_connection", return_value=conn):
+    response = client.get("/band/export/availability.csv?token=token")
+    # 途中までの内容で正常に終わったように見せず、レスポンスの送信を中断する
+    with pytest.raises(psycopg.OperationalError):
+      response.get_data()
+
+
+def _rows_then_error(row):
+  yield row
+  raise psycopg.OperationalError("connection lost")
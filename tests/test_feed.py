@@ -0,0 +1,53 @@
+"""/feed/<token>.ics のトークンの検証と、DBのエラー時にキャッシュしないことの確認 (DBには接続しない)"""
+from datetime import date
+from unittest import mock
+
+import psycopg
+import pytest
+
+from App.app_init_ import create_app
+from App.db.cache import feed_cache
+from App.export import load_feed_token, make_feed_token
+
+
+@pytest.fixture
+def client():
+  app = create_app()
+  return app.test_client()
+
+
+def test_tokens_are_refused_without_secret_key(client):
+  with mock.patch("App.export.SECRET_KEY", None):
+    assert make_feed_token(7) is None
+    assert load_feed_token("Nw.forged") is None
+    assert client.get("/feed/Nw.forged.ics").status_code == 404
+
+
+def test_db_error_is_not_cached(client):
+  with mock.patch("App.export.SECRET_KEY", "test"), \
+      mock.patch("App.db.schedule._get_read_connection", side_effect=psycopg.OperationalError("down")), \
+      mock.patch.object(feed_cache, "put") as put:
+    response = client.get(f"/feed/{make_feed_token(7)}.ics")
+
+  assert response.status_code == 503
+  put.assert_not_called()
+
+
+def test_etag_is_stable_across_rebuilds(client):
+  rows = [{"band_id": 3, "name": "バンド", "schedule": {}}]
+  with mock.patch("App.export.SECRET_KEY", "test"), \
+      mock.patch("App.db.schedule.ScheduleDatabaseManager.get_feed_practices", return_value=rows):
+    first = client.get(f"/feed/{make_feed_token(7)}.ics")
+    second = client.get(f"/feed/{make_feed_token(7)}.ics")
+
+  assert first.status_code == 200
+  assert first.headers["ETag"] == second.headers["ETag"]
+
+
+def test_feed_is_not_cached_after_invalidation_during_read():
+  generation = feed_cache.begin()
+  feed_cache.invalidate_band(3)
+  with mock.patch("App.db.cache.bus") as bus:
+    bus.active = True
+    feed_cache.put(7, b"BEGIN:VCALENDAR", frozenset({3}), date.today(), generation)
+    assert feed_cache.get(7) is None
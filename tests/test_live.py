@@ -0,0 +1,19 @@
+"""バンドのページへの配信で、差分の基準になる内容をプライマリから読むことの確認 (DBには接続しない)"""
+from unittest import mock
+
+from App.db import base
+from App.live import BandBroadcaster
+
+
+def test_compute_reads_schedules_from_primary():
+  reads = []
+
+  def read_connection():
+    reads.append(base._primary_reads.get())
+    return mock.MagicMock()
+
+  with mock.patch("App.db.band.BandDatabaseManager.get_users", return_value=[]), \
+      mock.patch("App.db.schedule._get_read_connection", side_effect=read_connection):
+    BandBroadcaster()._compute(3)
+
+  assert reads == [True]
@@ -0,0 +1,88 @@
+"""/schedule-manage/save から、開いているバンドのページへの配信の予約までの確認 (DBには接続しない)"""
+from datetime import date, time
+from unittest import mock
+
+import pytest
+
+from App.app_init_ import create_app
+from App.db.band import Band
+from App.db.events import bus
+from App.db.user import User
+from App.live import broadcaster
+from App.ratelimit import Admission, save_limiter
+
+
+@pytest.fixture
+def client():
+  app = create_app()
+  app.secret_key = app.secret_key or "test"
+  client = app.test_client()
+  with client.session_transaction() as session:
+    session["_user_id"] = "member@example.invalid"
+    session["_fresh"] = True
+
+  with mock.patch("App.db.user.UserDatabaseManager.get_user", return_value=User(7, "member@example.invalid", "member")), \
+      mock.patch.object(save_limiter, "admit", return_value=Admission(True, 0.0, 3000)), \
+      mock.patch("App.db.schedule._get_connection"):
+    yield client
+
+
+@pytest.fixture
+def mark_dirty():
+  # /band/stream を開いたときと同じように、配信側をイベントの購読者にする
+  bus.subscribe(broadcaster._on_event)
+  try:
+    with mock.patch.object(broadcaster, "mark_dirty") as mark_dirty:
+      yield mark_dirty
+  finally:
+    with bus._lock:
+      bus._handlers = [entry for entry in bus._handlers if entry[0] != broadcaster._on_event]
+
+
+@pytest.mark.parametrize("partial", [True, False])
+def test_save_marks_band_dirty_with_int_id(client, mark_dirty, partial):
+  response = client.post("/schedule-manage/save", json={
+    "band_id": "3", "partial": partial, "schedule": {"2026-01-05": [1] * 24}, "comment": "",
+  })
+
+  assert response.status_code == 200
+  mark_dirty.assert_called_once_with(3)
+  assert type(mark_dirty.call_args.args[0]) is int
+
+
+def test_save_rejects_invalid_band_id(client, mark_dirty):
+  response = client.post("/schedule-manage/save", json={"band_id": "abc", "schedule": {}})
+
+  assert response.status_code == 400
+  mark_dirty.assert_not_called()
+
+
+@pytest.mark.parametrize("partial", [True, False])
+def test_save_to_archived_band_is_conflict(client, partial):
+  band = Band(3, "band", 1, "token", date(2026, 1, 1), date(2026, 1, 31), time(9), time(22), True)
+  with mock.patch("App.db.schedule.ScheduleDatabaseManager.merge_schedule", return_value=False), \
+      mock.patch("App.db.schedule.ScheduleDatabaseManager.update_schedule", return_value=None), \
+      mock.patch("App.db.band.BandDatabaseManager.get_band", return_value=band):
+    response = client.post("/schedule-manage/save", json={
+      "band_id": "3", "partial": partial, "schedule": {"2026-01-05": [1] * 24}, "comment": "",
+    })
+
+  assert response.status_code == 409
+
+
+def test_invalid_payload_does_not_use_save_admission(client):
+  response = client.post("/schedule-manage/save", json={"band_id": "3", "schedule": ["2026-01-05"]})
+
+  assert response.status_code == 400
+  save_limiter.admit.assert_not_called()
+
+
+def test_band_practice_save_to_archived_band_is_conflict(client):
+  active = Band(3, "band", 1, "token", date(2026, 1, 1), date(2026, 1, 31), time(9), time(22), False)
+  archived = Band(3, "band", 1, "token", date(2026, 1, 1), date(2026, 1, 31), time(9), time(22), True)
+  with mock.patch("App.db.band.BandDatabaseManager.get_bands", return_value=[active]), \
+      mock.patch("App.db.schedule.ScheduleDatabaseManager.update_schedule", return_value=None), \
+      mock.patch("App.db.band.BandDatabaseManager.get_band", return_value=archived):
+    response = client.post("/band-practice/save", json={"band_id": 3, "schedule": {"2026-01-05": [1] * 24}})
+
+  assert response.status_code == 409